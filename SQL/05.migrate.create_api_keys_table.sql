@@ -0,0 +1,16 @@
+CREATE TABLE "API_KEYS" (
+    "id" TEXT NOT NULL DEFAULT gen_random_uuid(),
+    "created_at" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "user_email" TEXT NOT NULL,
+    "name" TEXT NOT NULL,
+    "hashed_key" TEXT NOT NULL,  -- Only the SHA-256 of the key is stored, the key itself is shown once when it is created
+
+    CONSTRAINT "API_KEYS_PK" PRIMARY KEY ("id")
+);
+
+CREATE UNIQUE INDEX "API_KEYS_hashed_key_key" ON "API_KEYS"("hashed_key");
+CREATE INDEX "API_KEYS_user_email_idx" ON "API_KEYS"("user_email");
+
+ALTER TABLE "API_KEYS" ADD CONSTRAINT "API_KEYS_user_email_FK" FOREIGN KEY ("user_email") REFERENCES "APP_USERS"("email") ON DELETE CASCADE ON UPDATE CASCADE;
+
+GRANT ALL ON TABLE "API_KEYS" TO webtext2sql_app;
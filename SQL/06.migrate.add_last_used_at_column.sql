@@ -0,0 +1,11 @@
+ALTER TABLE "USER_CONNECTIONS"
+ADD COLUMN "last_used_at" TIMESTAMP(3);
+
+-- Connections never used count as used when they were created, so that the recent connections are ordered by the column alone
+UPDATE "USER_CONNECTIONS" SET "last_used_at" = "created_at" WHERE "last_used_at" IS NULL;
+
+ALTER TABLE "USER_CONNECTIONS"
+ALTER COLUMN "last_used_at" SET DEFAULT CURRENT_TIMESTAMP,
+ALTER COLUMN "last_used_at" SET NOT NULL;
+
+CREATE INDEX "USER_CONNECTIONS_user_email_last_used_at_idx" ON "USER_CONNECTIONS"("user_email", "last_used_at" DESC);
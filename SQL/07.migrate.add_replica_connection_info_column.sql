@@ -0,0 +1,2 @@
+ALTER TABLE "USER_CONNECTIONS"
+ADD COLUMN "replica_connection_info" JSONB NOT NULL DEFAULT '[]';  -- The host and port of each read replica, which share the rest of the TCP connection info
@@ -0,0 +1,20 @@
+CREATE TABLE "QUERY_WORKLOAD" (
+    "id" BIGINT GENERATED ALWAYS AS IDENTITY,
+    "executed_at" TIMESTAMP(3) NOT NULL,
+    "fingerprint" TEXT NOT NULL,  -- The hash of the normalized query, the same for the queries that only differ in their literals
+    "normalized_query" TEXT NOT NULL,
+    "connection_id" TEXT NOT NULL,  -- The identity of the database (and credentials) the query was executed on, not of a user connection
+    "db_schema" TEXT,
+    "duration_ms" DOUBLE PRECISION NOT NULL,
+    "row_count" INTEGER,
+    "byte_count" BIGINT,  -- Estimated, out of the text representation of the values
+    "error_class" TEXT,  -- The class of the error raised by the driver, if the query failed
+    "llm_latency_ms" DOUBLE PRECISION,  -- The time it took the AI model to generate (or repair) the query, if it did
+
+    CONSTRAINT "QUERY_WORKLOAD_PK" PRIMARY KEY ("id")
+);
+
+CREATE INDEX "QUERY_WORKLOAD_executed_at_idx" ON "QUERY_WORKLOAD"("executed_at");
+CREATE INDEX "QUERY_WORKLOAD_fingerprint_idx" ON "QUERY_WORKLOAD"("fingerprint");
+
+GRANT ALL ON TABLE "QUERY_WORKLOAD" TO webtext2sql_app;
@@ -0,0 +1,22 @@
+CREATE TABLE "USER_CONNECTION_THREADS" (
+    "connection_id" TEXT NOT NULL,
+    "thread_id" TEXT NOT NULL,
+    "created_at" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "USER_CONNECTION_THREADS_PK" PRIMARY KEY ("connection_id", "thread_id")
+);
+
+-- The primary key covers the lookups by connection, this index the cascades from the deleted threads
+CREATE INDEX "USER_CONNECTION_THREADS_thread_id_idx" ON "USER_CONNECTION_THREADS"("thread_id");
+
+ALTER TABLE "USER_CONNECTION_THREADS" ADD CONSTRAINT "USER_CONNECTION_THREADS_connection_id_FK" FOREIGN KEY ("connection_id") REFERENCES "USER_CONNECTIONS"("id") ON DELETE CASCADE ON UPDATE CASCADE;
+ALTER TABLE "USER_CONNECTION_THREADS" ADD CONSTRAINT "USER_CONNECTION_THREADS_thread_id_FK" FOREIGN KEY ("thread_id") REFERENCES "Thread"("id") ON DELETE CASCADE ON UPDATE CASCADE;
+
+-- The threads of the existing connections are the ones that used to be deleted along with them, i.e. those named after their server
+INSERT INTO "USER_CONNECTION_THREADS" ("connection_id", "thread_id")
+SELECT uc."id", t."id"
+FROM "USER_CONNECTIONS" uc
+JOIN "User" u ON u."identifier" = uc."user_email"
+JOIN "Thread" t ON t."userId" = u."id" AND t."name" LIKE '%' || uc."server_name" || '%';
+
+GRANT ALL ON TABLE "USER_CONNECTION_THREADS" TO webtext2sql_app;
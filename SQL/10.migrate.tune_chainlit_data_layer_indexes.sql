@@ -0,0 +1,12 @@
+-- The threads of a user are listed by their last update, paged by the update of the last thread of the previous page
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "Thread_userId_updatedAt_idx" ON "Thread"("userId", "updatedAt" DESC);
+
+-- The steps of a thread are read (when it is resumed) by "Step_threadId_startTime_endTime_idx", in the order of their start,
+-- so the index on the thread alone is redundant. The indexes below are not used by any query of the data layer,
+-- but are updated on every step written (about four per message), so they are dropped.
+-- "Step_parentId_idx" is kept for the cascading deletes of the children of a step.
+DROP INDEX CONCURRENTLY IF EXISTS "Step_threadId_idx";
+DROP INDEX CONCURRENTLY IF EXISTS "Step_startTime_idx";
+DROP INDEX CONCURRENTLY IF EXISTS "Step_endTime_idx";
+DROP INDEX CONCURRENTLY IF EXISTS "Step_type_idx";
+DROP INDEX CONCURRENTLY IF EXISTS "Step_name_idx";
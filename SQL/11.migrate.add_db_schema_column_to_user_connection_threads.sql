@@ -0,0 +1,2 @@
+ALTER TABLE "USER_CONNECTION_THREADS"
+ADD COLUMN "db_schema" TEXT;  -- The schema last selected in the thread, so that it can be resumed without choosing its connection and schema again
@@ -0,0 +1,7 @@
+-- "connection_id" held the identity of the database (and credentials) a query was executed on, shared by the user connections to it.
+-- It is kept as "connection_identity", and "connection_id" now holds the ID of the user connection (USER_CONNECTIONS) the query was executed through.
+ALTER TABLE "QUERY_WORKLOAD"
+RENAME COLUMN "connection_id" TO "connection_identity";
+
+ALTER TABLE "QUERY_WORKLOAD"
+ADD COLUMN "connection_id" TEXT;  -- NULL for the executions recorded before this migration
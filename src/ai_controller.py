@@ -1,9 +1,22 @@
+import functools
 import logging
 import os
+import time
+from typing import TYPE_CHECKING
 
-from openai import AsyncOpenAI
+import metrics
+import prompt_templates
+import scheduler
+import str_manipulation
+import workload
+from cache_backends import shared_cache
+from caching_configs import LLM_CACHE_TTL
 
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from openai.types import CompletionUsage
+
+    from db_controllers.base_db_controller import QueryExecutionError
 
 settings = {
     "model": "gpt-4o-mini",
@@ -12,30 +25,140 @@
 logger = logging.getLogger("webtext2sql")
 
 
-# This function cannot get a caching decorator because it is async and there is no async cache decorator in cachetools yet
-# Possibly, see https://pypi.org/project/asyncache/
-async def get_ai_response(prompt: str) -> str:
+@functools.cache
+def _get_client() -> "AsyncOpenAI":
+    """
+    Create the OpenAI client on first use, since importing `openai` takes a considerable part of the startup time.
+
+    Returns:
+        AsyncOpenAI: The OpenAI client, shared by all requests.
     """
-    Get a response from the AI model based on the provided prompt and settings.
+    from openai import AsyncOpenAI  # noqa: PLC0415
+
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+# Identical prompts (same question, schema and context) get the same response for a while, regardless of the worker serving them
+@shared_cache("ai_responses", ttl=LLM_CACHE_TTL, key=lambda messages: (settings["model"], messages))
+async def get_ai_response(messages: list[dict]) -> str:
+    """
+    Get a response from the AI model based on the provided messages and settings.
+    The token usage of each request is recorded, including how much of the prompt was served from the provider's prompt cache.
+    Requests that are not served from the cache are scheduled fairly among the users, see `scheduler.llm_scheduler`.
 
     Args:
-        prompt (str): The prompt to send to the AI model.
-        settings (dict): The settings for the AI model.
+        messages (list[dict]): The messages to send to the AI model, in the format of the chat completions API.
 
     Returns:
         str: The response from the AI model.
     """
-    logger.debug(f"Sending prompt to AI model: {prompt}")
-
-    # Send the prompt to the AI model and get the response
-    response = await client.chat.completions.create(
-        messages=[
-            {
-                "role": "user",
-                "content": prompt,
-            },
-        ],
-        **settings,
-    )
+    logger.debug(f"Sending messages to AI model: {messages}")
+
+    # Send the messages to the AI model and get the response
+    async with scheduler.llm_scheduler.slot():
+        response = await _get_client().chat.completions.create(
+            messages=messages,
+            **settings,
+        )
+
+    _record_usage(response.usage)
 
     return response.choices[0].message.content.strip()
+
+
+def _record_usage(usage: "CompletionUsage | None") -> None:
+    """
+    Record the token usage of a request to the AI model.
+
+    Args:
+        usage (CompletionUsage | None): The usage reported by the API, if any.
+    """
+    if usage is None:
+        return
+
+    cached_tokens = (usage.prompt_tokens_details.cached_tokens or 0) if usage.prompt_tokens_details else 0
+
+    metrics.increment("llm.requests")
+    metrics.increment("llm.prompt_tokens", usage.prompt_tokens)
+    metrics.increment("llm.cached_prompt_tokens", cached_tokens)
+    metrics.increment("llm.completion_tokens", usage.completion_tokens)
+    metrics.observe("llm.cached_prompt_ratio", cached_tokens / usage.prompt_tokens if usage.prompt_tokens else 0)
+
+    logger.info(f"AI model usage: {usage.prompt_tokens} prompt tokens ({cached_tokens} cached), {usage.completion_tokens} completion tokens")
+
+
+async def generate_sql_query(  # noqa: PLR0913
+    question: str,
+    db_type: str,
+    metadata: list[str],
+    schema: str,
+    context: list[dict] | None = None,
+    *,
+    column_profiles: str = "",
+    previous_results: str = "",
+) -> str:
+    """
+    Ask the AI model for the SQL query that answers a question about a database (or about the results of the previous questions).
+
+    Args:
+        question (str): The user's question, in natural language.
+        db_type (str): The type of the database ('mysql' or 'postgres').
+        metadata (list[str]): The database metadata.
+        schema (str): The database schema.
+        context (list[dict] | None): The previous questions and their SQL queries, if any.
+        column_profiles (str): The summary of the values of the columns, if any.
+        previous_results (str): The tables of the results kept in the session, if any, see `local_results`.
+
+    Returns:
+        str: The SQL query generated by the AI model.
+    """
+    messages = prompt_templates.build_sql_messages(
+        question,
+        db_type,
+        metadata,
+        schema,
+        context,
+        column_profiles=column_profiles,
+        previous_results=previous_results,
+    )
+
+    started = time.perf_counter()
+    response = await get_ai_response(messages)
+    # Recorded along with the executions of the query, see `workload`
+    workload.set_llm_latency((time.perf_counter() - started) * 1000)
+
+    logger.debug(f"AI's response: {response}")
+    return str_manipulation.extract_sql_only(response)
+
+
+async def repair_sql_query(question: str, error: "QueryExecutionError", db_type: str, metadata: list[str], schema: str) -> str:
+    """
+    Ask the AI model to fix a SQL query that the database failed to execute, given the error of the database.
+    Only the tables mentioned in the query or in the error are included in the prompt.
+
+    Args:
+        question (str): The user's question, in natural language.
+        error (QueryExecutionError): The error raised when executing the query.
+        db_type (str): The type of the database ('mysql' or 'postgres').
+        metadata (list[str]): The database metadata.
+        schema (str): The database schema.
+
+    Returns:
+        str: The fixed SQL query.
+    """
+    relevant_metadata = str_manipulation.select_relevant_tables(metadata, error.query, error.message)
+    messages = prompt_templates.build_repair_messages(
+        question,
+        error.query,
+        error.message,
+        db_type=db_type,
+        metadata=relevant_metadata,
+        schema=schema,
+    )
+
+    started = time.perf_counter()
+    response = await get_ai_response(messages)
+    workload.set_llm_latency((time.perf_counter() - started) * 1000)
+
+    logger.debug(f"AI's repaired query: {response}")
+    return str_manipulation.extract_sql_only(response)
@@ -0,0 +1,94 @@
+import csv
+import io
+import json
+import logging
+from collections.abc import Generator, Iterable
+from typing import Any
+
+from connection_pool import ConnectionPool
+
+logger: logging.Logger = logging.getLogger("webtext2sql")
+
+
+def get_metadata(pool: ConnectionPool, schema: str) -> list[str]:
+    """
+    Get the metadata of a schema through a controller of a pool.
+
+    Args:
+        pool (ConnectionPool): The pool of the connection.
+        schema (str): The database schema.
+
+    Returns:
+        list[str]: The database metadata.
+    """
+    with pool.lease() as db_controller:
+        return db_controller.get_db_metadata(schema=schema)
+
+
+def stream_results(pool: ConnectionPool, query: str) -> Generator[tuple[tuple[str], list[Any]]]:
+    """
+    Stream the results of a query through a controller of a pool, which stays leased until the results are exhausted.
+
+    Args:
+        pool (ConnectionPool): The pool of the connection.
+        query (str): The SQL query to execute.
+
+    Yields:
+        tuple[tuple[str], list[Any]]: The column names and the next batch of rows, as yielded by `stream_query`.
+    """
+    with pool.lease() as db_controller:
+        yield from db_controller.stream_query(query)
+
+
+def to_ndjson(sql_query: str, batches: Iterable[tuple[tuple[str], list[Any]]]) -> Generator[str]:
+    """
+    Format the streamed results of a query as newline-delimited JSON.
+    The first line holds the SQL query and the column names, each following line holds a row as an array of values
+    and the last line holds the number of rows.
+
+    Args:
+        sql_query (str): The SQL query of the results.
+        batches (Iterable[tuple[tuple[str], list[Any]]]): The column names and the rows of each batch.
+
+    Yields:
+        str: A chunk of lines per batch.
+    """
+    row_count = 0
+    header_written = False
+
+    for column_names, rows in batches:
+        chunk = ""
+        if not header_written:
+            chunk = json.dumps({"sql_query": sql_query, "columns": column_names}) + "\n"
+            header_written = True
+
+        # Dates, decimals etc. are written as strings
+        chunk += "".join(json.dumps(row, default=str) + "\n" for row in rows)
+        row_count += len(rows)
+        yield chunk
+
+    yield json.dumps({"row_count": row_count}) + "\n"
+
+
+def to_csv(batches: Iterable[tuple[tuple[str], list[Any]]]) -> Generator[str]:
+    """
+    Format the streamed results of a query as CSV, starting with a header of the column names.
+
+    Args:
+        batches (Iterable[tuple[tuple[str], list[Any]]]): The column names and the rows of each batch.
+
+    Yields:
+        str: A chunk of CSV lines per batch.
+    """
+    header_written = False
+
+    for column_names, rows in batches:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        if not header_written:
+            writer.writerow(column_names)
+            header_written = True
+
+        writer.writerows(rows)
+        yield buffer.getvalue()
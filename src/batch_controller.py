@@ -0,0 +1,224 @@
+import asyncio
+import csv
+import logging
+import re
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import ai_controller
+import column_profiler
+import query_repair
+import result_exports
+import scheduler
+import workload
+from connection_pool import ConnectionPool
+from db_controllers.base_db_controller import QueryExecutionError
+from execution_configs import BATCH_LLM_CONCURRENCY, BATCH_MAX_QUESTIONS, BATCH_POOL_SIZE
+
+logger: logging.Logger = logging.getLogger("webtext2sql")
+
+# Bullets ("-", "*", "•") and numbering ("1.", "2)") that analysts usually prefix their pasted questions with
+_LIST_MARKER = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+
+
+@dataclass
+class BatchAnswer:
+    """The outcome of a single question of a batch."""
+
+    question: str
+    sql_query: str | None = None
+    rows: int | None = None
+    file_name: str | None = None  # The name of the results' CSV in the archive
+    error: str | None = None
+
+
+def parse_questions(text: str) -> list[str]:
+    """
+    Split a pasted list of questions into the individual questions, one per non-empty line.
+
+    Args:
+        text (str): The pasted questions.
+
+    Returns:
+        list[str]: The questions, without any list markers.
+    """
+    questions = (_LIST_MARKER.sub("", line).strip() for line in text.splitlines())
+    return [question for question in questions if question]
+
+
+async def answer_questions(
+    conn_info: dict,
+    schema: str,
+    questions: list[str],
+    archive_path: Path,
+    *,
+    connection_id: str | None,
+) -> list[BatchAnswer]:
+    """
+    Answer a batch of questions against one schema and collect all the results into a ZIP archive.
+    The metadata is fetched once for the whole batch, the AI model is asked concurrently (up to `BATCH_LLM_CONCURRENCY` requests)
+    and the queries are executed through a pool of up to `BATCH_POOL_SIZE` connections.
+
+    The archive contains a `summary.csv` with the SQL query, the number of rows or the error of each question,
+    along with one CSV with the full results of each question that was answered.
+
+    Args:
+        conn_info (dict): The connection information.
+        schema (str): The database schema.
+        questions (list[str]): The questions to answer.
+        archive_path (Path): The path of the ZIP archive to write.
+        connection_id (str | None): The ID of the user connection, recorded with the executed queries.
+
+    Returns:
+        list[BatchAnswer]: The outcome of each question, in the order of the questions.
+
+    Raises:
+        ValueError: If there are no questions or more than `BATCH_MAX_QUESTIONS` of them.
+    """
+    if not questions or len(questions) > BATCH_MAX_QUESTIONS:
+        msg = f"A batch must contain between 1 and {BATCH_MAX_QUESTIONS} questions, got {len(questions)}."
+        raise ValueError(msg)
+
+    logger.debug(f"Answering a batch of {len(questions)} questions")
+
+    with ConnectionPool(conn_info, size=min(BATCH_POOL_SIZE, len(questions))) as pool, TemporaryDirectory() as work_dir:
+        metadata = await asyncio.to_thread(_get_metadata, pool, schema)
+        column_profiler.schedule_profiling(conn_info, schema)
+        column_profiles = await asyncio.to_thread(column_profiler.get_profile_summary, conn_info, schema)
+
+        # Waiting for a connection happens here rather than in a worker thread, so that the batch never occupies more threads than connections
+        llm_slots = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+        query_slots = asyncio.Semaphore(pool.size)
+
+        answers = await asyncio.gather(
+            *(
+                _answer_question(
+                    question,
+                    Path(work_dir) / f"{number:02d}.csv",
+                    pool=pool,
+                    llm_slots=llm_slots,
+                    query_slots=query_slots,
+                    db_type=conn_info["type_of_db"],
+                    metadata=metadata,
+                    schema=schema,
+                    connection_id=connection_id,
+                    column_profiles=column_profiles,
+                )
+                for number, question in enumerate(questions, start=1)
+            ),
+        )
+
+        await asyncio.to_thread(_write_archive, answers, Path(work_dir), archive_path)
+
+    logger.debug(f"Answered {sum(answer.error is None for answer in answers)} of {len(answers)} questions of the batch")
+    return answers
+
+
+async def _answer_question(  # noqa: PLR0913
+    question: str,
+    csv_path: Path,
+    *,
+    pool: ConnectionPool,
+    llm_slots: asyncio.Semaphore,
+    query_slots: asyncio.Semaphore,
+    db_type: str,
+    metadata: list[str],
+    schema: str,
+    connection_id: str | None,
+    column_profiles: str,
+) -> BatchAnswer:
+    """
+    Answer a single question of a batch, writing its full results to a CSV file.
+    Any failure is recorded in the answer, so that it does not fail the rest of the batch.
+
+    Args:
+        question (str): The question to answer.
+        csv_path (Path): The path of the CSV file to write the results to.
+        pool (ConnectionPool): The connection pool of the batch.
+        llm_slots (asyncio.Semaphore): Bounds the concurrent requests to the AI model.
+        query_slots (asyncio.Semaphore): Bounds the concurrently executed queries.
+        db_type (str): The type of the database.
+        metadata (list[str]): The database metadata.
+        schema (str): The database schema.
+        connection_id (str | None): The ID of the user connection, recorded with the executed queries.
+        column_profiles (str): The summary of the values of the columns of the schema.
+
+    Returns:
+        BatchAnswer: The outcome of the question.
+    """
+    # Each question runs in its own task, so the latency of the AI model recorded for its query is its own
+    workload.set_context(schema, connection_id)
+
+    async with llm_slots:
+        try:
+            sql_query = await ai_controller.generate_sql_query(question, db_type, metadata, schema, column_profiles=column_profiles)
+        except scheduler.SchedulerBusyError as e:
+            return BatchAnswer(question=question, error=str(e))
+        except Exception:
+            logger.exception(f"Failed to get the SQL query of the question: {question}")
+            return BatchAnswer(question=question, error="The AI model could not be reached.")
+
+    if not sql_query:
+        return BatchAnswer(question=question, error="The AI model did not return a valid SQL query.")
+
+    async def run_query(query: str) -> int:
+        # A slot is only held while executing, not while the AI model repairs a failed query
+        async with query_slots, scheduler.db_scheduler.slot():
+            return await asyncio.to_thread(_export_results, pool, query, csv_path)
+
+    try:
+        sql_query, rows = await query_repair.execute_with_repair(
+            run_query,
+            sql_query,
+            question=question,
+            db_type=db_type,
+            metadata=metadata,
+            schema=schema,
+        )
+    except QueryExecutionError as e:
+        return BatchAnswer(question=question, sql_query=e.query, error=e.message)
+    except Exception as e:
+        logger.exception(f"Failed to execute the SQL query of the question: {question}")
+        return BatchAnswer(question=question, sql_query=sql_query, error=str(e).strip())
+
+    return BatchAnswer(question=question, sql_query=sql_query, rows=rows, file_name=csv_path.name)
+
+
+def _get_metadata(pool: ConnectionPool, schema: str) -> list[str]:
+    with pool.lease() as db_controller:
+        return db_controller.get_db_metadata(schema=schema)
+
+
+def _export_results(pool: ConnectionPool, query: str, csv_path: Path) -> int:
+    with pool.lease() as db_controller:
+        return result_exports.write_csv(db_controller.stream_query(query), csv_path)
+
+
+def _write_archive(answers: list[BatchAnswer], work_dir: Path, archive_path: Path) -> None:
+    """
+    Write the summary and the results of a batch into a ZIP archive.
+
+    Args:
+        answers (list[BatchAnswer]): The outcome of each question.
+        work_dir (Path): The directory holding the CSV files of the results.
+        archive_path (Path): The path of the ZIP archive to write.
+    """
+    summary_path = work_dir / "summary.csv"
+
+    with summary_path.open("w", newline="", encoding="utf-8") as summary_file:
+        writer = csv.writer(summary_file)
+        writer.writerow(("number", "question", "sql_query", "rows", "results_file", "error"))
+        writer.writerows(
+            (number, answer.question, answer.sql_query, answer.rows, answer.file_name, answer.error) for number, answer in enumerate(answers, start=1)
+        )
+
+    archive_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.write(summary_path, arcname=summary_path.name)
+
+        for answer in answers:
+            if answer.file_name:
+                archive.write(work_dir / answer.file_name, arcname=answer.file_name)
@@ -0,0 +1,221 @@
+import functools
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import threading
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from typing import Any
+
+from cachetools import TLRUCache
+
+from caching_configs import SHARED_CACHE_MAX_SIZE
+
+logger = logging.getLogger("webtext2sql")
+
+KEY_PREFIX = "webtext2sql"
+
+# Returned by the backends on a cache miss, since None may be a valid cached value
+MISSING = object()
+
+
+class CacheBackend(ABC):
+    """
+    Base class for the backends of the caches and the state shared by the workers of the application.
+    Keys are strings and values are any picklable object.
+    A backend never raises on failure, it logs and behaves as a cache miss instead.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Any:  # noqa: ANN401
+        """
+        Retrieve the value stored under a key.
+
+        Args:
+            key (str): The key of the value.
+
+        Returns:
+            Any: The stored value, or MISSING if there is none (or it has expired).
+        """
+        msg = "This method should be implemented by subclasses."
+        raise NotImplementedError(msg)
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: int) -> None:  # noqa: ANN401
+        """
+        Store a value under a key for a limited time.
+
+        Args:
+            key (str): The key of the value.
+            value (Any): The value to store.
+            ttl (int): The number of seconds after which the value expires.
+        """
+        msg = "This method should be implemented by subclasses."
+        raise NotImplementedError(msg)
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """
+        Remove the value stored under a key, if any.
+
+        Args:
+            key (str): The key of the value.
+        """
+        msg = "This method should be implemented by subclasses."
+        raise NotImplementedError(msg)
+
+
+class InProcessCacheBackend(CacheBackend):
+    """Backend that keeps everything in the memory of the current process, i.e. nothing is shared between workers."""
+
+    def __init__(self, maxsize: int = SHARED_CACHE_MAX_SIZE) -> None:
+        # Each value is stored along with its TTL, so that every key can expire at a different time
+        self._cache: TLRUCache = TLRUCache(maxsize=maxsize, ttu=lambda _key, value, now: now + value[0])
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:  # noqa: ANN401
+        with self._lock:
+            entry = self._cache.get(key)
+
+        return MISSING if entry is None else entry[1]
+
+    def set(self, key: str, value: Any, ttl: int) -> None:  # noqa: ANN401
+        with self._lock:
+            self._cache[key] = (ttl, value)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._cache.pop(key, None)
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Backend that keeps everything in a server speaking the Redis protocol (Redis, Valkey, KeyDB etc.),
+    so that all the workers and nodes of the application share it.
+    """
+
+    def __init__(self, url: str) -> None:
+        import redis  # noqa: PLC0415 # Only needed when a Redis backend is configured
+
+        self._redis_error = redis.RedisError
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Any:  # noqa: ANN401
+        try:
+            payload = self._client.get(key)
+        except self._redis_error:
+            logger.exception(f"Failed to read key {key} from the cache backend")
+            return MISSING
+
+        # The backend only holds what the application itself has written
+        return MISSING if payload is None else pickle.loads(payload)  # noqa: S301
+
+    def set(self, key: str, value: Any, ttl: int) -> None:  # noqa: ANN401
+        try:
+            self._client.set(key, pickle.dumps(value), ex=ttl)
+        except self._redis_error:
+            logger.exception(f"Failed to write key {key} to the cache backend")
+
+    def delete(self, key: str) -> None:
+        try:
+            self._client.delete(key)
+        except self._redis_error:
+            logger.exception(f"Failed to delete key {key} from the cache backend")
+
+
+@functools.cache
+def get_cache_backend() -> CacheBackend:
+    """
+    Get the cache backend of the application, as configured by the `CACHE_BACKEND_URL` environment variable.
+    A `redis://` (or `rediss://`) URL selects the Redis backend, otherwise the in-process backend is used.
+
+    Returns:
+        CacheBackend: The cache backend, shared by the whole process.
+    """
+    url = os.getenv("CACHE_BACKEND_URL")
+
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        logger.info("Using the Redis cache backend")
+        return RedisCacheBackend(url)
+
+    logger.info("Using the in-process cache backend")
+    return InProcessCacheBackend()
+
+
+def make_key(namespace: str, *parts: Any) -> str:  # noqa: ANN401
+    """
+    Build a backend key out of a namespace and any number of parts.
+    The parts are hashed, so that arbitrarily long values (e.g. prompts) make keys of a fixed size.
+
+    Args:
+        namespace (str): The namespace of the key, e.g. the name of the cached function.
+        *parts: The values that identify the entry within the namespace.
+
+    Returns:
+        str: The backend key.
+    """
+    digest = hashlib.sha256(repr(parts).encode()).hexdigest()
+    return f"{KEY_PREFIX}:{namespace}:{digest}"
+
+
+def shared_cache(
+    namespace: str,
+    ttl: int,
+    key: Callable[..., tuple],
+    condition: Callable[[Any], bool] | None = None,
+) -> Callable[[Callable], Callable]:
+    """
+    Cache the results of a function (sync or async) in the cache backend, so that all workers share them.
+    Unlike `cachetools.func.ttl_cache`, the key is built explicitly, so that e.g. a method can be keyed by
+    the identity of the connection rather than by the (short-lived) instance it is called on.
+
+    Args:
+        namespace (str): The namespace of the cache entries.
+        ttl (int): The number of seconds after which an entry expires.
+        key (Callable[..., tuple]): Builds the parts of the key out of the arguments of the function.
+        condition (Callable[[Any], bool] | None): Decides whether a result should be cached, all results are by default.
+
+    Returns:
+        Callable[[Callable], Callable]: The decorator.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:  # noqa: ANN401
+                backend = get_cache_backend()
+                cache_key = make_key(namespace, *key(*args, **kwargs))
+
+                cached = backend.get(cache_key)
+                if cached is not MISSING:
+                    logger.debug(f"Cache hit for {namespace}")
+                    return cached
+
+                result = await func(*args, **kwargs)
+                if condition is None or condition(result):
+                    backend.set(cache_key, result, ttl)
+                return result
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:  # noqa: ANN401
+            backend = get_cache_backend()
+            cache_key = make_key(namespace, *key(*args, **kwargs))
+
+            cached = backend.get(cache_key)
+            if cached is not MISSING:
+                logger.debug(f"Cache hit for {namespace}")
+                return cached
+
+            result = func(*args, **kwargs)
+            if condition is None or condition(result):
+                backend.set(cache_key, result, ttl)
+            return result
+
+        return wrapper
+
+    return decorator
@@ -1,2 +1,9 @@
 CACHE_TTL = 60  # Cache TTL in seconds
 CACHE_MAX_SIZE = 128  # Maximum size of elements in the cache
+SHARED_CACHE_MAX_SIZE = 4096  # Maximum size of elements in the in-process shared cache backend
+LLM_CACHE_TTL = 60 * 60  # Cache TTL of the AI model's responses in seconds
+RESULTS_CACHE_TTL = 10  # Cache TTL of query results in seconds
+SESSION_STATE_TTL = 60 * 60 * 24  # TTL of the session state mirrored to the shared backend in seconds (same as the login cookie)
+SCHEMAS_CACHE_TTL = 60 * 60 * 24  # TTL of the cached schema list of a connection in seconds
+SCHEMAS_REFRESH_AFTER = 60  # Age in seconds after which a cached schema list is refreshed in the background (while still being served)
+METADATA_STORE_TTL = 60 * 60 * 24  # TTL of the stored DDL of each table in seconds, which is otherwise only introspected again when the table changes
@@ -1,3 +1,4 @@
+import functools
 import os
 
 import chainlit as cl
@@ -14,13 +15,32 @@
 
 
 import chainlit_controller
+import context_builder
+import data_layer
+import local_results
+import query_repair
+import scheduler
 import str_manipulation
+import warmup
+import workload
+from db_controllers.base_db_controller import QueryExecutionError
+from execution_configs import SCHEDULER_BATCH_WEIGHT
 from main import COOKIE_NAME, serializer
 from user_controllers import app_users
 
 load_dotenv()
 
-cl.instrument_openai()
+
+@functools.cache
+def _instrument_openai() -> None:
+    """Instrument the OpenAI client on first use instead of at import time, since it has to import `openai`."""
+    cl.instrument_openai()
+
+
+@cl.data_layer
+def get_data_layer() -> data_layer.TunedDataLayer:
+    """Persist the chat history in the app database, through Chainlit's data layer tuned for the writes of every message."""
+    return data_layer.TunedDataLayer(os.getenv("DATABASE_URL"), storage_client=data_layer.get_storage_client())
 
 
 @cl.header_auth_callback
@@ -57,6 +77,9 @@ def auth_from_header(headers: dict) -> None | cl.User:
                 logger.warning(f"User {email} not found in the database.")
                 return None
 
+            # Open the user's most recently used connections in the background, so that they are ready by the time they choose one
+            warmup.schedule_warmup(email)
+
             return cl.User(
                 identifier=email,
                 metadata={
@@ -89,11 +112,39 @@ async def on_chat_resume(thread: ThreadDict) -> None:
     Handle the event when a chat is resumed.
     This function is triggered when a user resumes a chat session.
 
+    The connection and the schema the thread was used with are restored, so that the user can carry on asking questions,
+    otherwise (e.g. if no connection was ever chosen in it) the user is asked to choose them again.
+
     Args:
         thread: The thread object representing the chat session.
     """
     logger.debug(f"Chat resumed: {thread['id']} by User: {thread['userId']}")
 
+    if not await chainlit_controller.restore_thread_binding():
+        await chainlit_controller.new_connection_reconnect_or_delete_connection()
+
+
+@cl.on_chat_end
+async def on_chat_end() -> None:
+    """
+    Handle the event when a chat session ends.
+    This function is triggered when the user disconnects or opens another chat,
+    so any query still running for this session is abandoned and gets cancelled.
+    """
+    await chainlit_controller.cancel_running_query()
+
+    # The results kept for the follow-up questions of the session are not needed anymore
+    local_results.drop_session(cl.context.session.id)
+
+
+@cl.on_stop
+async def on_stop() -> None:
+    """
+    Handle the event when the user stops the current task.
+    The query of the stopped task is cancelled so that it does not keep running on the database server.
+    """
+    await chainlit_controller.cancel_running_query()
+
 
 @cl.on_chat_start
 async def new_thread_opened() -> None:
@@ -105,6 +156,7 @@ async def new_thread_opened() -> None:
         thread: The thread object representing the chat session.
     """
     logger.debug(f"Chat started by User: {cl.user_session.get('user').identifier}")
+    warmup.schedule_warmup(cl.user_session.get("user").identifier)
     await chainlit_controller.new_connection_reconnect_or_delete_connection()
 
 
@@ -119,10 +171,21 @@ async def handle_message(message: cl.Message) -> None:
     """
     logger.debug(f"Received message: {message.content}")
 
+    # The requests to the AI model and the queries of the message are scheduled fairly among the users
+    scheduler.set_current_user(cl.user_session.get("user").identifier)
+
+    # A new message supersedes any query that is still running for a previous one
+    await chainlit_controller.cancel_running_query()
+
+    # Chainlit names a new thread after its first message, so the name tracked in the session may no longer be current
+    cl.user_session.set("thread_name", None)
+
     conn_info = chainlit_controller.get_user_connection_info()
-    schema = cl.user_session.get("curr_db_schema")
+    schema = chainlit_controller.get_session_state("curr_db_schema")
+    workload.set_context(schema, chainlit_controller.get_session_state("curr_conn_id"))
 
-    db_controller, metadata, tunnel = chainlit_controller.get_db_controller_and_metadata(conn_info, schema)
+    # The connection is leased from the shared pool of this worker, warmed up when the chat started or was resumed
+    metadata = await chainlit_controller.get_metadata(conn_info, schema)
 
     db_engine = create_engine(os.getenv("DATABASE_URL"))
     with Session(db_engine) as session:
@@ -131,35 +194,91 @@ async def handle_message(message: cl.Message) -> None:
             session,
         )
 
-    context = None
-
-    if (  # Check if the chat context is not empty, it is not the start of a new conversation and the user is allowed to use chat context
-        allowed
-        and cl.chat_context.to_openai()
-        and cl.chat_context.to_openai()[-2]
-        and not cl.chat_context.to_openai()[-2]["content"].startswith("You have selected the schema:")
-    ):
-        context = cl.chat_context.to_openai()[-11:-1]  # Include up to 10 previous messages, omit the latest
-
-    sql_query = await chainlit_controller.get_ai_sql_query(
-        message,
-        conn_info,
-        metadata,
-        schema,
-        context,
-    )
-
-    if not sql_query:
-        logger.error("The AI model did not return a valid SQL query.")
-        await cl.Message(content="The AI model did not return a valid SQL query.").send()
+    # The history is built once, and only its questions and SQL queries (not the results) are kept, within a token budget
+    context = context_builder.build_context(cl.chat_context.to_openai()[:-1]) if allowed else None  # Omit the latest message
+
+    _instrument_openai()
+
+    try:
+        sql_query = await chainlit_controller.get_ai_sql_query(
+            message,
+            conn_info,
+            metadata,
+            schema,
+            context,
+        )
+
+        # A follow-up question may be answered in-process from the results of the previous ones, without querying the database
+        local_preview = None
+        if local_results.is_local_query(sql_query):
+            local_preview = await chainlit_controller.execute_local_query(sql_query)
+            if local_preview is None:
+                sql_query = await chainlit_controller.get_ai_sql_query(message, conn_info, metadata, schema, context, previous_results=False)
+
+        if not sql_query:
+            logger.error("The AI model did not return a valid SQL query.")
+            await cl.Message(content="The AI model did not return a valid SQL query.").send()
+            return
+
+        if local_preview is None:
+            # Only the rows shown to the user (or kept for the follow-up questions) are fetched, the full results are produced on demand.
+            # A query that the database rejects is sent back to the AI model to be fixed, along with the error.
+            sql_query, preview = await query_repair.execute_with_repair(
+                lambda query: chainlit_controller.execute_query_preview(conn_info, query),
+                sql_query,
+                question=message.content,
+                db_type=conn_info["type_of_db"],
+                metadata=metadata,
+                schema=schema,
+            )
+        else:
+            preview = local_preview
+    except QueryExecutionError as e:
+        await cl.Message(content=str_manipulation.form_error_answer(e)).send()
+        return
+    except scheduler.SchedulerBusyError as e:
+        await cl.Message(content=str(e)).send()
         return
 
-    results, col_names = db_controller.execute_query(sql_query)
+    await chainlit_controller.keep_results(message.content, sql_query, preview)
+    results, col_names, has_more = preview
+
+    # The rows fetched beyond the ones shown were only fetched to be kept, the full results of the database are produced on demand
+    if local_preview is None and len(results) > str_manipulation.MAX_RESULT_ROWS:
+        results, has_more = results[: str_manipulation.MAX_RESULT_ROWS], True
+
+    answer, elements = str_manipulation.form_answer(results, col_names, sql_query, has_more=has_more, downloadable=local_preview is None)
+    # The results of the previous questions are only kept in the session, so a query over them cannot be executed again
+    actions = chainlit_controller.create_full_results_actions(sql_query) if has_more and local_preview is None else []
 
-    if tunnel:
-        tunnel.stop()
-        logger.debug("SSH tunnel closed")
+    await cl.Message(content=answer, elements=elements, actions=actions).send()
 
-    answer, elements = str_manipulation.form_answer(results, col_names, sql_query)
 
-    await cl.Message(content=answer, elements=elements).send()
+@cl.action_callback("batch_questions")
+async def batch_questions(_: cl.Action) -> None:
+    """
+    Handle the batch question mode.
+    This function is triggered when the user clicks the "Ask a batch of questions" button after selecting a schema.
+    """
+    _instrument_openai()
+
+    # The questions of a batch get a smaller share of the capacity than the questions asked in the chat
+    scheduler.set_current_user(cl.user_session.get("user").identifier, weight=SCHEDULER_BATCH_WEIGHT)
+    await chainlit_controller.handle_batch_questions()
+
+
+@cl.action_callback("download_full_csv")
+@cl.action_callback("download_full_parquet")
+@cl.action_callback("download_full_arrow")
+async def download_full_results(action: cl.Action) -> None:
+    """
+    Handle the download of the full results of a previewed query.
+    This function is triggered when the user clicks one of the "Download full ..." buttons of a message.
+
+    Args:
+        action (cl.Action): The action clicked, whose payload contains the ID of the previewed query.
+    """
+    export_format = action.name.removeprefix("download_full_")
+    scheduler.set_current_user(cl.user_session.get("user").identifier)
+    workload.set_context(chainlit_controller.get_session_state("curr_db_schema"), chainlit_controller.get_session_state("curr_conn_id"))
+    await chainlit_controller.send_full_results(action.payload.get("value"), export_format)
@@ -1,19 +1,34 @@
+import asyncio
+import functools
 import logging
 import os
-from copy import deepcopy
-from typing import TYPE_CHECKING
+import uuid
+from collections.abc import AsyncGenerator, Callable, Iterable
+from contextlib import AbstractContextManager, asynccontextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
 
 import chainlit as cl
-import chainlit.data as cl_data
 from sqlmodel import Session, create_engine
-from sshtunnel import SSHTunnelForwarder
 
 import ai_controller
+import batch_controller
+import cache_backends
+import column_profiler
 import connection_controller
+import connection_pool
+import context_builder
+import local_results
+import replica_router
+import result_exports
+import scheduler
+import schema_cache
 import str_manipulation
-from connection_factory import get_db_controller
-from db_controllers.base_db_controller import BaseDBController
-from user_controllers import user_connections
+import warmup
+from caching_configs import SESSION_STATE_TTL
+from db_controllers.base_db_controller import BaseDBController, QueryExecutionError
+from execution_configs import BATCH_MAX_QUESTIONS, LOCAL_RESULTS_MAX_ROWS
+from user_controllers import threads, user_connections
 from user_controllers.user_connections import UserConnection
 
 if TYPE_CHECKING:
@@ -22,15 +37,61 @@
 
 logger: logging.Logger = logging.getLogger("webtext2sql")
 
+FULL_RESULTS_HISTORY = 20  # Number of previewed queries per session whose full results can still be downloaded
+
+
+def set_session_state(key: str, value: Any) -> None:  # noqa: ANN401
+    """
+    Set a value in the user session and mirror it to the shared cache backend,
+    so that the chat can carry on if it reconnects to another worker.
+
+    Args:
+        key (str): The key of the value.
+        value (Any): The value to set, it must be picklable.
+    """
+    cl.user_session.set(key, value)
+
+    backend_key = cache_backends.make_key("session", cl.context.session.thread_id, key)
+    cache_backends.get_cache_backend().set(backend_key, value, SESSION_STATE_TTL)
+
+
+def get_session_state(key: str) -> Any:  # noqa: ANN401
+    """
+    Get a value set with `set_session_state`, restoring it from the shared cache backend if it is missing from the user session.
+
+    Args:
+        key (str): The key of the value.
+
+    Returns:
+        Any: The value, or None if it has not been set.
+    """
+    value = cl.user_session.get(key)
+    if value is not None:
+        return value
+
+    backend_key = cache_backends.make_key("session", cl.context.session.thread_id, key)
+    value = cache_backends.get_cache_backend().get(backend_key)
+    if value is cache_backends.MISSING:
+        return None
+
+    cl.user_session.set(key, value)
+    return value
+
 
 def get_user_connection_info() -> dict:
     """
     Retrieve the connection information for the current user.
+    If it is missing from the user session (e.g. the chat has reconnected to another worker), it is read again from the app database,
+    out of the connection ID mirrored to the shared cache backend, see `set_user_connection_info`.
 
     Returns:
         dict: Connection information including host, port, database, user, and password.
     """
-    conn_info: dict = cl.user_session.get("curr_conn_info")
+    conn_info: dict | None = cl.user_session.get("curr_conn_info")
+    if not conn_info:
+        conn_info = _get_conn_info_by_id(get_session_state("curr_conn_id"), cl.user_session.get("user").identifier)
+        cl.user_session.set("curr_conn_info", conn_info)
+
     if not conn_info:
         logger.error("No connection info found for the user.")
         return {}
@@ -38,6 +99,29 @@ def get_user_connection_info() -> dict:
     return conn_info
 
 
+def set_user_connection_info(conn_info: dict) -> None:
+    """
+    Set the connection information of the current user in the user session.
+    Unlike the session state, it is not mirrored to the shared cache backend, since it holds the credentials of the connection.
+    Only the ID of the connection (`curr_conn_id`) is, out of which the connection information is read again on another worker.
+
+    Args:
+        conn_info (dict): The connection information.
+    """
+    cl.user_session.set("curr_conn_info", conn_info)
+
+
+def _get_conn_info_by_id(connection_id: str | None, user_email: str) -> dict | None:
+    if not connection_id:
+        return None
+
+    db_engine = create_engine(os.getenv("DATABASE_URL"))
+    with Session(db_engine) as session:
+        user_connection = user_connections.get_user_connection_by_id(connection_id, user_email, session)
+
+    return user_connections.get_conn_info(user_connection) if user_connection else None
+
+
 def get_available_schemas_for_curr_server() -> list[str]:
     """
     Retrieve the names of all database schemas available to the current user.
@@ -50,36 +134,8 @@ def get_available_schemas_for_curr_server() -> list[str]:
         logger.error("No connection info found for the user.")
         return []
 
-    available_dbs = []
-
-    conn_details = deepcopy(conn_info)
-
-    if conn_info.get("type") == "ssh":
-        tunnel = SSHTunnelForwarder(
-            ssh_address_or_host=(conn_info["ssh"]["ssh_host"], conn_info["ssh"]["ssh_port"]),
-            ssh_username=conn_info["ssh"]["ssh_user"],
-            ssh_password=conn_info["ssh"]["ssh_password"],
-            remote_bind_address=(conn_info["tcp"]["host"], conn_info["tcp"]["port"]),
-            local_bind_address=("127.0.0.1", 0),  # Let OS pick a free local port
-            logger=logger,
-        )
-        tunnel.start()
-
-        conn_details["tcp"]["host"] = "127.0.0.1"
-        conn_details["tcp"]["port"] = tunnel.local_bind_port
-
-    # Get the database controller for the current connection type
-    db_controller = get_db_controller(
-        db_type=conn_info["type_of_db"],
-        tcp_details=conn_details["tcp"],
-    )
-    # Get the available schemas from the database controller
-    available_dbs = db_controller.get_available_dbs()
-
-    if conn_info.get("type") == "ssh":
-        tunnel.stop()
-
-    return available_dbs
+    # The schema list may have already been fetched in advance, when the user logged in or tested the connection
+    return schema_cache.get_available_schemas(conn_info)
 
 
 async def new_connection_reconnect_or_delete_connection() -> None:
@@ -177,13 +233,87 @@ async def handle_db_selection() -> None:
         server_name: str = selected_conn_info.pop("server_name")
 
         # Step 3: Set the selected connection info as a context variable for this user
-        cl.user_session.set("curr_conn_info", selected_conn_info)
+        set_user_connection_info(selected_conn_info)
+
+        # The most recently used connections are the ones opened in advance the next time the user logs in
+        db_engine = create_engine(os.getenv("DATABASE_URL"))
+        with Session(db_engine) as session:
+            user_connections.mark_user_connection_used(server_name, cl.user_session.get("user").identifier, session)
 
         # Change the current thread name to reflect the current connection
         thread_name = f"{server_name} - {selected_conn_info['tcp'].get('user', 'unknown_user')}"
         await change_thread_name(thread_name)
 
+        # The thread exists in the data layer once it has been named, so it can be bound to the connection
+        with Session(db_engine) as session:
+            user_connection = user_connections.get_user_connection_by_server_name(server_name, cl.user_session.get("user").identifier, session)
+        if user_connection:
+            set_session_state("curr_conn_id", str(user_connection.id))
+            await asyncio.to_thread(_bind_thread_to_connection, str(user_connection.id), cl.context.session.thread_id)
+
+        await handle_schema_selection()
+
+
+async def restore_thread_binding() -> bool:
+    """
+    Restore the connection and the schema of a resumed thread, so that the user can carry on asking questions right away.
+    The connection ID and the schema mirrored to the shared cache backend are used if they are still there, otherwise the binding
+    recorded in the app database. The metadata of the schema is then fetched in the background, through the shared pool of the connection,
+    so that the first question after resuming finds it cached. If no schema was selected in the thread, the user is asked for one.
+
+    Returns:
+        bool: True if the connection of the thread was restored, False if the thread is not bound to any connection of the user.
+    """
+    user_email = cl.user_session.get("user").identifier
+    schema = get_session_state("curr_db_schema")
+    conn_info = await asyncio.to_thread(_get_conn_info_by_id, get_session_state("curr_conn_id"), user_email) if schema else None
+
+    if not conn_info:
+        binding = await asyncio.to_thread(_get_thread_binding, cl.context.session.thread_id, user_email)
+        if binding is None:
+            return False
+
+        user_connection, schema = binding
+        conn_info = user_connections.get_conn_info(user_connection)
+        set_session_state("curr_conn_id", str(user_connection.id))
+
+    set_user_connection_info(conn_info)
+
+    if not schema:
         await handle_schema_selection()
+        return True
+
+    set_session_state("curr_db_schema", schema)
+
+    logger.debug(f"Restored the schema {schema} of the resumed thread: {cl.context.session.thread_id}")
+    warmup.schedule_schema_warmup(conn_info, schema)
+    return True
+
+
+def _get_thread_binding(thread_id: str, user_email: str) -> tuple[UserConnection, str | None] | None:
+    db_engine = create_engine(os.getenv("DATABASE_URL"))
+
+    with Session(db_engine) as session:
+        return user_connections.get_thread_binding(thread_id, user_email, session)
+
+
+def _bind_thread_to_connection(connection_id: str, thread_id: str, db_schema: str | None = None) -> None:
+    """
+    Bind a thread to a connection (and the schema selected in it), so that it is deleted along with the connection
+    and resumed with it. A failure is only logged, since the thread can still be used.
+
+    Args:
+        connection_id (str): The ID of the connection.
+        thread_id (str): The ID of the thread.
+        db_schema (str | None): The schema selected in the thread, or None to keep the one recorded (if any).
+    """
+    db_engine = create_engine(os.getenv("DATABASE_URL"))
+
+    try:
+        with Session(db_engine) as session:
+            user_connections.bind_thread_to_connection(connection_id, thread_id, session, db_schema=db_schema)
+    except Exception:
+        logger.exception(f"Failed to bind the thread to the connection: {connection_id}")
 
 
 async def _get_db_buttons_of_user_connections() -> list[cl.Action]:
@@ -199,15 +329,7 @@ async def _get_db_buttons_of_user_connections() -> list[cl.Action]:
     db_btns: list[cl.Action] = [
         cl.Action(
             name=f"{conn.server_name}",
-            payload={
-                "value": {
-                    "type": "ssh" if conn.ssh_connection_info else "tcp",
-                    "ssh": conn.ssh_connection_info,
-                    "tcp": conn.tcp_connection_info,
-                    "type_of_db": conn.type_of_db,
-                    "server_name": conn.server_name,
-                },
-            },
+            payload={"value": {**user_connections.get_conn_info(conn), "server_name": conn.server_name}},
             label=f"{conn.server_name}",
         )
         for conn in user_connections_list
@@ -275,6 +397,13 @@ async def ask_and_store_connection_details(connection_type: str) -> bool:
     elif connection_type == "tcp":
         conn_info["tcp"], conn_info["type_of_db"], connection_name = await ask_for_the_tcp_connection_info()
 
+        # SSH tunnels are bound to the host of the primary, so only direct connections can have read replicas
+        try:
+            conn_info["replicas"] = await ask_for_the_replicas()
+        except ValueError as e:
+            await cl.Message(content=f"{e}. Please try again.").send()
+            return False
+
     can_establish_connection: bool = connection_controller.try_establish_connection(conn_info)
 
     if not can_establish_connection:
@@ -282,7 +411,7 @@ async def ask_and_store_connection_details(connection_type: str) -> bool:
         return False
 
     # Save the connection info in the user session
-    cl.user_session.set("curr_conn_info", conn_info)
+    set_user_connection_info(conn_info)
 
     # Change the current thread name to reflect the current connection
     server_name = connection_name if connection_name else conn_info["tcp"].get("host")
@@ -295,16 +424,21 @@ async def ask_and_store_connection_details(connection_type: str) -> bool:
     db_engine = create_engine(os.getenv("DATABASE_URL"))
 
     with Session(db_engine) as session:
-        user_connections.insert_user_connection(
+        user_connection = user_connections.insert_user_connection(
             user_connection=UserConnection(
                 user_email=cl.user_session.get("user").identifier,
                 server_name=server_name,
                 ssh_connection_info=conn_info["ssh"] if connection_type == "ssh" else {},
                 tcp_connection_info=conn_info["tcp"],
+                replica_connection_info=conn_info.get("replicas", []),
                 type_of_db=conn_info["type_of_db"],
             ),
             session=session,
         )
+        connection_id = str(user_connection.id)
+
+    set_session_state("curr_conn_id", connection_id)
+    await asyncio.to_thread(_bind_thread_to_connection, connection_id, cl.context.session.thread_id)
 
     await cl.Message(content="Connection established successfully!").send()
     return True
@@ -315,7 +449,7 @@ async def handle_schema_selection() -> None:
     # Get the list of available database schemas from the database controller
     db_list = get_available_schemas_for_curr_server()
     if not db_list:
-        logger.error(f"No database schemas found for the user: {cl.user_session.get('curr_conn_info').get('tcp', {}).get('user')}")
+        logger.error(f"No database schemas found for the user: {get_user_connection_info().get('tcp', {}).get('user')}")
         await cl.Message(content="No database schemas found for you on this database server. Please try again.").send()
         return
 
@@ -340,14 +474,26 @@ async def handle_schema_selection() -> None:
     schema_to_work_with = res.get("payload").get("value")
     if schema_to_work_with:
         # Step 3: Set the selected schema as a context variable for this user
-        cl.user_session.set("curr_db_schema", schema_to_work_with)
+        set_session_state("curr_db_schema", schema_to_work_with)
+
+        # The schema is recorded along with the binding of the thread, so that the thread is resumed with it
+        connection_id = get_session_state("curr_conn_id")
+        if connection_id:
+            await asyncio.to_thread(_bind_thread_to_connection, connection_id, cl.context.session.thread_id, schema_to_work_with)
 
         # Change the current thread name to reflect the current schema
         await append_schema_to_thread_name(schema_to_work_with)
 
         # Step 4: Send a message to the user confirming the selection
         await cl.Message(
-            content=f"You have selected the schema: \n**{schema_to_work_with}**\n\nNow you can ask me any question about this database, and I will provide you with the SQL query to get the answer.",
+            content=f"{context_builder.SCHEMA_SELECTED_PREFIX} \n**{schema_to_work_with}**\n\nNow you can ask me any question about this database, and I will provide you with the SQL query to get the answer.",
+            actions=[
+                cl.Action(
+                    name="batch_questions",
+                    payload={"value": "batch_questions"},
+                    label="Ask a batch of questions",
+                ),
+            ],
         ).send()
     else:
         await cl.Message(content="No database selected. Please choose a database to work with.").send()
@@ -454,6 +600,27 @@ async def ask_for_the_tcp_connection_info() -> tuple[dict, str, str]:
     return tcp_info, type_of_db, connection_name
 
 
+async def ask_for_the_replicas() -> list[dict]:
+    """
+    Ask the user for the read replicas of the database, which the queries are routed to instead of the primary.
+
+    Returns:
+        list[dict]: The host and port of each replica, if any.
+
+    Raises:
+        ValueError: If any of the replicas is not a `host:port` pair.
+    """
+    replicas: StepDict | None = await cl.AskUserMessage(
+        content="Please enter the read replicas of the database, if any, as comma-separated `host:port` pairs (or `-` for none):",
+        timeout=31_536_000,
+    ).send()
+
+    if not replicas or replicas.get("output").strip() == "-":
+        return []
+
+    return replica_router.parse_replicas(replicas.get("output"))
+
+
 async def change_thread_name(thread_name: str) -> None:
     """
     Change the name of the current thread to reflect the current connection.
@@ -467,6 +634,9 @@ async def change_thread_name(thread_name: str) -> None:
     # It uses the emitter to emit that the thread name has been initialized.
     await cl.context.emitter.init_thread(thread_name)
 
+    # The name is tracked in the session, so that renaming the thread again does not need to query it
+    cl.user_session.set("thread_name", thread_name)
+
 
 async def append_schema_to_thread_name(schema_name: str) -> None:
     """
@@ -475,16 +645,36 @@ async def append_schema_to_thread_name(schema_name: str) -> None:
     Args:
         schema_name (str): The name of the schema to append.
     """
-    current_thread = await cl_data.get_data_layer().get_thread(cl.context.session.thread_id)
-    current_thread_name = current_thread.get("name")
+    current_thread_name = cl.user_session.get("thread_name")
+
+    # e.g. the chat has been resumed or a message has been sent since, in which case only the name is queried (not the whole thread)
+    if current_thread_name is None:
+        current_thread_name = await asyncio.to_thread(_get_thread_name, cl.context.session.thread_id)
 
     new_thread_name = f"{current_thread_name} - {schema_name}"
     await change_thread_name(new_thread_name)
 
 
-async def get_ai_sql_query(message: cl.Message, conn_info: dict, metadata: list[str], schema: str, context: list[dict]) -> str:
+def _get_thread_name(thread_id: str) -> str | None:
+    db_engine = create_engine(os.getenv("DATABASE_URL"))
+    with Session(db_engine) as session:
+        return threads.get_thread_name(thread_id, session)
+
+
+async def get_ai_sql_query(  # noqa: PLR0913
+    message: cl.Message,
+    conn_info: dict,
+    metadata: list[str],
+    schema: str,
+    context: list[dict],
+    *,
+    previous_results: bool = True,
+) -> str:
     """
     Get the SQL query from the AI model.
+    The tables of the schema get profiled in the background, and whatever is already known about their values is included in the prompt.
+    The results of the previous questions kept in the session are included as well, so that the AI model can target them instead
+    of the database, see `local_results`.
 
     Args:
         message (cl.Message): The user's message.
@@ -492,66 +682,312 @@ async def get_ai_sql_query(message: cl.Message, conn_info: dict, metadata: list[
         metadata (list[str]): The database metadata.
         schema (str): The database schema.
         context (list[dict]): The chat context.
+        previous_results (bool): Whether the query may target the results of the previous questions.
 
     Returns:
         str: The SQL query generated by the AI model.
     """
-    meta_str = "\n".join(metadata)
-    meta_str = f"This is my db structure:\n{meta_str}" if meta_str else ""
+    column_profiler.schedule_profiling(conn_info, schema)
+    column_profiles = await asyncio.to_thread(column_profiler.get_profile_summary, conn_info, schema)
+
+    return await ai_controller.generate_sql_query(
+        message.content,
+        conn_info["type_of_db"],
+        metadata,
+        schema,
+        context,
+        column_profiles=column_profiles,
+        previous_results=local_results.describe_tables(cl.context.session.id) if previous_results else "",
+    )
 
-    context_str = "\n".join([f"{' - ' + c['role'] + ': ' + c['content']}" for c in context]) if context else ""
-    context_str = f"\n\nPrevious Chat context:\n{context_str}" if context_str else ""
 
-    template = f"""{meta_str}
+async def execute_query_preview(conn_info: dict, query: str) -> tuple[tuple, tuple[str], bool]:
+    """
+    Execute a query through the shared pool of a connection, fetching only the rows shown to the user,
+    in a worker thread so that it can be cancelled while it is running.
+    If the results of the questions are kept for the follow-up questions, up to `LOCAL_RESULTS_MAX_ROWS` rows are fetched instead,
+    see `keep_results`.
 
-    Please answer only with the SQL query (without any text formatting) that answers the following question:
-    {message.content}
+    Args:
+        conn_info (dict): The connection information.
+        query (str): The SQL query to execute.
 
-    Keep in mind that the database is a {conn_info["type_of_db"]} database and that the schema is {schema} and it should be used in the SQL query.
-    {"Add quotes around the table and column names to avoid SQL syntax errors." if conn_info["type_of_db"] == "postgres" else ""}
-    Unless explicitly stated, please do not limit the number of rows returned.
-    {context_str}
+    Returns:
+        tuple[tuple, tuple[str], bool]: The previewed results, the column names of the query and whether it has more rows.
     """
-    logger.debug(f"Sending the following template to the AI model:\n{template}")
+    max_rows = LOCAL_RESULTS_MAX_ROWS if local_results.is_enabled() else str_manipulation.MAX_RESULT_ROWS
+    return await _run_cancellable(conn_info, lambda db_controller: db_controller.execute_query_preview(query, max_rows))
 
-    response = await ai_controller.get_ai_response(template)
-    logger.debug(f"AI's response: {response}")
-    return str_manipulation.extract_sql_only(response)
 
+async def execute_local_query(query: str) -> tuple[tuple, tuple[str], bool] | None:
+    """
+    Execute a query over the results of the previous questions kept in the session, in-process and in a worker thread.
 
-def get_db_controller_and_metadata(
-    conn_info: dict,
-    schema: str,
-) -> tuple[BaseDBController, list[str], SSHTunnelForwarder | None]:
+    Args:
+        query (str): The DuckDB SQL query generated by the AI model.
+
+    Returns:
+        tuple[tuple, tuple[str], bool] | None: The results, the column names and whether the query has more rows,
+        or None if the query failed, in which case the question should be answered by the database instead.
+    """
+    try:
+        return await asyncio.to_thread(local_results.execute, cl.context.session.id, query)
+    except QueryExecutionError as e:
+        logger.warning(f"Failed to answer the question from the previous results, asking the database instead: {e.message}")
+        return None
+
+
+async def keep_results(question: str, query: str, preview: tuple[tuple, tuple[str], bool]) -> None:
+    """
+    Keep the results of a question in the session for the follow-up questions (if they are complete), see `local_results`.
+
+    Args:
+        question (str): The user's question.
+        query (str): The SQL query that produced the results.
+        preview (tuple[tuple, tuple[str], bool]): The fetched rows, the column names and whether the query has more rows.
     """
-    Get the database controller and metadata.
+    results, column_names, has_more = preview
+
+    if local_results.is_enabled() and not has_more and column_names:
+        await asyncio.to_thread(local_results.keep_results, cl.context.session.id, question, query, results, column_names)
+
+
+async def _run_cancellable[T](conn_info: dict, func: Callable[[BaseDBController], T]) -> T:
+    """
+    Run a blocking database operation in a worker thread, once it gets a slot of `scheduler.db_scheduler`,
+    with a controller leased from the shared pool of the connection.
+    The controller is kept in the user session for as long as the operation runs, so that its query can be cancelled.
 
     Args:
         conn_info (dict): The connection information.
-        schema (str): The database schema.
+        func (Callable[[BaseDBController], T]): The blocking operation, given the leased controller.
+
+    Returns:
+        T: The result of the operation.
+    """
+    async with scheduler.db_scheduler.slot(), lease_db_controller(conn_info) as db_controller:
+        cl.user_session.set("running_db_controller", db_controller)
+        operation = asyncio.ensure_future(cl.make_async(func)(db_controller))
+        try:
+            return await asyncio.shield(operation)
+        except asyncio.CancelledError:
+            # The lease only ends (closing the controller) once the worker thread no longer uses it
+            await cl.make_async(db_controller.cancel_running_query)()
+            await asyncio.wait([operation])
+            raise
+        finally:
+            # Another message may have already replaced the running controller
+            if cl.user_session.get("running_db_controller") is db_controller:
+                cl.user_session.set("running_db_controller", None)
+
+
+async def handle_batch_questions() -> None:
+    """Ask the user for a list of questions, answer all of them against the current schema and send the results as a ZIP archive."""
+    conn_info = get_user_connection_info()
+    schema = get_session_state("curr_db_schema")
+    if not conn_info or not schema:
+        await cl.Message(content="Please choose a database schema to work with before asking a batch of questions.").send()
+        return
+
+    res: StepDict | None = await cl.AskUserMessage(
+        content=f"Please paste your questions, one per line (up to {BATCH_MAX_QUESTIONS}):",
+        timeout=31_536_000,
+    ).send()
+    if not res:
+        return
+
+    questions = batch_controller.parse_questions(res.get("output"))
+    if not questions or len(questions) > BATCH_MAX_QUESTIONS:
+        await cl.Message(content=f"Please provide between 1 and {BATCH_MAX_QUESTIONS} questions, one per line.").send()
+        return
+
+    # Files in the session's directory are cleaned up by Chainlit when the session ends
+    archive_path = Path(cl.context.session.files_dir) / f"batch_{uuid.uuid4().hex}.zip"
+
+    try:
+        async with cl.Step(name="Answering the questions"):
+            answers = await batch_controller.answer_questions(
+                conn_info,
+                schema,
+                questions,
+                archive_path,
+                connection_id=get_session_state("curr_conn_id"),
+            )
+    except Exception:
+        logger.exception("Failed to answer the batch of questions")
+        await cl.Message(content="Failed to connect to the database to answer the questions. Please try again.").send()
+        return
+
+    answered = sum(answer.error is None for answer in answers)
+    await cl.Message(
+        content=f"Answered {answered} of {len(answers)} questions. The archive contains a `summary.csv` with the SQL query of each question and a CSV with the results of each answered one.",
+        elements=[cl.File(name="batch_results.zip", path=str(archive_path), display="inline")],
+    ).send()
+
+
+def create_full_results_actions(query: str) -> list[cl.Action]:
+    """
+    Create the actions that download the full results of a previewed query, one per export format.
+    The query itself is kept in the user session, so that the actions cannot be used to run arbitrary SQL.
+
+    Args:
+        query (str): The SQL query whose results were previewed.
 
     Returns:
-        tuple[BaseDBController, list[str], SSHTunnelForwarder | None]: The database controller, metadata, and SSH tunnel.
-    """
-    conn_details = deepcopy(conn_info)
-    tunnel = None
-    if conn_info.get("ssh"):
-        logger.debug("Using SSH tunnel for database connection")
-        tunnel = SSHTunnelForwarder(
-            ssh_address_or_host=(conn_info["ssh"]["ssh_host"], conn_info["ssh"]["ssh_port"]),
-            ssh_username=conn_info["ssh"]["ssh_user"],
-            ssh_password=conn_info["ssh"]["ssh_password"],
-            remote_bind_address=(conn_info["tcp"]["host"], conn_info["tcp"]["port"]),
-            local_bind_address=("127.0.0.1", 0),
-            logger=logger,
+        list[cl.Action]: The download actions.
+    """
+    full_results_queries: dict[str, str] = get_session_state("full_results_queries") or {}
+
+    results_id = uuid.uuid4().hex
+    full_results_queries[results_id] = query
+
+    # Only the most recent queries are kept (dicts preserve insertion order)
+    while len(full_results_queries) > FULL_RESULTS_HISTORY:
+        full_results_queries.pop(next(iter(full_results_queries)))
+
+    set_session_state("full_results_queries", full_results_queries)
+
+    return [
+        cl.Action(
+            name="download_full_csv",
+            payload={"value": results_id},
+            label="Download full CSV",
+        ),
+        cl.Action(
+            name="download_full_parquet",
+            payload={"value": results_id},
+            label="Download full Parquet",
+        ),
+        cl.Action(
+            name="download_full_arrow",
+            payload={"value": results_id},
+            label="Download full Arrow IPC",
+        ),
+    ]
+
+
+async def send_full_results(results_id: str, export_format: str) -> None:
+    """
+    Execute a previewed query again, stream its full results into a file of the given format and send it to the user.
+
+    Args:
+        results_id (str): The ID of the previewed query, as given in the payload of the download action.
+        export_format (str): The format of the file, one of `result_exports.EXPORT_FORMATS`.
+    """
+    query: str | None = (get_session_state("full_results_queries") or {}).get(results_id)
+    if not query:
+        await cl.Message(content="These results are no longer available. Please ask your question again.").send()
+        return
+
+    writer, file_extension = result_exports.EXPORT_FORMATS[export_format]
+
+    # Files in the session's directory are cleaned up by Chainlit when the session ends
+    file_path = Path(cl.context.session.files_dir) / f"{results_id}.{file_extension}"
+
+    try:
+        rows_written = await _run_cancellable(
+            get_user_connection_info(),
+            lambda db_controller: _export_full_results(db_controller, query, writer, file_path),
         )
-        tunnel.start()
-        conn_details["tcp"]["host"] = "127.0.0.1"
-        conn_details["tcp"]["port"] = tunnel.local_bind_port
+    except Exception:
+        logger.exception("Failed to export the full results")
+        await cl.Message(content="Failed to export the full results. Please try again.").send()
+        return
 
-    db_controller: connection_controller.MySQLController | connection_controller.PostgresController = get_db_controller(
-        db_type=conn_info["type_of_db"],
-        tcp_details=conn_details["tcp"],
-    )
-    metadata = db_controller.get_db_metadata(schema=schema)
-    return db_controller, metadata, tunnel
+    await cl.Message(
+        content=f"Here are the full results ({rows_written} rows):",
+        elements=[cl.File(name=f"data_table.{file_extension}", path=str(file_path), display="inline")],
+    ).send()
+
+
+async def cancel_running_query() -> None:
+    """Cancel the query that is currently running for the user session, if any."""
+    db_controller: BaseDBController | None = cl.user_session.get("running_db_controller")
+    if not db_controller:
+        return
+
+    logger.debug("Cancelling the running query of the user session")
+    await cl.make_async(db_controller.cancel_running_query)()
+
+
+def _export_full_results(
+    db_controller: BaseDBController,
+    query: str,
+    writer: Callable[[Iterable[tuple[tuple[str], list]], Path], int],
+    file_path: Path,
+) -> int:
+    """
+    Stream the full results of a query into a file.
+
+    Args:
+        db_controller (BaseDBController): The database controller to execute the query with.
+        query (str): The SQL query to execute.
+        writer (Callable): The function of `result_exports` that writes the file.
+        file_path (Path): The path of the file to write.
+
+    Returns:
+        int: The number of rows written.
+    """
+    file_path.parent.mkdir(exist_ok=True)
+    return writer(db_controller.stream_query(query), file_path)
+
+
+@asynccontextmanager
+async def lease_db_controller(conn_info: dict) -> AsyncGenerator[BaseDBController]:
+    """
+    Lease a controller of the shared pool of a connection (see `connection_pool.get_shared_pool`),
+    without blocking the event loop while waiting for one to be released or connecting a new one.
+    The pool is looked up on every lease, so that a pool closed for being idle in the meantime is opened again.
+
+    Args:
+        conn_info (dict): The connection information.
+
+    Yields:
+        BaseDBController: The leased controller.
+    """
+    pool = await asyncio.to_thread(connection_pool.get_shared_pool, conn_info)
+    lease = pool.lease()
+    entering = asyncio.ensure_future(asyncio.to_thread(lease.__enter__))
+
+    try:
+        db_controller = await asyncio.shield(entering)
+    except asyncio.CancelledError:
+        # The worker thread still leases the controller, which is given back (unused) as soon as it does
+        entering.add_done_callback(functools.partial(_end_abandoned_lease, lease))
+        raise
+
+    try:
+        yield db_controller
+    except BaseException as e:
+        # A controller whose lease does not end normally is closed, which may block on the network
+        await asyncio.to_thread(lease.__exit__, type(e), e, e.__traceback__)
+        raise
+
+    lease.__exit__(None, None, None)
+
+
+def _end_abandoned_lease(lease: AbstractContextManager[BaseDBController], entering: asyncio.Future) -> None:
+    """
+    End a lease whose task was cancelled while the controller was being leased, giving the controller back to its pool.
+
+    Args:
+        lease (AbstractContextManager[BaseDBController]): The lease.
+        entering (asyncio.Future): The (done) future that entered the lease in a worker thread.
+    """
+    if not entering.cancelled() and entering.exception() is None:
+        lease.__exit__(None, None, None)
+
+
+async def get_metadata(conn_info: dict, schema: str) -> list[str]:
+    """
+    Get the metadata of a schema through the shared pool of its connection, which is already warm for a resumed thread.
+
+    Args:
+        conn_info (dict): The connection information.
+        schema (str): The database schema.
+
+    Returns:
+        list[str]: The database metadata.
+    """
+    async with lease_db_controller(conn_info) as db_controller:
+        return await asyncio.to_thread(db_controller.get_db_metadata, schema=schema)
@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cache_backends
+import connection_pool
+from connection_factory import connection_identity
+from profiling_configs import (
+    PROFILE_MAX_AGE,
+    PROFILE_MIN_INTERVAL,
+    PROFILE_SUMMARY_MAX_CHARS,
+    PROFILE_TABLE_DELAY,
+    PROFILE_TABLES_PER_RUN,
+    PROFILES_CACHE_TTL,
+)
+
+logger: logging.Logger = logging.getLogger("webtext2sql")
+
+# A single thread profiles all the schemas of a worker, one table at a time, so that profiling never adds more than one query to any database
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="webtext2sql-profiler")
+
+# The schemas whose profiling job is scheduled or running, so that it is not scheduled again in the meantime
+_scheduled: set[tuple[str, str]] = set()
+_scheduled_lock = threading.Lock()
+
+
+def schedule_profiling(conn_info: dict, schema: str) -> None:
+    """
+    Profile the columns of the tables of a schema in the background, a few tables at a time.
+    Each run only profiles the `PROFILE_TABLES_PER_RUN` tables whose profile is missing or the oldest (if older than `PROFILE_MAX_AGE`),
+    and runs for the same schema are at least `PROFILE_MIN_INTERVAL` seconds apart, so it can be called on every question.
+
+    Args:
+        conn_info (dict): The connection information.
+        schema (str): The database schema.
+    """
+    identity = connection_identity(conn_info["type_of_db"], conn_info["tcp"], conn_info.get("ssh"))
+
+    with _scheduled_lock:
+        if (identity, schema) in _scheduled:
+            return
+        _scheduled.add((identity, schema))
+
+    _executor.submit(_run_profiling, conn_info, schema, identity)
+
+
+def get_profile_summary(conn_info: dict, schema: str) -> str:
+    """
+    Summarize the stored column profiles of a schema, compactly enough to be included in prompts.
+
+    Args:
+        conn_info (dict): The connection information.
+        schema (str): The database schema.
+
+    Returns:
+        str: One line per profiled column (sorted, so that the summary only changes when the profiles do), or an empty string if there are none.
+    """
+    identity = connection_identity(conn_info["type_of_db"], conn_info["tcp"], conn_info.get("ssh"))
+
+    profiles = cache_backends.get_cache_backend().get(_cache_key(identity, schema))
+    if profiles is cache_backends.MISSING:
+        return ""
+
+    lines: list[str] = []
+    length = 0
+
+    for table_name, table_profile in sorted(profiles["tables"].items()):
+        for column_name, column_profile in sorted(table_profile["columns"].items()):
+            if "values" in column_profile:
+                line = f"{table_name}.{column_name}: one of " + ", ".join(f"'{value}'" for value in column_profile["values"])
+            else:
+                line = f"{table_name}.{column_name}: from {column_profile['min']} to {column_profile['max']}"
+
+            if length + len(line) > PROFILE_SUMMARY_MAX_CHARS:
+                return "\n".join(lines)
+
+            lines.append(line)
+            length += len(line) + 1
+
+    return "\n".join(lines)
+
+
+def _run_profiling(conn_info: dict, schema: str, identity: str) -> None:
+    """
+    Run the profiling job of a schema, storing the profile of each table as soon as it is done.
+
+    Args:
+        conn_info (dict): The connection information.
+        schema (str): The database schema.
+        identity (str): The identity of the connection.
+    """
+    backend = cache_backends.get_cache_backend()
+    cache_key = _cache_key(identity, schema)
+
+    try:
+        profiles = backend.get(cache_key)
+        tables: dict[str, dict] = {} if profiles is cache_backends.MISSING else dict(profiles["tables"])
+
+        if profiles is not cache_backends.MISSING and time.time() - profiles["last_run"] < PROFILE_MIN_INTERVAL:
+            return
+
+        # Claimed before profiling, so that the other workers skip this schema for a while too.
+        # A copy is stored every time, since the in-process backend stores the object itself and it may be read concurrently.
+        last_run = time.time()
+        backend.set(cache_key, {"last_run": last_run, "tables": dict(tables)}, PROFILES_CACHE_TTL)
+
+        pool = connection_pool.get_shared_pool(conn_info)
+        with pool.lease() as db_controller:
+            table_names = db_controller.list_tables(schema)
+
+        # Dropped tables are forgotten
+        tables = {name: profile for name, profile in tables.items() if name in table_names}
+
+        stale_tables = [name for name in table_names if time.time() - tables.get(name, {}).get("profiled_at", 0) > PROFILE_MAX_AGE]
+        stale_tables.sort(key=lambda name: tables.get(name, {}).get("profiled_at", 0))
+
+        for table_name in stale_tables[:PROFILE_TABLES_PER_RUN]:
+            with pool.lease() as db_controller:
+                columns = db_controller.profile_table(schema, table_name)
+
+            tables[table_name] = {"profiled_at": time.time(), "columns": columns}
+            backend.set(cache_key, {"last_run": last_run, "tables": dict(tables)}, PROFILES_CACHE_TTL)
+            logger.debug(f"Profiled {len(columns)} columns of table {schema}.{table_name}")
+
+            time.sleep(PROFILE_TABLE_DELAY)
+
+    except Exception:  # noqa: BLE001
+        logger.warning(f"Failed to profile the columns of schema: {schema}")
+    finally:
+        with _scheduled_lock:
+            _scheduled.discard((identity, schema))
+
+
+def _cache_key(identity: str, schema: str) -> str:
+    return cache_backends.make_key("column_profiles", identity, schema)
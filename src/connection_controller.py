@@ -2,20 +2,76 @@
 from copy import deepcopy
 from typing import TYPE_CHECKING
 
-from sshtunnel import SSHTunnelForwarder
-
-from connection_factory import get_db_controller
+import schema_cache
+from connection_factory import connection_identity, get_db_controller
 
 if TYPE_CHECKING:
-    from db_controllers.mysql_controller import MySQLController
-    from db_controllers.pg_controller import PostgresController
+    from sshtunnel import SSHTunnelForwarder
+
+    from db_controllers.base_db_controller import BaseDBController
 
 logger: logging.Logger = logging.getLogger("webtext2sql")
 
 
+def create_ssh_tunnel(conn_info: dict) -> "SSHTunnelForwarder":
+    """
+    Create (but do not start) an SSH tunnel to the database server of the given connection.
+    `sshtunnel` (and `paramiko` with it) is imported here, since it is only needed by SSH connections.
+
+    Args:
+        conn_info (dict): A dictionary containing the SSH and TCP connection parameters.
+
+    Returns:
+        SSHTunnelForwarder: The SSH tunnel, bound to a free local port once started.
+    """
+    from sshtunnel import SSHTunnelForwarder  # noqa: PLC0415
+
+    return SSHTunnelForwarder(
+        ssh_address_or_host=(conn_info["ssh"]["ssh_host"], conn_info["ssh"]["ssh_port"]),
+        ssh_username=conn_info["ssh"]["ssh_user"],
+        ssh_password=conn_info["ssh"]["ssh_password"],
+        remote_bind_address=(conn_info["tcp"]["host"], conn_info["tcp"]["port"]),
+        local_bind_address=("127.0.0.1", 0),  # Let OS pick a free local port
+        logger=logger,
+    )
+
+
+def create_db_controller(conn_info: dict, tunnel: "SSHTunnelForwarder | None" = None) -> "BaseDBController":
+    """
+    Connect to the database of the given connection, through an already started SSH tunnel if the connection requires one.
+    Connections with read replicas are routed to one of them, unless they are reached through an SSH tunnel,
+    which is bound to the host of the primary.
+
+    Args:
+        conn_info (dict): A dictionary containing connection parameters.
+        tunnel (SSHTunnelForwarder | None): The started SSH tunnel to the database server, if the connection requires one.
+
+    Returns:
+        BaseDBController: The database controller.
+    """
+    tcp_details = deepcopy(conn_info["tcp"])
+
+    if tunnel:
+        tcp_details["host"] = "127.0.0.1"
+        tcp_details["port"] = tunnel.local_bind_port
+
+    db_controller = get_db_controller(
+        db_type=conn_info["type_of_db"],
+        tcp_details=tcp_details,
+        replicas=None if tunnel else conn_info.get("replicas"),
+    )
+
+    # The tunnel rewrites the host and port, so the controller is identified by the details entered by the user instead
+    db_controller.identity = connection_identity(conn_info["type_of_db"], conn_info["tcp"], conn_info.get("ssh"))
+
+    return db_controller
+
+
 def try_establish_connection(conn_info: dict) -> bool:
     """
     Attempt to establish a connection using the provided connection information.
+    The connection is opened through its shared pool and its schema list is fetched (and cached) along the way,
+    so that the schema selection that follows a successful test does not connect again.
 
     Args:
         conn_info (dict): A dictionary containing connection parameters.
@@ -23,35 +79,11 @@ def try_establish_connection(conn_info: dict) -> bool:
     Returns:
         bool: True if the connection is established successfully, False otherwise.
     """
-    db_controller_type: MySQLController | PostgresController = get_db_controller(
-        db_type=conn_info["type_of_db"],
-    )
+    try:
+        schema_cache.refresh_available_schemas(conn_info)
+    except Exception:
+        logger.exception("Failed to establish a connection:")
+        return False
 
-    if conn_info["type"] == "ssh":
-        # If SSH connection is selected, we need to establish the SSH tunnel first
-        try:
-            with SSHTunnelForwarder(
-                ssh_address_or_host=(conn_info["ssh"]["ssh_host"], conn_info["ssh"]["ssh_port"]),
-                ssh_username=conn_info["ssh"]["ssh_user"],
-                ssh_password=conn_info["ssh"]["ssh_password"],
-                remote_bind_address=(conn_info["tcp"]["host"], conn_info["tcp"]["port"]),
-                local_bind_address=("127.0.0.1", 0),  # Let OS pick a free local port
-                logger=logger,
-            ) as tunnel:
-                # Update the TCP connection info to use the local bind port
-                conn_dict_info = deepcopy(conn_info)
-
-                conn_dict_info["tcp"]["host"] = "127.0.0.1"
-                conn_dict_info["tcp"]["port"] = tunnel.local_bind_port
-
-                return db_controller_type.try_establish_connection(
-                    tcp_details=conn_dict_info["tcp"],
-                )
-
-        except Exception:
-            logger.exception("Failed to establish SSH tunnel:")
-            return False
-
-    return db_controller_type.try_establish_connection(
-        tcp_details=conn_info["tcp"],
-    )
+    logger.info("Connection established successfully.")
+    return True
@@ -1,31 +1,38 @@
-from db_controllers.base_db_controller import BaseDBController
-from db_controllers.mysql_controller import MySQLController
-from db_controllers.pg_controller import PostgresController
+import hashlib
+import json
+from typing import TYPE_CHECKING
 
+import replica_router
 
-def get_db_controller(db_type: str, tcp_details: dict | None = None) -> MySQLController | PostgresController:
+if TYPE_CHECKING:
+    from db_controllers.base_db_controller import BaseDBController
+    from db_controllers.mysql_controller import MySQLController
+    from db_controllers.pg_controller import PostgresController
+
+
+def get_db_controller(db_type: str, tcp_details: dict | None = None, replicas: list[dict] | None = None) -> "MySQLController | PostgresController":
     """
     Get the appropriate database controller based on the specified type.
+    If the connection has read replicas, the controller connects to one of them instead of the primary whenever possible.
 
     Args:
         db_type (str): The type of database ('mysql' or 'postgres').
         tcp_details (dict): Additional keyword arguments for connection parameters.
+        replicas (list[dict] | None): The host and port of each read replica of the connection, if any.
 
     Returns:
         MySQLController | PostgresController: An instance of the appropriate database controller.
     """
-    if db_type == "mysql":
-        return MySQLController(tcp_details)
-    if db_type == "postgres":
-        return PostgresController(tcp_details)
+    if replicas:
+        return replica_router.connect_for_reads(db_type, tcp_details, replicas)
 
-    msg = f"Unsupported database type: {db_type}"
-    raise ValueError(msg)
+    return get_db_controller_type(db_type)(tcp_details)
 
 
-def get_db_controller_type(db_type: str) -> type[BaseDBController]:
+def get_db_controller_type(db_type: str) -> type["BaseDBController"]:
     """
     Get the class of the appropriate database controller based on the specified type.
+    The controllers are imported on first use, so that only the driver of the databases actually in use gets loaded.
 
     Args:
         db_type (str): The type of database ('mysql' or 'postgres').
@@ -34,9 +41,35 @@ def get_db_controller_type(db_type: str) -> type[BaseDBController]:
         type[BaseDBController]: The class of the appropriate database controller.
     """
     if db_type == "mysql":
+        from db_controllers.mysql_controller import MySQLController  # noqa: PLC0415
+
         return MySQLController
     if db_type == "postgres":
+        from db_controllers.pg_controller import PostgresController  # noqa: PLC0415
+
         return PostgresController
 
     msg = f"Unsupported database type: {db_type}"
     raise ValueError(msg)
+
+
+def connection_identity(db_type: str, tcp_details: dict, ssh_details: dict | None = None) -> str:
+    """
+    Build a stable identifier of the database (and credentials) a connection reaches.
+    Unlike a controller instance, it is the same across requests, workers and nodes, so it is used to key the shared caches.
+
+    Args:
+        db_type (str): The type of database ('mysql' or 'postgres').
+        tcp_details (dict): The TCP connection parameters, as entered by the user (i.e. before any SSH tunneling).
+        ssh_details (dict | None): The SSH connection parameters, if the database is reached through an SSH tunnel.
+
+    Returns:
+        str: The identifier of the connection.
+    """
+    identifying_details = {
+        "type_of_db": db_type,
+        "tcp": {key: tcp_details.get(key) for key in ("host", "port", "dbname", "user", "password")},
+        "ssh": {key: ssh_details.get(key) for key in ("ssh_host", "ssh_port", "ssh_user")} if ssh_details else None,
+    }
+    # The password is hashed along with the rest, so that it never appears in a cache key
+    return hashlib.sha256(json.dumps(identifying_details, sort_keys=True, default=str).encode()).hexdigest()
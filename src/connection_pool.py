@@ -0,0 +1,184 @@
+import logging
+import queue
+import threading
+import time
+from collections.abc import Generator
+from contextlib import contextmanager
+from types import TracebackType
+from typing import TYPE_CHECKING, Self
+
+import connection_controller
+import replica_router
+from connection_factory import connection_identity
+from execution_configs import SHARED_POOL_IDLE_TIMEOUT, SHARED_POOL_SIZE
+
+if TYPE_CHECKING:
+    from sshtunnel import SSHTunnelForwarder
+
+    from db_controllers.base_db_controller import BaseDBController
+
+logger: logging.Logger = logging.getLogger("webtext2sql")
+
+
+class ConnectionPool:
+    """
+    A small pool of database controllers for a single connection, all sharing one SSH tunnel (if the connection requires one).
+    Controllers are only opened when no idle one is available, so the pool never holds more connections than it is concurrently used by.
+
+    It is meant to be used as a context manager, which stops the tunnel and closes all the controllers on exit.
+    """
+
+    def __init__(self, conn_info: dict, size: int) -> None:
+        self.conn_info = conn_info
+        self.size = size
+        self._tunnel: SSHTunnelForwarder | None = None
+        self._idle: queue.LifoQueue[BaseDBController] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._open_lock = threading.Lock()
+        self._opened = False
+        self._leases = 0
+        self._leases_lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    def __enter__(self) -> Self:
+        self.open()
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc: BaseException | None, traceback: TracebackType | None) -> None:
+        self.close()
+
+    def open(self) -> None:
+        """Start the SSH tunnel of the pool, if its connection requires one. Opening an already open pool does nothing."""
+        with self._open_lock:
+            if self._opened:
+                return
+
+            if self.conn_info.get("type") == "ssh":
+                logger.debug("Using SSH tunnel for the connection pool")
+                self._tunnel = connection_controller.create_ssh_tunnel(self.conn_info)
+                self._tunnel.start()
+
+            self._opened = True
+
+    @contextmanager
+    def lease(self) -> Generator["BaseDBController"]:
+        """
+        Lease a controller of the pool, waiting for one to be released if all of them are in use.
+        An idle controller connected to a read replica that is no longer usable is replaced by a newly routed one.
+        A controller whose lease does not end normally (e.g. with an error) is closed instead of being released,
+        since its connection may be broken or still busy.
+
+        Yields:
+            BaseDBController: The leased controller.
+        """
+        with self._slots:
+            with self._leases_lock:
+                self._leases += 1
+
+            try:
+                try:
+                    db_controller = self._idle.get_nowait()
+                except queue.Empty:
+                    db_controller = connection_controller.create_db_controller(self.conn_info, self._tunnel)
+                else:
+                    # A replica may have started lagging since the controller connected to it, so the routing is done again
+                    if not replica_router.is_still_usable(db_controller):
+                        db_controller.close_connection()
+                        db_controller = connection_controller.create_db_controller(self.conn_info, self._tunnel)
+
+                released = False
+                try:
+                    yield db_controller
+                    released = True
+                finally:
+                    if released:
+                        self._idle.put(db_controller)
+                    else:
+                        db_controller.close_connection()
+            finally:
+                with self._leases_lock:
+                    self._leases -= 1
+                    self.last_used = time.monotonic()
+
+    def is_idle(self, timeout: float) -> bool:
+        """
+        Check whether the pool has been left unused for a while.
+
+        Args:
+            timeout (float): The number of seconds after which an unused pool is considered idle.
+
+        Returns:
+            bool: True if no controller is leased and none has been for `timeout` seconds.
+        """
+        with self._leases_lock:
+            return self._leases == 0 and time.monotonic() - self.last_used > timeout
+
+    def close(self) -> None:
+        """Close all the idle controllers of the pool and stop its SSH tunnel."""
+        while True:
+            try:
+                self._idle.get_nowait().close_connection()
+            except queue.Empty:
+                break
+
+        with self._open_lock:
+            if self._tunnel:
+                self._tunnel.stop()
+                self._tunnel = None
+                logger.debug("SSH tunnel closed")
+
+            self._opened = False
+
+
+_shared_pools: dict[str, ConnectionPool] = {}
+_shared_pools_lock = threading.Lock()
+
+
+def get_shared_pool(conn_info: dict) -> ConnectionPool:
+    """
+    Get the pool of a connection shared by all the requests of this worker, opening it on first use.
+    Shared pools that have been left unused for `SHARED_POOL_IDLE_TIMEOUT` seconds are closed whenever a pool is requested.
+
+    Args:
+        conn_info (dict): The connection information.
+
+    Returns:
+        ConnectionPool: The shared pool of the connection.
+    """
+    identity = connection_identity(conn_info["type_of_db"], conn_info["tcp"], conn_info.get("ssh"))
+
+    with _shared_pools_lock:
+        for pool_identity, pool in list(_shared_pools.items()):
+            if pool_identity != identity and pool.is_idle(SHARED_POOL_IDLE_TIMEOUT):
+                logger.debug("Closing an idle shared connection pool")
+                _shared_pools.pop(pool_identity).close()
+
+        pool = _shared_pools.get(identity)
+        if pool is None:
+            pool = ConnectionPool(conn_info, size=SHARED_POOL_SIZE)
+            _shared_pools[identity] = pool
+
+        # So that it is not considered idle (and closed) before the caller leases a controller of it
+        pool.last_used = time.monotonic()
+
+    # Opened outside of the lock, so that a slow SSH tunnel only holds up the requests for its own connection
+    try:
+        pool.open()
+    except Exception:
+        with _shared_pools_lock:
+            if _shared_pools.get(identity) is pool:
+                del _shared_pools[identity]
+        raise
+
+    return pool
+
+
+def count_shared_pools() -> int:
+    """
+    Count the shared pools of this worker, idle or not.
+
+    Returns:
+        int: The number of shared pools.
+    """
+    with _shared_pools_lock:
+        return len(_shared_pools)
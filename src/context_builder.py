@@ -0,0 +1,97 @@
+import logging
+import re
+
+from execution_configs import CONTEXT_MAX_TURNS, CONTEXT_TOKEN_BUDGET
+
+logger: logging.Logger = logging.getLogger("webtext2sql")
+
+# The message confirming the selection of a schema starts with this, anything before it refers to another schema (or to no schema at all)
+SCHEMA_SELECTED_PREFIX = "You have selected the schema:"
+
+_SQL_BLOCK = re.compile(r"```sql\n(.*?)\n```", re.DOTALL)
+
+# A rough but dependency-free estimate, English text and SQL average about 4 characters per token
+_CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens a text takes up in a prompt.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return len(text) // _CHARS_PER_TOKEN + 1
+
+
+def build_context(
+    history: list[dict],
+    token_budget: int = CONTEXT_TOKEN_BUDGET,
+    max_turns: int = CONTEXT_MAX_TURNS,
+) -> list[dict]:
+    """
+    Build the chat context of a prompt out of the chat history.
+    Only the previous questions and the SQL queries that answered them are kept (without any results or other messages),
+    starting from the most recent ones and only since the current schema was selected, for as long as they fit in the token budget.
+
+    Args:
+        history (list[dict]): The messages of the chat so far, as given by `cl.chat_context.to_openai()`, without the current question.
+        token_budget (int): The maximum estimated number of tokens of the context.
+        max_turns (int): The maximum number of questions in the context.
+
+    Returns:
+        list[dict]: The context, as user (question) and assistant (SQL query) messages in chronological order.
+    """
+    turns = _extract_turns(history)
+
+    context: list[dict] = []
+    tokens = 0
+
+    for question, sql_query in reversed(turns[-max_turns:]):
+        turn_tokens = estimate_tokens(question) + estimate_tokens(sql_query)
+        if tokens + turn_tokens > token_budget:
+            break
+
+        context[:0] = [{"role": "user", "content": question}, {"role": "assistant", "content": sql_query}]
+        tokens += turn_tokens
+
+    logger.debug(f"Built a chat context of {len(context) // 2} of {len(turns)} previous questions (~{tokens} tokens)")
+    return context
+
+
+def _extract_turns(history: list[dict]) -> list[tuple[str, str]]:
+    """
+    Extract the questions and the SQL queries that answered them out of the chat history, since the current schema was selected.
+
+    Args:
+        history (list[dict]): The messages of the chat so far.
+
+    Returns:
+        list[tuple[str, str]]: The question and the SQL query of each answered question, in chronological order.
+    """
+    turns: list[tuple[str, str]] = []
+    question: str | None = None
+
+    for message in history:
+        content = message.get("content")
+        if not isinstance(content, str):
+            continue
+
+        if message.get("role") == "user":
+            # A question without an answer (e.g. a reply to a prompt of the app) is superseded by the next one
+            question = content.strip()
+        elif message.get("role") == "assistant":
+            if content.startswith(SCHEMA_SELECTED_PREFIX):
+                turns.clear()
+                question = None
+                continue
+
+            sql_block = _SQL_BLOCK.search(content)
+            if question and sql_block:
+                turns.append((question, sql_block.group(1).strip()))
+            question = None
+
+    return turns
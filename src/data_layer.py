@@ -0,0 +1,370 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any
+
+import asyncpg
+from cachetools import LRUCache
+from chainlit.data.chainlit_data_layer import ISO_FORMAT, ChainlitDataLayer
+from chainlit.data.storage_clients.base import BaseStorageClient
+from chainlit.data.utils import queue_until_user_message
+from chainlit.element import Element
+from chainlit.step import StepDict
+from chainlit.types import Feedback, PageInfo, PaginatedResponse, Pagination, ThreadDict, ThreadFilter
+
+import metrics
+from execution_configs import (
+    DATA_LAYER_KNOWN_IDS_MAX_SIZE,
+    DATA_LAYER_POOL_MAX_INACTIVE_LIFETIME,
+    DATA_LAYER_POOL_MAX_SIZE,
+    DATA_LAYER_POOL_MIN_SIZE,
+    DATA_LAYER_STEP_FLUSH_DELAY,
+)
+
+logger: logging.Logger = logging.getLogger("webtext2sql")
+
+# The same upsert Chainlit writes a step with, so that writing a batch of steps leaves them exactly as writing them one by one
+_UPSERT_STEP = """
+INSERT INTO "Step" (
+    id, "threadId", "parentId", input, metadata, name, output,
+    type, "startTime", "endTime", "showInput", "isError"
+) VALUES (
+    $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12
+)
+ON CONFLICT (id) DO UPDATE SET
+    "parentId" = COALESCE(EXCLUDED."parentId", "Step"."parentId"),
+    input = COALESCE(NULLIF(EXCLUDED.input, ''), "Step".input),
+    metadata = CASE
+        WHEN EXCLUDED.metadata <> '{}' THEN EXCLUDED.metadata
+        ELSE "Step".metadata
+    END,
+    name = COALESCE(EXCLUDED.name, "Step".name),
+    output = COALESCE(NULLIF(EXCLUDED.output, ''), "Step".output),
+    type = CASE
+        WHEN EXCLUDED.type = 'run' THEN "Step".type
+        ELSE EXCLUDED.type
+    END,
+    "threadId" = COALESCE(EXCLUDED."threadId", "Step"."threadId"),
+    "endTime" = COALESCE(EXCLUDED."endTime", "Step"."endTime"),
+    "startTime" = LEAST(EXCLUDED."startTime", "Step"."startTime"),
+    "showInput" = COALESCE(EXCLUDED."showInput", "Step"."showInput"),
+    "isError" = COALESCE(EXCLUDED."isError", "Step"."isError")
+"""
+
+# The columns of `_UPSERT_STEP`, in the order of its parameters
+_STEP_COLUMNS = ("id", "thread_id", "parent_id", "input", "metadata", "name", "output", "type", "start_time", "end_time", "show_input", "is_error")
+
+
+def get_storage_client() -> BaseStorageClient | None:
+    """
+    Get the client of the S3 bucket the elements of the threads are stored in, as Chainlit's own data layer sets it up.
+
+    Returns:
+        BaseStorageClient | None: The client, or None if no bucket is configured.
+    """
+    if not (os.getenv("APP_AWS_ACCESS_KEY") and os.getenv("APP_AWS_SECRET_KEY") and os.getenv("APP_AWS_REGION")):
+        return None
+
+    from chainlit.data.storage_clients.s3 import S3StorageClient  # noqa: PLC0415 # boto3 is only loaded when a bucket is configured
+
+    return S3StorageClient(
+        bucket=os.getenv("BUCKET_NAME"),
+        region_name=os.getenv("APP_AWS_REGION"),
+        aws_access_key_id=os.getenv("APP_AWS_ACCESS_KEY"),
+        aws_secret_access_key=os.getenv("APP_AWS_SECRET_KEY"),
+        endpoint_url=os.getenv("DEV_AWS_ENDPOINT"),
+    )
+
+
+def _merge_step_params(earlier: dict, later: dict) -> dict:
+    """
+    Merge two writes of the same step into one, which leaves the step as the two upserts would one after the other.
+
+    Args:
+        earlier (dict): The parameters of the earlier write.
+        later (dict): The parameters of the later write.
+
+    Returns:
+        dict: The parameters of the merged write.
+    """
+
+    def coalesce(column: str) -> Any:  # noqa: ANN401
+        return later[column] if later[column] is not None else earlier[column]
+
+    return {
+        "id": later["id"],
+        "thread_id": coalesce("thread_id"),
+        "parent_id": coalesce("parent_id"),
+        "input": later["input"] or earlier["input"],
+        "metadata": later["metadata"] if later["metadata"] != "{}" else earlier["metadata"],
+        "name": coalesce("name"),
+        "output": later["output"] or earlier["output"],
+        "type": earlier["type"] if later["type"] == "run" else later["type"],
+        "start_time": min(earlier["start_time"], later["start_time"]),
+        "end_time": coalesce("end_time"),
+        "show_input": coalesce("show_input"),
+        "is_error": coalesce("is_error"),
+    }
+
+
+class TunedDataLayer(ChainlitDataLayer):
+    """
+    Chainlit's Postgres data layer, with a sized connection pool and batched step writes.
+
+    Every message writes several steps, most of them twice (once when sent and again when updated), and Chainlit writes each
+    of them with up to three round trips (checking that its thread and parent exist before upserting it). Here the writes are
+    buffered for `DATA_LAYER_STEP_FLUSH_DELAY` seconds, the writes of the same step are merged, and the batch is upserted with
+    a single `executemany`, checking the threads and parents of the whole batch at once (and only those not seen before).
+    The buffered steps are written before anything that reads them or references them, e.g. resuming a thread or adding an element.
+    """
+
+    def __init__(self, database_url: str, storage_client: BaseStorageClient | None = None) -> None:
+        super().__init__(database_url, storage_client=storage_client)
+        self._pending_steps: list[dict] = []
+        self._flush_task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+
+        # The threads and steps known to exist, which are not checked again before writing the steps referencing them
+        self._known_threads: LRUCache[str, bool] = LRUCache(maxsize=DATA_LAYER_KNOWN_IDS_MAX_SIZE)
+        self._known_steps: LRUCache[str, bool] = LRUCache(maxsize=DATA_LAYER_KNOWN_IDS_MAX_SIZE)
+
+    async def connect(self) -> None:
+        """Create the connection pool shared by all the sessions of the worker, unless it exists already."""
+        if not self.pool:
+            self.pool = await asyncpg.create_pool(
+                self.database_url,
+                min_size=DATA_LAYER_POOL_MIN_SIZE,
+                max_size=DATA_LAYER_POOL_MAX_SIZE,
+                max_inactive_connection_lifetime=DATA_LAYER_POOL_MAX_INACTIVE_LIFETIME,
+            )
+
+    @queue_until_user_message()
+    async def create_step(self, step_dict: StepDict) -> None:
+        """
+        Buffer a write of a step, to be flushed along with the other writes of the following `DATA_LAYER_STEP_FLUSH_DELAY` seconds.
+
+        Args:
+            step_dict (StepDict): The step.
+        """
+        start_time = await self.get_current_timestamp()
+        if step_dict.get("createdAt"):
+            start_time = datetime.strptime(step_dict["createdAt"], ISO_FORMAT)  # noqa: DTZ007 # Naive, like the other timestamps of the table
+
+        self._pending_steps.append(
+            {
+                "id": step_dict["id"],
+                "thread_id": step_dict.get("threadId"),
+                "parent_id": step_dict.get("parentId"),
+                "input": step_dict.get("input"),
+                "metadata": json.dumps(step_dict.get("metadata", {})),
+                "name": step_dict.get("name"),
+                "output": step_dict.get("output"),
+                "type": step_dict["type"],
+                "start_time": start_time,
+                "end_time": start_time,
+                "show_input": str(step_dict.get("showInput", "json")),
+                "is_error": step_dict.get("isError", False),
+            },
+        )
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_steps_later())
+
+    async def _flush_steps_later(self) -> None:
+        await asyncio.sleep(DATA_LAYER_STEP_FLUSH_DELAY)
+        await self.flush_steps()
+
+    async def flush_steps(self) -> None:
+        """
+        Write the buffered steps. If the batch fails (e.g. a thread was deleted since it was last seen), the steps are written
+        one by one after forgetting the known threads and steps, so that only the failing ones are lost.
+        """
+        async with self._flush_lock:
+            pending, self._pending_steps = self._pending_steps, []
+            if not pending:
+                return
+
+            try:
+                await self._write_steps(pending)
+            except Exception:  # noqa: BLE001
+                logger.warning(f"Failed to write a batch of {len(pending)} steps, writing them one by one")
+                metrics.increment("data_layer.step_batches_failed")
+                self._known_threads.clear()
+                self._known_steps.clear()
+
+                for params in pending:
+                    try:
+                        await self._write_steps([params])
+                    except Exception:
+                        logger.exception(f"Failed to write the step {params['id']}")
+
+    async def _write_steps(self, pending: list[dict]) -> None:
+        """
+        Upsert a batch of step writes, merging the writes of the same step and creating their missing threads and parents first.
+
+        Args:
+            pending (list[dict]): The parameters of each write, in the order they were made.
+        """
+        thread_ids = {params["thread_id"] for params in pending if params["thread_id"]} - self._known_threads.keys()
+        if thread_ids:
+            existing = await self.execute_query('SELECT id FROM "Thread" WHERE id = ANY($1::text[])', {"ids": list(thread_ids)})
+            for thread_id in thread_ids - {row["id"] for row in existing}:
+                await self.update_thread(thread_id=thread_id)
+
+        parent_ids = {params["parent_id"] for params in pending if params["parent_id"]} - self._known_steps.keys()
+        missing_parents = set()
+        if parent_ids:
+            existing = await self.execute_query('SELECT id FROM "Step" WHERE id = ANY($1::text[])', {"ids": list(parent_ids)})
+            missing_parents = parent_ids - {row["id"] for row in existing}
+
+        rows: dict[str, dict] = {}
+        for params in pending:
+            # Like Chainlit, a parent that does not exist (yet) when its child is written is created as a placeholder run
+            parent_id = params["parent_id"]
+            if parent_id in missing_parents and parent_id not in rows:
+                rows[parent_id] = {
+                    **dict.fromkeys(_STEP_COLUMNS),
+                    "id": parent_id,
+                    "metadata": "{}",
+                    "type": "run",
+                    "start_time": params["start_time"],
+                    "end_time": params["start_time"],
+                    "show_input": "json",
+                    "is_error": False,
+                }
+
+            step_id = params["id"]
+            rows[step_id] = _merge_step_params(rows[step_id], params) if step_id in rows else params
+
+        if not self.pool:
+            await self.connect()
+
+        async with self.pool.acquire() as connection, connection.transaction():
+            await connection.executemany(_UPSERT_STEP, [tuple(row[column] for column in _STEP_COLUMNS) for row in rows.values()])
+
+        for thread_id in thread_ids:
+            self._known_threads[thread_id] = True
+        for step_id in rows:
+            self._known_steps[step_id] = True
+
+        metrics.increment("data_layer.step_writes", len(pending))
+        metrics.increment("data_layer.steps_upserted", len(rows))
+        metrics.observe("data_layer.step_batch_size", len(rows))
+
+    async def create_element(self, element: Element) -> None:
+        """Write the buffered steps before an element, which references its step."""
+        await self.flush_steps()
+        await super().create_element(element)
+
+    async def upsert_feedback(self, feedback: Feedback) -> str:
+        """Write the buffered steps before a feedback, which references its step."""
+        await self.flush_steps()
+        return await super().upsert_feedback(feedback)
+
+    async def delete_step(self, step_id: str) -> None:
+        """Write the buffered steps before deleting a step, so that a buffered write of it does not bring it back."""
+        await self.flush_steps()
+        self._known_steps.pop(step_id, None)
+        await super().delete_step(step_id)
+
+    async def get_step(self, step_id: str) -> StepDict | None:
+        """Write the buffered steps before reading a step."""
+        await self.flush_steps()
+        return await super().get_step(step_id)
+
+    async def get_favorite_steps(self, user_id: str) -> list[StepDict]:
+        """Write the buffered steps before reading the favorite steps of a user."""
+        await self.flush_steps()
+        return await super().get_favorite_steps(user_id)
+
+    async def get_thread(self, thread_id: str) -> ThreadDict | None:
+        """Write the buffered steps before reading a thread, e.g. when it is resumed."""
+        await self.flush_steps()
+        return await super().get_thread(thread_id)
+
+    async def update_thread(
+        self,
+        thread_id: str,
+        name: str | None = None,
+        user_id: str | None = None,
+        metadata: dict | None = None,
+        tags: list[str] | None = None,
+    ) -> None:
+        """Create or update a thread, which is then known to exist when its steps are written."""
+        await super().update_thread(thread_id, name=name, user_id=user_id, metadata=metadata, tags=tags)
+        self._known_threads[thread_id] = True
+
+    async def delete_thread(self, thread_id: str) -> None:
+        """Write the buffered steps before deleting a thread, so that a buffered write of its steps does not bring it back."""
+        await self.flush_steps()
+        self._known_threads.pop(thread_id, None)
+        await super().delete_thread(thread_id)
+
+    async def list_threads(self, pagination: Pagination, filters: ThreadFilter) -> PaginatedResponse[ThreadDict]:
+        """
+        List the threads of a user, most recently updated first, as Chainlit does, but without counting all the threads of
+        the user for every thread listed (a count that is never used), so that a page only reads the index of the threads of the user.
+
+        Args:
+            pagination (Pagination): The size of the page and the thread it starts after.
+            filters (ThreadFilter): The user and the text the names of the threads are searched for.
+
+        Returns:
+            PaginatedResponse[ThreadDict]: The page of threads.
+        """
+        query = """
+        SELECT t.*, u.identifier AS user_identifier
+        FROM "Thread" t
+        LEFT JOIN "User" u ON t."userId" = u.id
+        WHERE t."deletedAt" IS NULL
+        """
+        params: dict[str, Any] = {}
+
+        if filters.search:
+            params["name"] = f"%{filters.search}%"
+            query += f" AND t.name ILIKE ${len(params)}"
+
+        if filters.userId:
+            params["user_id"] = filters.userId
+            query += f' AND t."userId" = ${len(params)}'
+
+        if pagination.cursor:
+            params["cursor"] = pagination.cursor
+            query += f' AND t."updatedAt" < (SELECT "updatedAt" FROM "Thread" WHERE id = ${len(params)})'
+
+        params["limit"] = pagination.first + 1
+        query += f' ORDER BY t."updatedAt" DESC LIMIT ${len(params)}'
+
+        threads = await self.execute_query(query, params)
+
+        has_next_page = len(threads) > pagination.first
+        thread_dicts = [
+            ThreadDict(
+                id=str(thread["id"]),
+                createdAt=thread["updatedAt"].isoformat(),
+                name=thread["name"],
+                userId=str(thread["userId"]) if thread["userId"] else None,
+                userIdentifier=thread["user_identifier"],
+                metadata=json.loads(thread["metadata"]),
+                steps=[],
+                elements=[],
+                tags=[],
+            )
+            for thread in threads[: pagination.first]
+        ]
+
+        return PaginatedResponse(
+            pageInfo=PageInfo(
+                hasNextPage=has_next_page,
+                startCursor=thread_dicts[0]["id"] if thread_dicts else None,
+                endCursor=thread_dicts[-1]["id"] if thread_dicts else None,
+            ),
+            data=thread_dicts,
+        )
+
+    async def close(self) -> None:
+        """Write the buffered steps before closing the connection pool."""
+        await self.flush_steps()
+        await super().close()
@@ -1,4 +1,22 @@
-from .mysql_controller import MySQLController
-from .pg_controller import PostgresController
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .mysql_controller import MySQLController
+    from .pg_controller import PostgresController
 
 __all__ = ["MySQLController", "PostgresController"]
+
+
+def __getattr__(name: str) -> type:
+    """Import the controllers lazily, so that importing one of them does not load the driver of the other."""
+    if name == "MySQLController":
+        from .mysql_controller import MySQLController  # noqa: PLC0415
+
+        return MySQLController
+    if name == "PostgresController":
+        from .pg_controller import PostgresController  # noqa: PLC0415
+
+        return PostgresController
+
+    msg = f"module {__name__!r} has no attribute {name!r}"
+    raise AttributeError(msg)
@@ -1,17 +1,67 @@
 import logging
+import time
 from abc import ABC, abstractmethod
-from typing import Any
-
-import psycopg
-import pymysql
-from cachetools.func import ttl_cache
-from psycopg.rows import Row  # For type hinting compatibility
+from collections.abc import Generator
+from typing import TYPE_CHECKING, Any
 
+import metrics
 import str_manipulation
-from caching_configs import CACHE_MAX_SIZE, CACHE_TTL
+import workload
+from cache_backends import MISSING, get_cache_backend, make_key, shared_cache
+from caching_configs import CACHE_TTL, METADATA_STORE_TTL, RESULTS_CACHE_TTL
+from connection_factory import connection_identity
+from execution_configs import STREAM_BATCH_SIZE
+from profiling_configs import PROFILE_MAX_DISTINCT, PROFILE_MAX_VALUE_LENGTH
+
+if TYPE_CHECKING:
+    from contextlib import AbstractContextManager
+
+    # The drivers are only imported by the controller of each database type
+    import psycopg
+    import pymysql
+    from psycopg.rows import Row  # For type hinting compatibility
 
 logger = logging.getLogger("webtext2sql")
 
+# The (first word of the) data types whose distinct values are listed when there are only a few of them
+PROFILED_VALUE_TYPES = frozenset(
+    {"char", "character", "varchar", "text", "tinytext", "mediumtext", "longtext", "enum", "set", "user-defined", "citext"},
+)
+# The (first word of the) data types whose range (minimum and maximum) is given
+PROFILED_RANGE_TYPES = frozenset(
+    {"date", "datetime", "timestamp", "time", "year"}
+    | {"tinyint", "smallint", "mediumint", "int", "integer", "bigint"}
+    | {"numeric", "decimal", "real", "double", "float"},
+)
+
+
+class QueryExecutionError(Exception):
+    """
+    Raised when the database fails to execute a query, with what is needed to report the error or repair the query.
+
+    Attributes:
+        query (str): The SQL query that failed.
+        message (str): The error message of the database.
+        code (str | None): The error code of the database (the SQLSTATE on Postgres, the error number on MySQL), if any.
+        interrupted (bool): Whether the query was cancelled or timed out, rather than being invalid.
+    """
+
+    def __init__(self, query: str, message: str, *, code: str | None = None, interrupted: bool = False) -> None:
+        super().__init__(message)
+        self.query = query
+        self.message = message
+        self.code = code
+        self.interrupted = interrupted
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        Get the error as a dictionary, e.g. to be returned by the API.
+
+        Returns:
+            dict[str, Any]: The SQL query, the error message, the error code and whether the query was interrupted.
+        """
+        return {"sql_query": self.query, "error": self.message, "code": self.code, "interrupted": self.interrupted}
+
 
 class BaseDBController(ABC):
     """
@@ -19,15 +69,19 @@ class BaseDBController(ABC):
     Provides common functionality for managing database connections and executing queries.
     """
 
-    _connection: psycopg.Connection | pymysql.Connection
+    _connection: "psycopg.Connection | pymysql.Connection"
+    _query_running: bool = False
+    replica_identity: str | None = None  # The identity of the read replica the controller is connected to, if any
 
     def __init__(self, db_type: str, tcp_details: dict) -> None:
         self.db_type = db_type
         self.tcp_details = tcp_details
         self._user = tcp_details.get("user")
+        # Keys the shared caches, since a controller instance only lives as long as a request
+        self.identity = connection_identity(db_type, tcp_details)
 
     @property
-    def connection(self) -> psycopg.Connection | pymysql.Connection:
+    def connection(self) -> "psycopg.Connection | pymysql.Connection":
         """
         Property to get the current database connection.
         If the connection is not established, it raises an error.
@@ -54,8 +108,13 @@ def get_available_dbs(self) -> list[str]:
         msg = "This method should be implemented by subclasses."
         raise NotImplementedError(msg)
 
-    @ttl_cache(maxsize=1024, ttl=10)
-    def execute_query(self, query: str) -> tuple[tuple[Row | Any], tuple[str]]:
+    @shared_cache(
+        "query_results",
+        ttl=RESULTS_CACHE_TTL,
+        key=lambda self, query: (self.identity, query),
+        condition=lambda result: bool(result[1]),  # Failed queries have no column names
+    )
+    def execute_query(self, query: str) -> tuple[tuple["Row | Any"], tuple[str]]:
         """
         Execute a SQL query and return the results.
 
@@ -64,24 +123,290 @@ def execute_query(self, query: str) -> tuple[tuple[Row | Any], tuple[str]]:
 
         Returns:
             tuple: A tuple containing the results as a list of tuples and the column names.
-            If an error occurs, returns an empty list.
+
+        Raises:
+            QueryExecutionError: If the database fails to execute the query.
         """
+        started = time.perf_counter()
+
         try:
             logger.debug(f"Executing query: {query}")
+            self._query_running = True
 
             with self.connection.cursor() as cursor:
                 cursor.execute(query)
                 results: list[tuple] = cursor.fetchall()
 
-                column_names = (desc[0] for desc in cursor.description)  # This will use the aliases if they are set in the query
+                column_names = tuple(desc[0] for desc in cursor.description)  # This will use the aliases if they are set in the query
+        except Exception as e:
+            self._record_execution(query, started, error=e)
+            raise self._to_query_error(query, e) from e
+        finally:
+            self._query_running = False
+
+        self._record_execution(query, started, rows=results)
+        return tuple(results), column_names
+
+    @shared_cache(
+        "query_previews",
+        ttl=RESULTS_CACHE_TTL,
+        key=lambda self, query, max_rows: (self.identity, query, max_rows),
+        condition=lambda result: bool(result[1]),  # Failed queries have no column names
+    )
+    def execute_query_preview(self, query: str, max_rows: int) -> tuple[tuple["Row | Any"], tuple[str], bool]:
+        """
+        Execute a SQL query but only fetch the first rows of its results.
+        Whenever possible, the query is wrapped with a LIMIT so that the server does not produce the rest of the rows at all.
 
-            return tuple(results), column_names
-        except Exception:
-            logger.exception("An error occurred")
-            # TODO @dyka3773: In case of an sql error, we should return it to the user instead of just logging it.
-            return (), ()
+        Args:
+            query (str): The SQL query to execute.
+            max_rows (int): The maximum number of rows to fetch.
+
+        Returns:
+            tuple: A tuple containing the first rows of the results, the column names
+            and whether the query has more rows than the ones returned.
+
+        Raises:
+            QueryExecutionError: If the database fails to execute the query.
+        """
+        # The execution is recorded under the original query (including the time of a failed limited query), so that it is
+        # aggregated with the executions of the same query that are not previews
+        started = time.perf_counter()
+
+        # One extra row is fetched to find out if there are more rows than the ones previewed
+        limited_query = str_manipulation.limit_query_rows(query, max_rows + 1)
+
+        if limited_query:
+            try:
+                preview = self._fetch_preview(limited_query, max_rows)
+            except Exception as e:
+                # Errors of the query itself are raised right away, instead of running the query again only to get them once more
+                if not self._is_wrapper_error(e):
+                    self._record_execution(query, started, error=e)
+                    raise self._to_query_error(query, e) from e
+
+                # e.g. MySQL does not allow duplicate column names in derived tables, which a `SELECT *` over a join may produce
+                logger.warning(f"The query cannot be wrapped with a LIMIT, falling back to the original one: {e}")
+
+                try:
+                    preview = self._fetch_preview(query, max_rows, streaming=True)
+                except Exception as e:
+                    self._record_execution(query, started, error=e)
+                    raise self._to_query_error(query, e) from e
+
+            self._record_execution(query, started, rows=preview[0])
+            return preview
+
+        # Statements other than a single SELECT (e.g. SHOW or EXPLAIN) only return a few rows,
+        # and Postgres cannot fetch them through a server-side cursor
+        try:
+            preview = self._fetch_preview(query, max_rows)
+        except Exception as e:
+            self._record_execution(query, started, error=e)
+            raise self._to_query_error(query, e) from e
+
+        self._record_execution(query, started, rows=preview[0])
+        return preview
+
+    def _fetch_preview(self, query: str, max_rows: int, *, streaming: bool = False) -> tuple[tuple["Row | Any"], tuple[str], bool]:
+        """
+        Execute a SQL query and fetch up to one row more than the maximum number of rows requested.
+
+        Args:
+            query (str): The SQL query to execute.
+            max_rows (int): The maximum number of rows to return.
+            streaming (bool): Whether to use a server-side cursor, so that only the fetched rows are transferred
+                (for queries whose number of rows is not bounded by a LIMIT).
+
+        Returns:
+            tuple: A tuple containing the first rows of the results, the column names
+            and whether the query has more rows than the ones returned.
+        """
+        try:
+            logger.debug(f"Executing preview query: {query}")
+            self._query_running = True
+
+            with self._get_streaming_cursor() if streaming else self.connection.cursor() as cursor:
+                cursor.execute(query)
+                results: list[tuple] = cursor.fetchmany(max_rows + 1)
+
+                column_names = tuple(desc[0] for desc in cursor.description) if cursor.description else ()
+
+            return tuple(results[:max_rows]), column_names, len(results) > max_rows
         finally:
-            self.connection.commit()  # Commit the transaction if needed
+            self._query_running = False
+
+    def stream_query(self, query: str, batch_size: int = STREAM_BATCH_SIZE) -> Generator[tuple[tuple[str], list["Row | Any"]]]:
+        """
+        Execute a SQL query and stream its results in batches, using a server-side cursor.
+        This way the complete result set is never held in memory at once.
+
+        Args:
+            query (str): The SQL query to execute.
+            batch_size (int): The number of rows to fetch per round-trip.
+
+        Yields:
+            tuple[tuple[str], list]: The column names and the next batch of rows.
+            At least one (possibly empty) batch is yielded so that the column names are always known.
+
+        Raises:
+            QueryExecutionError: If the database fails to execute the query.
+        """
+        logger.debug(f"Streaming query: {query}")
+        self._query_running = True
+
+        started = time.perf_counter()
+        row_count = byte_count = 0
+        error = None
+
+        try:
+            with self._get_streaming_cursor() as cursor:
+                cursor.execute(query)
+                column_names = tuple(desc[0] for desc in cursor.description) if cursor.description else ()
+
+                batch = cursor.fetchmany(batch_size)
+                row_count, byte_count = len(batch), workload.estimate_size(batch)
+                yield column_names, batch
+
+                while len(batch) == batch_size:
+                    batch = cursor.fetchmany(batch_size)
+                    if batch:
+                        row_count, byte_count = row_count + len(batch), byte_count + workload.estimate_size(batch)
+                        yield column_names, batch
+        except Exception as e:
+            error = e
+            raise self._to_query_error(query, e) from e
+        finally:
+            self._query_running = False
+            # The results that were streamed are recorded even if the rest were abandoned
+            if error:
+                self._record_execution(query, started, error=error)
+            else:
+                self._record_execution(query, started, row_count=row_count, byte_count=byte_count)
+
+    def _record_execution(  # noqa: PLR0913
+        self,
+        query: str,
+        started: float,
+        *,
+        rows: "list[tuple] | tuple[tuple, ...] | None" = None,
+        row_count: int | None = None,
+        byte_count: int | None = None,
+        error: Exception | None = None,
+    ) -> None:
+        """
+        Record an execution of a query in the workload store, see `workload.record_execution`.
+
+        Args:
+            query (str): The SQL query.
+            started (float): The `time.perf_counter()` of when the execution started.
+            rows (list[tuple] | tuple[tuple, ...] | None): The fetched rows, to count and size, if they are all at hand.
+            row_count (int | None): The number of rows, if they have been counted already.
+            byte_count (int | None): The estimated size of the rows in bytes, if it has been estimated already.
+            error (Exception | None): The error raised by the driver, if the query failed.
+        """
+        if rows is not None:
+            row_count, byte_count = len(rows), workload.estimate_size(rows)
+
+        workload.record_execution(
+            query,
+            connection_identity=self.identity,
+            duration_ms=(time.perf_counter() - started) * 1000,
+            row_count=row_count,
+            byte_count=byte_count,
+            error=error,
+        )
+
+    @abstractmethod
+    def _get_streaming_cursor(self) -> "AbstractContextManager[psycopg.Cursor | pymysql.cursors.Cursor]":
+        """
+        Create a server-side cursor, which fetches the results of a query in batches instead of all at once.
+
+        Returns:
+            AbstractContextManager[psycopg.Cursor | pymysql.cursors.Cursor]: The server-side cursor, to be used as a context manager.
+        """
+        msg = "This method should be implemented by subclasses."
+        raise NotImplementedError(msg)
+
+    def _to_query_error(self, query: str, error: Exception) -> QueryExecutionError:
+        """
+        Convert an error raised by the driver while executing a query to a `QueryExecutionError`.
+
+        Args:
+            query (str): The SQL query that failed.
+            error (Exception): The error raised by the driver.
+
+        Returns:
+            QueryExecutionError: The error, with the details given by the database.
+        """
+        code, message = self._describe_error(error)
+        logger.warning(f"Failed to execute query ({code}): {message}")
+        return QueryExecutionError(query, message, code=code, interrupted=self._is_interrupted_error(error))
+
+    @staticmethod
+    @abstractmethod
+    def _describe_error(error: Exception) -> tuple[str | None, str]:
+        """
+        Get the error code and the error message given by the database out of an error raised by the driver.
+
+        Args:
+            error (Exception): The error raised while executing a query.
+
+        Returns:
+            tuple[str | None, str]: The error code (if any) and the error message.
+        """
+        msg = "This method should be implemented by subclasses."
+        raise NotImplementedError(msg)
+
+    @staticmethod
+    @abstractmethod
+    def _is_interrupted_error(error: Exception) -> bool:
+        """
+        Check whether an error was raised because the query was cancelled or timed out.
+
+        Args:
+            error (Exception): The error raised while executing a query.
+
+        Returns:
+            bool: True if the query was interrupted, False otherwise.
+        """
+        msg = "This method should be implemented by subclasses."
+        raise NotImplementedError(msg)
+
+    @staticmethod
+    @abstractmethod
+    def _is_wrapper_error(error: Exception) -> bool:
+        """
+        Check whether an error was raised because of the derived table a previewed query is wrapped in, see `limit_query_rows`.
+
+        Args:
+            error (Exception): The error raised while executing the wrapped query.
+
+        Returns:
+            bool: True if the query itself may still succeed without the wrapper, False otherwise.
+        """
+        msg = "This method should be implemented by subclasses."
+        raise NotImplementedError(msg)
+
+    @abstractmethod
+    def _configure_session(self) -> None:
+        """
+        Configure the session of the current connection once, when it is opened, for running generated queries:
+        read-only and in autocommit mode (so that no query holds a snapshot or locks after it is done, and no extra
+        round-trip is needed to end its transaction), with the execution time and the resources of each statement bounded.
+        """
+        msg = "This method should be implemented by subclasses."
+        raise NotImplementedError(msg)
+
+    @abstractmethod
+    def cancel_running_query(self) -> None:
+        """
+        Cancel the query currently running on the current connection, if any.
+        This is meant to be called from a different thread than the one executing the query,
+        so that the database server frees the resources of an abandoned query immediately.
+        """
+        msg = "This method should be implemented by subclasses."
+        raise NotImplementedError(msg)
 
     @abstractmethod
     def _get_db_tables_for_user(self, schema: str) -> list[str]:
@@ -112,10 +437,32 @@ def _get_table_ddl(self, schema: str, table_name: str) -> str:
         msg = "This method should be implemented by subclasses."
         raise NotImplementedError(msg)
 
-    @ttl_cache(maxsize=CACHE_MAX_SIZE, ttl=CACHE_TTL)
+    @abstractmethod
+    def _get_table_change_markers(self, schema: str) -> dict[str, str]:
+        """
+        Retrieve a marker of the definition of each table of a schema with a single catalog query,
+        which changes whenever the DDL of the table may have changed (e.g. when it is altered or recreated).
+
+        Args:
+            schema (str): Schema name to filter tables.
+
+        Returns:
+            dict[str, str]: The change marker of each table by name.
+        """
+        msg = "This method should be implemented by subclasses."
+        raise NotImplementedError(msg)
+
+    @shared_cache(
+        "db_metadata",
+        ttl=CACHE_TTL,
+        key=lambda self, schema=None: (self.identity, schema),
+        condition=bool,  # An empty metadata list means that fetching it failed
+    )
     def get_db_metadata(self, schema: str | None = None) -> list[str]:
         """
         Retrieve the metadata of the database tables available to the user in a given schema.
+        The DDL of each table is stored along with its change marker (see `_get_table_change_markers`),
+        so that only the tables that have been added or altered since the last time are introspected again.
 
         Args:
             schema (str | None): Schema name to filter tables. If None, all schemas are considered.
@@ -126,30 +473,162 @@ def get_db_metadata(self, schema: str | None = None) -> list[str]:
         logger.debug("Fetching all database tables available to the user")
         tables: list[str] = self._get_db_tables_for_user(schema=schema)
 
+        try:
+            markers = self._get_table_change_markers(schema)
+        except Exception:
+            logger.exception(f"Failed to fetch the change markers of the tables of schema: {schema}")
+            markers = {}
+
+        # The DDL of each table (as a `(marker, ddl)` pair by name) as of the last time the metadata was fetched
+        store_key = make_key("table_ddl", self.identity, schema)
+        stored: dict[str, tuple[str | None, str]] = get_cache_backend().get(store_key)
+        if stored is MISSING:
+            stored = {}
+
+        store: dict[str, tuple[str | None, str]] = {}
         metadata: list[str] = []
+        reintrospected = 0
 
         for table_name in tables:
-            try:
-                logger.debug(f"Fetching metadata & DDL for table: {table_name}")
+            marker = markers.get(table_name)
+
+            # Tables without a marker (e.g. if fetching the markers failed) are always introspected
+            if marker is not None and stored.get(table_name, (None, None))[0] == marker:
+                trimmed_ddl = stored[table_name][1]
+            else:
+                reintrospected += 1
+                trimmed_ddl = self._fetch_table_metadata(table_name, schema)
+                if trimmed_ddl is None:
+                    continue
 
-                table_ddl = self._get_table_ddl(table_name=table_name, schema=schema)
+            store[table_name] = (marker, trimmed_ddl)
+            metadata.append(trimmed_ddl)
 
-                logger.debug(f"DDL for table {table_name}:\n{table_ddl}")
+        metrics.increment("metadata.tables_reintrospected", reintrospected)
+        metrics.increment("metadata.tables_reused", len(tables) - reintrospected)
+        logger.debug(f"Reused the DDL of {len(tables) - reintrospected} tables and introspected {reintrospected} tables of schema: {schema}")
 
-                if table_ddl is None:
-                    logger.error(f"Failed to retrieve metadata for table: {table_name}")
-                    continue
+        # Dropped tables are left out of the new store, so it is also written when only they changed
+        if store != stored:
+            get_cache_backend().set(store_key, store, METADATA_STORE_TTL)
+
+        return metadata
+
+    def _fetch_table_metadata(self, table_name: str, schema: str | None) -> str | None:
+        """
+        Introspect a table and optimize its DDL to be included in prompts.
+
+        Args:
+            table_name (str): Name of the table.
+            schema (str | None): Schema name where the table is located.
+
+        Returns:
+            str | None: The optimized DDL of the table, or None if it could not be retrieved.
+        """
+        try:
+            logger.debug(f"Fetching metadata & DDL for table: {table_name}")
+
+            table_ddl = self._get_table_ddl(table_name=table_name, schema=schema)
+
+            logger.debug(f"DDL for table {table_name}:\n{table_ddl}")
+
+            if table_ddl is None:
+                logger.error(f"Failed to retrieve metadata for table: {table_name}")
+                return None
+
+            # Optimize the DDL string to use less tokens
+            return str_manipulation.optimize_ddl_for_ai(table_ddl)
+
+        except Exception:
+            logger.exception(f"An error occurred while fetching metadata for table {table_name}")
+            return None
+
+    def list_tables(self, schema: str) -> list[str]:
+        """
+        Retrieve the names of the tables of a schema available to the user.
+
+        Args:
+            schema (str): The schema name.
+
+        Returns:
+            list[str]: The table names.
+        """
+        return self._get_db_tables_for_user(schema=schema)
+
+    @abstractmethod
+    def get_replication_lag(self) -> float | None:
+        """
+        Get how far behind its primary the database server is, for routing reads to the replicas of a connection.
+
+        Returns:
+            float | None: The replication lag in seconds (0 if the server is not a replica),
+            or None if the server is a replica that is not replicating.
+        """
+        msg = "This method should be implemented by subclasses."
+        raise NotImplementedError(msg)
+
+    @abstractmethod
+    def profile_table(self, schema: str, table_name: str) -> dict[str, dict]:
+        """
+        Profile the columns of a table, without scanning it:
+        the distinct values of the text columns with only a few of them and the range of the numeric and temporal columns.
 
-                # Optimize the DDL string to use less tokens
-                trimmed_ddl = str_manipulation.optimize_ddl_for_ai(table_ddl)
+        Args:
+            schema (str): Schema name where the table is located.
+            table_name (str): Name of the table to profile.
 
-                metadata.append(trimmed_ddl)
+        Returns:
+            dict[str, dict]: The profile of each profiled column by name, either as `{"values": [...]}` or as `{"min": ..., "max": ...}`.
+        """
+        msg = "This method should be implemented by subclasses."
+        raise NotImplementedError(msg)
 
-            except Exception:
-                logger.exception(f"An error occurred while fetching metadata for table {table_name}")
+    @staticmethod
+    def _get_profiled_type(data_type: str) -> str | None:
+        """
+        Get the kind of profile of a column out of its data type.
+
+        Args:
+            data_type (str): The data type of the column, as given by `information_schema.columns`.
+
+        Returns:
+            str | None: "values", "range" or None if columns of this type are not profiled.
+        """
+        base_type = data_type.lower().split("(")[0].split(" ")[0]
+
+        if base_type in PROFILED_VALUE_TYPES:
+            return "values"
+        if base_type in PROFILED_RANGE_TYPES:
+            return "range"
+        return None
+
+    @staticmethod
+    def _profile_rows(column_names: list[str], column_kinds: list[str], rows: list[tuple]) -> dict[str, dict]:
+        """
+        Profile the columns of a table out of a sample of its rows.
+
+        Args:
+            column_names (list[str]): The names of the sampled columns.
+            column_kinds (list[str]): The kind of profile of each column ("values" or "range").
+            rows (list[tuple]): The sampled rows.
+
+        Returns:
+            dict[str, dict]: The profile of each profiled column by name, as returned by `profile_table`.
+        """
+        profiles: dict[str, dict] = {}
+
+        for index, (column_name, kind) in enumerate(zip(column_names, column_kinds, strict=True)):
+            values = {row[index] for row in rows if row[index] is not None}
+            if not values:
                 continue
 
-        return metadata
+            if kind == "range":
+                profiles[column_name] = {"min": str(min(values)), "max": str(max(values))}
+            # Values that hardly repeat within the sample are not categories, even if there are few of them
+            elif len(values) <= PROFILE_MAX_DISTINCT and len(values) * 2 <= len(rows):
+                profiles[column_name] = {"values": sorted(str(value)[:PROFILE_MAX_VALUE_LENGTH] for value in values)}
+
+        return profiles
 
     @staticmethod
     @abstractmethod
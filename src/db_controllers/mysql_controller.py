@@ -6,9 +6,16 @@
 
 from caching_configs import CACHE_MAX_SIZE, CACHE_TTL
 from db_controllers.base_db_controller import BaseDBController
+from execution_configs import SESSION_TMP_TABLE_SIZE, STATEMENT_TIMEOUT_MS
+from profiling_configs import PROFILE_SAMPLE_ROWS
 
 logger = logging.getLogger("webtext2sql")
 
+ER_QUERY_INTERRUPTED = 1317  # Raised when a query is killed with `KILL QUERY`
+ER_QUERY_TIMEOUT = 3024  # Raised when a query exceeds the `max_execution_time`
+ER_TOO_LONG_IDENT = 1059  # Raised when a column of a derived table is named after an expression longer than 64 characters
+ER_DUP_FIELDNAME = 1060  # Raised when a derived table has duplicate column names, e.g. of a `SELECT *` over a join
+
 
 class MySQLController(BaseDBController):
     """
@@ -19,10 +26,10 @@ class MySQLController(BaseDBController):
     def __init__(self, tcp_details: dict | None = None) -> None:
         super().__init__(db_type="mysql", tcp_details=tcp_details if tcp_details else {})
         if tcp_details is not None:
-            self._connection: sql.Connection = sql.connect(**tcp_details)
+            self._connection: sql.Connection = sql.connect(**tcp_details, autocommit=True)
+            self._configure_session()
 
     @override
-    @ttl_cache(maxsize=CACHE_MAX_SIZE, ttl=CACHE_TTL)
     def get_available_dbs(self) -> list[str]:
         """
         Retrieve the names of all databases available to the user.
@@ -66,14 +73,19 @@ def _get_db_tables_for_user(self, schema: str | None = None) -> list[str]:
             list: list of table names in the specified schema.
         """
         with self.connection.cursor() as cursor:
-            cursor.execute(f"""
+            # The `%` of the patterns are doubled, since the query is formatted with the bound parameters
+            cursor.execute(
+                """
                 SELECT table_name
                 FROM information_schema.tables
-                WHERE table_schema = '{schema}'
-                AND table_name NOT LIKE 'mysql_%'
-                AND table_name NOT LIKE 'sys_%'
-                AND table_name NOT LIKE 'performance_schema_%';
-            """)
+                WHERE table_schema = %s
+                AND table_name NOT LIKE 'mysql_%%'
+                AND table_name NOT LIKE 'sys_%%'
+                AND table_name NOT LIKE 'performance_schema_%%'
+                ORDER BY table_name;
+                """,
+                (schema,),
+            )
             tables: list = cursor.fetchall()
 
         if not tables:
@@ -86,7 +98,44 @@ def _get_db_tables_for_user(self, schema: str | None = None) -> list[str]:
         return table_names
 
     @override
-    @ttl_cache(maxsize=CACHE_MAX_SIZE, ttl=CACHE_TTL)
+    def _get_table_change_markers(self, schema: str) -> dict[str, str]:
+        """
+        Retrieve a marker of the definition of each table of a schema out of `information_schema`:
+        the creation time of the table (which changes when it is recreated or rebuilt by an ALTER) along with checksums
+        of its comment, columns, indexes and foreign keys (since instant ALTERs, e.g. adding a column, keep the creation time).
+        The update time is left out, since it changes with the data rather than with the DDL.
+
+        Args:
+            schema (str): Schema name to filter tables.
+
+        Returns:
+            dict[str, str]: The change marker of each table by name.
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT
+                    t.TABLE_NAME,
+                    CONCAT_WS(
+                        ':',
+                        t.CREATE_TIME,
+                        CRC32(t.TABLE_COMMENT),
+                        (SELECT SUM(CRC32(CONCAT_WS('|', c.ORDINAL_POSITION, c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE, c.COLUMN_DEFAULT, c.EXTRA, c.COLUMN_COMMENT)))
+                            FROM information_schema.columns c WHERE c.TABLE_SCHEMA = t.TABLE_SCHEMA AND c.TABLE_NAME = t.TABLE_NAME),
+                        (SELECT SUM(CRC32(CONCAT_WS('|', s.INDEX_NAME, s.SEQ_IN_INDEX, s.COLUMN_NAME, s.NON_UNIQUE)))
+                            FROM information_schema.statistics s WHERE s.TABLE_SCHEMA = t.TABLE_SCHEMA AND s.TABLE_NAME = t.TABLE_NAME),
+                        (SELECT SUM(CRC32(CONCAT_WS('|', k.CONSTRAINT_NAME, k.COLUMN_NAME, k.REFERENCED_TABLE_NAME, k.REFERENCED_COLUMN_NAME)))
+                            FROM information_schema.key_column_usage k
+                            WHERE k.TABLE_SCHEMA = t.TABLE_SCHEMA AND k.TABLE_NAME = t.TABLE_NAME AND k.REFERENCED_TABLE_NAME IS NOT NULL)
+                    )
+                FROM information_schema.tables t
+                WHERE t.TABLE_SCHEMA = %s
+                """,
+                (schema,),
+            )
+            return dict(cursor.fetchall())
+
+    @override
     def _get_table_ddl(self, table_name: str, schema: str | None = None) -> str:
         """
         Retrieve the DDL (Data Definition Language) statement for a specific table.
@@ -100,7 +149,8 @@ def _get_table_ddl(self, table_name: str, schema: str | None = None) -> str:
         """
         try:
             with self.connection.cursor() as cursor:
-                cursor.execute(f"""SHOW CREATE TABLE `{schema}`.`{table_name}`;""")
+                # SHOW statements do not accept bound parameters, so the (quoted) identifiers are inlined
+                cursor.execute(f"SHOW CREATE TABLE {_quote_identifier(schema)}.{_quote_identifier(table_name)};")
                 result = cursor.fetchone()
 
         except sql.Error:
@@ -113,6 +163,190 @@ def _get_table_ddl(self, table_name: str, schema: str | None = None) -> str:
 
         return result[1]
 
+    @override
+    def profile_table(self, schema: str, table_name: str) -> dict[str, dict]:
+        """
+        Profile the columns of a table out of its first `PROFILE_SAMPLE_ROWS` rows.
+        MySQL has neither column statistics that are kept up to date nor `TABLESAMPLE`, and a random sample would scan the whole table.
+
+        Args:
+            schema (str): Schema name where the table is located.
+            table_name (str): Name of the table to profile.
+
+        Returns:
+            dict[str, dict]: The profile of each profiled column by name, either as `{"values": [...]}` or as `{"min": ..., "max": ...}`.
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT COLUMN_NAME, DATA_TYPE
+                FROM information_schema.columns
+                WHERE TABLE_SCHEMA = %s
+                AND TABLE_NAME = %s
+                ORDER BY ORDINAL_POSITION
+                """,
+                (schema, table_name),
+            )
+            columns = [(column[0], self._get_profiled_type(column[1])) for column in cursor.fetchall()]
+            columns = [column for column in columns if column[1]]
+
+            if not columns:
+                return {}
+
+            column_list = ", ".join(_quote_identifier(column[0]) for column in columns)
+            cursor.execute(
+                f"SELECT {column_list} FROM {_quote_identifier(schema)}.{_quote_identifier(table_name)} LIMIT %s",  # The identifiers are quoted
+                (PROFILE_SAMPLE_ROWS,),
+            )
+            rows = cursor.fetchall()
+
+        return self._profile_rows([column[0] for column in columns], [column[1] for column in columns], rows)
+
+    @override
+    def get_replication_lag(self) -> float | None:
+        """
+        Get how far behind its source the database server is, as reported by `SHOW REPLICA STATUS`.
+
+        Returns:
+            float | None: The replication lag in seconds (0 if the server is not a replica),
+            or None if the replication threads of the replica are not running.
+        """
+        with self.connection.cursor() as cursor:
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except sql.err.ProgrammingError:
+                # Before MySQL 8.0.22 (and MariaDB 10.5.1)
+                cursor.execute("SHOW SLAVE STATUS")
+
+            row = cursor.fetchone()
+            if row is None:
+                return 0.0
+
+            status = dict(zip((desc[0] for desc in cursor.description), row, strict=True))
+
+        lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+        return None if lag is None else float(lag)
+
+    @override
+    def _fetch_preview(self, query: str, max_rows: int, *, streaming: bool = False) -> tuple[tuple, tuple[str], bool]:
+        """
+        Execute a SQL query and fetch up to one row more than the maximum number of rows requested.
+        Closing an unbuffered cursor still reads the rest of the rows off the connection, so when streaming,
+        the server is also told to stop after the fetched rows through the `sql_select_limit` of the session.
+
+        Args:
+            query (str): The SQL query to execute.
+            max_rows (int): The maximum number of rows to return.
+            streaming (bool): Whether to use an unbuffered cursor, for queries whose number of rows is not bounded by a LIMIT.
+
+        Returns:
+            tuple: A tuple containing the first rows of the results, the column names
+            and whether the query has more rows than the ones returned.
+        """
+        if not streaming:
+            return super()._fetch_preview(query, max_rows)
+
+        with self.connection.cursor() as cursor:
+            cursor.execute("SET SESSION sql_select_limit = %s", (max_rows + 1,))
+
+        try:
+            return super()._fetch_preview(query, max_rows, streaming=True)
+        finally:
+            with self.connection.cursor() as cursor:
+                cursor.execute("SET SESSION sql_select_limit = DEFAULT")
+
+    @override
+    def _get_streaming_cursor(self) -> sql.cursors.SSCursor:
+        """
+        Create an unbuffered cursor, which fetches the results of a query in batches instead of all at once.
+
+        Returns:
+            sql.cursors.SSCursor: The unbuffered cursor.
+        """
+        return self.connection.cursor(sql.cursors.SSCursor)
+
+    @override
+    @staticmethod
+    def _describe_error(error: Exception) -> tuple[str | None, str]:
+        """
+        Get the error number and the message of an error raised while executing a query.
+
+        Args:
+            error (Exception): The error raised while executing a query.
+
+        Returns:
+            tuple[str | None, str]: The error number (if any) and the error message.
+        """
+        # e.g. `pymysql.err.OperationalError(1054, "Unknown column 'x' in 'field list'")`
+        if isinstance(error, sql.Error) and len(error.args) == 2 and isinstance(error.args[0], int):  # noqa: PLR2004
+            return str(error.args[0]), str(error.args[1]).strip()
+
+        return None, str(error).strip()
+
+    @override
+    @staticmethod
+    def _is_interrupted_error(error: Exception) -> bool:
+        """
+        Check whether an error was raised because the query was killed or exceeded the `max_execution_time`.
+
+        Args:
+            error (Exception): The error raised while executing a query.
+
+        Returns:
+            bool: True if the query was interrupted, False otherwise.
+        """
+        return isinstance(error, sql.Error) and bool(error.args) and error.args[0] in (ER_QUERY_INTERRUPTED, ER_QUERY_TIMEOUT)
+
+    @override
+    @staticmethod
+    def _is_wrapper_error(error: Exception) -> bool:
+        """
+        Check whether an error was raised because the columns of a previewed query are not valid columns of a derived table.
+
+        Args:
+            error (Exception): The error raised while executing the wrapped query.
+
+        Returns:
+            bool: True if the query itself may still succeed without the wrapper, False otherwise.
+        """
+        return isinstance(error, sql.Error) and bool(error.args) and error.args[0] in (ER_TOO_LONG_IDENT, ER_DUP_FIELDNAME)
+
+    @override
+    def _configure_session(self) -> None:
+        """
+        Make the transactions of the current session read-only and set its `max_execution_time` and `tmp_table_size`.
+        The connection is in autocommit mode, so every statement runs in a (read-only) transaction of its own.
+        Note: MySQL only enforces the `max_execution_time` on read-only SELECT statements.
+        """
+        logger.debug(f"Configuring a read-only session with max_execution_time = {STATEMENT_TIMEOUT_MS} ms")
+
+        with self.connection.cursor() as cursor:
+            cursor.execute("SET SESSION TRANSACTION READ ONLY")
+            cursor.execute(
+                "SET SESSION max_execution_time = %s, SESSION tmp_table_size = %s",
+                (int(STATEMENT_TIMEOUT_MS), int(SESSION_TMP_TABLE_SIZE)),
+            )
+
+    @override
+    def cancel_running_query(self) -> None:
+        """
+        Cancel the query currently running on the current connection, if any.
+        MySQL can only do this through `KILL QUERY` from a second connection, since the first one is busy.
+        """
+        if not self._query_running:
+            logger.debug("No running query to cancel.")
+            return
+
+        thread_id = self.connection.thread_id()
+
+        try:
+            logger.info(f"Cancelling the running query of connection: {thread_id}")
+
+            with sql.connect(**self.tcp_details) as killer_connection, killer_connection.cursor() as cursor:
+                cursor.execute("KILL QUERY %s", (thread_id,))
+        except sql.Error:
+            logger.exception("Failed to cancel the running query.")
+
     @override
     @staticmethod
     def try_establish_connection(tcp_details: dict) -> bool:
@@ -134,3 +368,16 @@ def try_establish_connection(tcp_details: dict) -> bool:
         except sql.Error:
             logger.exception("Failed to establish a connection.")
             return False
+
+
+def _quote_identifier(identifier: str) -> str:
+    """
+    Quote an identifier (e.g. a table name) to be used in a query.
+
+    Args:
+        identifier (str): The identifier.
+
+    Returns:
+        str: The identifier in backticks, with any backticks in it escaped.
+    """
+    return "`" + identifier.replace("`", "``") + "`"
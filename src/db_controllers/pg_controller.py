@@ -1,11 +1,17 @@
+import csv
 import logging
+from collections.abc import Generator
+from contextlib import contextmanager
 from typing import TYPE_CHECKING, override
 
 import psycopg as sql
 from cachetools.func import ttl_cache
+from psycopg import sql as sql_composition
 
 from caching_configs import CACHE_MAX_SIZE, CACHE_TTL
 from db_controllers.base_db_controller import BaseDBController
+from execution_configs import SESSION_TEMP_FILE_LIMIT, SESSION_WORK_MEM, STATEMENT_TIMEOUT_MS
+from profiling_configs import PROFILE_MAX_DISTINCT, PROFILE_MAX_VALUE_LENGTH, PROFILE_SAMPLE_ROWS
 
 if TYPE_CHECKING:
     from psycopg.rows import Row
@@ -22,10 +28,10 @@ class PostgresController(BaseDBController):
     def __init__(self, tcp_details: dict | None = None) -> None:
         super().__init__(db_type="postgres", tcp_details=tcp_details if tcp_details else {})
         if tcp_details is not None:
-            self._connection: sql.Connection = sql.connect(**tcp_details)
+            self._connection: sql.Connection = sql.connect(**tcp_details, autocommit=True)
+            self._configure_session()
 
     @override
-    @ttl_cache(maxsize=CACHE_MAX_SIZE, ttl=CACHE_TTL)
     def get_available_dbs(self) -> list[str]:
         """
         Retrieve the names of all database schemas available to the user.
@@ -68,12 +74,17 @@ def _get_db_tables_for_user(self, schema: str | None = None) -> list[str]:
             list: list of table names in the specified schema.
         """
         with self.connection.cursor() as cursor:
-            cursor.execute(f"""SELECT DISTINCT table_name
+            cursor.execute(
+                """SELECT DISTINCT table_name
                         FROM information_schema.role_table_grants
                         WHERE privilege_type = 'SELECT'
-                        AND grantee = '{self._user}'
-                        AND table_schema = '{schema}';
-                   """)
+                        AND grantee = %s
+                        AND table_schema = %s
+                        ORDER BY table_name;
+                """,
+                (self._user, schema),
+                prepare=True,
+            )
             tables: list[Row] = cursor.fetchall()
 
         if not tables:
@@ -86,7 +97,48 @@ def _get_db_tables_for_user(self, schema: str | None = None) -> list[str]:
         return table_names
 
     @override
-    @ttl_cache(maxsize=CACHE_MAX_SIZE, ttl=CACHE_TTL)
+    def _get_table_change_markers(self, schema: str) -> dict[str, str]:
+        """
+        Retrieve a marker of the definition of each table of a schema out of the catalog rows its DDL is built from.
+        Every row of the catalog records the transaction that last wrote it (`xmin`), so altering a table changes the `xmin`
+        of its `pg_class` row or of the rows of its columns, defaults, constraints or comments.
+        The `relfilenode` changes when the table is rewritten (e.g. truncated or recreated by a migration).
+
+        Args:
+            schema (str): Schema name to filter tables.
+
+        Returns:
+            dict[str, str]: The change marker of each table by name.
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT
+                    c.relname,
+                    concat_ws(
+                        ':',
+                        c.relfilenode,
+                        c.xmin,
+                        (SELECT md5(string_agg(a.attnum || '/' || a.xmin, ',' ORDER BY a.attnum))
+                            FROM pg_attribute a WHERE a.attrelid = c.oid AND a.attnum > 0),
+                        (SELECT md5(string_agg(ad.adnum || '/' || ad.xmin, ',' ORDER BY ad.adnum))
+                            FROM pg_attrdef ad WHERE ad.adrelid = c.oid),
+                        (SELECT md5(string_agg(co.oid || '/' || co.xmin, ',' ORDER BY co.oid))
+                            FROM pg_constraint co WHERE co.conrelid = c.oid),
+                        (SELECT md5(string_agg(d.objsubid || '/' || d.xmin, ',' ORDER BY d.objsubid))
+                            FROM pg_description d WHERE d.objoid = c.oid AND d.classoid = 'pg_class'::regclass)
+                    )
+                FROM pg_class c
+                JOIN pg_namespace n ON c.relnamespace = n.oid
+                WHERE n.nspname = %s
+                AND c.relkind IN ('r', 'p', 'v', 'm', 'f')
+                """,
+                (schema,),
+                prepare=True,
+            )
+            return dict(cursor.fetchall())
+
+    @override
     def _get_table_ddl(self, table_name: str, schema: str | None = None) -> str:
         """
         Retrieve the DDL (Data Definition Language) statement for a specific table.
@@ -103,7 +155,8 @@ def _get_table_ddl(self, table_name: str, schema: str | None = None) -> str:
         try:
             with self.connection.cursor() as cur:
                 # Get column definitions
-                cur.execute(f"""
+                cur.execute(
+                    """
                     SELECT
                         a.attname AS column_name,
                         pg_catalog.format_type(a.atttypid, a.atttypmod) AS data_type,
@@ -115,12 +168,15 @@ def _get_table_ddl(self, table_name: str, schema: str | None = None) -> str:
                     JOIN pg_namespace n ON c.relnamespace = n.oid
                     LEFT JOIN pg_attrdef ad ON a.attrelid = ad.adrelid AND a.attnum = ad.adnum
                     LEFT JOIN pg_description d ON d.objoid = a.attrelid AND d.objsubid = a.attnum
-                    WHERE c.relname = '{table_name}'
-                    AND n.nspname = '{schema}'
+                    WHERE c.relname = %s
+                    AND n.nspname = %s
                     AND a.attnum > 0
                     AND NOT a.attisdropped
                     ORDER BY a.attnum
-                """)
+                    """,
+                    (table_name, schema),
+                    prepare=True,
+                )
 
                 columns = cur.fetchall()
                 col_lines = []  # list to hold column definitions
@@ -134,24 +190,29 @@ def _get_table_ddl(self, table_name: str, schema: str | None = None) -> str:
                     col_lines.append(col_def)
 
                 # Get primary key
-                cur.execute(f"""
+                cur.execute(
+                    """
                     SELECT kcu.column_name
                     FROM information_schema.table_constraints tc
                     JOIN information_schema.key_column_usage kcu
                     ON tc.constraint_name = kcu.constraint_name
                     AND tc.constraint_schema = kcu.constraint_schema
                     WHERE tc.constraint_type = 'PRIMARY KEY'
-                    AND tc.table_name = '{table_name}'
-                    AND tc.table_schema = '{schema}'
+                    AND tc.table_name = %s
+                    AND tc.table_schema = %s
                     ORDER BY kcu.ordinal_position
-                """)
+                    """,
+                    (table_name, schema),
+                    prepare=True,
+                )
 
                 pk_cols = [f'"{row[0]}"' for row in cur.fetchall()]
                 if pk_cols:
                     col_lines.append(f"    PRIMARY KEY ({', '.join(pk_cols)})")
 
                 # Get foreign keys
-                cur.execute(f"""
+                cur.execute(
+                    """
                     SELECT
                         tc.constraint_name,
                         kcu.column_name,
@@ -164,9 +225,13 @@ def _get_table_ddl(self, table_name: str, schema: str | None = None) -> str:
                     JOIN information_schema.constraint_column_usage ccu
                     ON tc.constraint_name = ccu.constraint_name AND tc.table_schema = ccu.constraint_schema
                     WHERE tc.constraint_type = 'FOREIGN KEY'
-                    AND tc.table_name = '{table_name}'
-                    AND tc.table_schema = '{schema}'
-                """)
+                    AND tc.table_name = %s
+                    AND tc.table_schema = %s
+                    ORDER BY tc.constraint_name, kcu.ordinal_position
+                    """,
+                    (table_name, schema),
+                    prepare=True,
+                )
 
                 fk_constraints = cur.fetchall()
                 for fk in fk_constraints:
@@ -176,15 +241,19 @@ def _get_table_ddl(self, table_name: str, schema: str | None = None) -> str:
                 ddl += ",\n".join(col_lines) + "\n);\n"
 
                 # Add table comment
-                cur.execute(f"""
+                cur.execute(
+                    """
                     SELECT d.description
                     FROM pg_description d
                     JOIN pg_class c ON d.objoid = c.oid
                     JOIN pg_namespace n ON c.relnamespace = n.oid
-                    WHERE c.relname = '{table_name}'
-                    AND n.nspname = '{schema}'
+                    WHERE c.relname = %s
+                    AND n.nspname = %s
                     AND d.objsubid = 0
-                """)
+                    """,
+                    (table_name, schema),
+                    prepare=True,
+                )
                 table_comment = cur.fetchone()
                 if table_comment and table_comment[0]:
                     ddl += f"\nCOMMENT ON TABLE {schema}.{table_name} IS '{table_comment[0]}';"
@@ -200,6 +269,226 @@ def _get_table_ddl(self, table_name: str, schema: str | None = None) -> str:
 
         return ddl
 
+    @override
+    def profile_table(self, schema: str, table_name: str) -> dict[str, dict]:
+        """
+        Profile the columns of a table out of the statistics gathered by ANALYZE (`pg_stats`), which costs nothing to the server.
+        Only a table that has never been analyzed is sampled instead, with `TABLESAMPLE`.
+
+        Args:
+            schema (str): Schema name where the table is located.
+            table_name (str): Name of the table to profile.
+
+        Returns:
+            dict[str, dict]: The profile of each profiled column by name, either as `{"values": [...]}` or as `{"min": ..., "max": ...}`.
+        """
+        with self.connection.cursor() as cursor:
+            # The arrays of pg_stats are of the pseudo-type anyarray, which can only be cast to text
+            cursor.execute(
+                """
+                SELECT c.column_name, c.data_type, s.n_distinct, s.most_common_vals::text, s.histogram_bounds::text
+                FROM information_schema.columns c
+                LEFT JOIN pg_stats s ON s.schemaname = c.table_schema AND s.tablename = c.table_name AND s.attname = c.column_name
+                WHERE c.table_schema = %s
+                AND c.table_name = %s
+                ORDER BY c.ordinal_position
+                """,
+                (schema, table_name),
+                prepare=True,
+            )
+            columns = cursor.fetchall()
+
+        profiled_columns = [(column[0], self._get_profiled_type(column[1]), *column[2:]) for column in columns]
+        profiled_columns = [column for column in profiled_columns if column[1]]
+
+        if not profiled_columns:
+            return {}
+
+        if all(column[2] is None for column in profiled_columns):
+            logger.debug(f"No statistics found for table {schema}.{table_name}, sampling it instead")
+            column_names, column_kinds = [column[0] for column in profiled_columns], [column[1] for column in profiled_columns]
+            return self._profile_table_sample(schema, table_name, column_names, column_kinds)
+
+        profiles: dict[str, dict] = {}
+
+        for column_name, kind, n_distinct, most_common_vals, histogram_bounds in profiled_columns:
+            if kind == "values" and most_common_vals and 0 < n_distinct <= PROFILE_MAX_DISTINCT:
+                values = _parse_array_literal(most_common_vals)
+                if values:
+                    profiles[column_name] = {"values": sorted(value[:PROFILE_MAX_VALUE_LENGTH] for value in values)}
+            elif kind == "range" and histogram_bounds:
+                bounds = _parse_array_literal(histogram_bounds)
+                if bounds:
+                    # The histogram bounds are sampled too, so they are only an approximation of the range
+                    profiles[column_name] = {"min": bounds[0], "max": bounds[-1]}
+
+        return profiles
+
+    def _profile_table_sample(self, schema: str, table_name: str, column_names: list[str], column_kinds: list[str]) -> dict[str, dict]:
+        """
+        Profile the columns of a table out of a sample of about `PROFILE_SAMPLE_ROWS` of its rows.
+
+        Args:
+            schema (str): Schema name where the table is located.
+            table_name (str): Name of the table to profile.
+            column_names (list[str]): The names of the columns to profile.
+            column_kinds (list[str]): The kind of profile of each column ("values" or "range").
+
+        Returns:
+            dict[str, dict]: The profile of each profiled column by name.
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT c.reltuples
+                FROM pg_class c
+                JOIN pg_namespace n ON c.relnamespace = n.oid
+                WHERE n.nspname = %s
+                AND c.relname = %s
+                """,
+                (schema, table_name),
+                prepare=True,
+            )
+            estimate = cursor.fetchone()
+
+            # The estimated number of rows is unknown (-1) for tables that have never been vacuumed or analyzed, in which case the LIMIT bounds the scan
+            estimated_rows = estimate[0] if estimate and estimate[0] > 0 else 0
+            sample_percent = min(100.0, 100.0 * 2 * PROFILE_SAMPLE_ROWS / estimated_rows) if estimated_rows else 100.0
+
+            cursor.execute(
+                sql_composition.SQL("SELECT {columns} FROM {schema}.{table} TABLESAMPLE SYSTEM (%s) LIMIT %s").format(
+                    columns=sql_composition.SQL(", ").join(sql_composition.Identifier(column_name) for column_name in column_names),
+                    schema=sql_composition.Identifier(schema),
+                    table=sql_composition.Identifier(table_name),
+                ),
+                (sample_percent, PROFILE_SAMPLE_ROWS),
+            )
+            rows = cursor.fetchall()
+
+        return self._profile_rows(column_names, column_kinds, rows)
+
+    @override
+    def get_replication_lag(self) -> float | None:
+        """
+        Get how far behind its primary the database server is, out of the timestamp of the last replayed transaction.
+        A standby that is streaming and has replayed everything it received is not lagging, however long ago the last transaction was.
+        A standby whose WAL receiver is not streaming (e.g. disconnected from its primary) is not replicating, however little it lags.
+
+        The status of the WAL receiver is only visible to roles with the privileges of `pg_read_all_stats`. For other roles,
+        the lag is always measured from the last replayed transaction, so an idle primary makes its standbys look lagging.
+
+        Returns:
+            float | None: The replication lag in seconds (0 if the server is not a standby),
+            or None if the standby is not streaming or has not replayed any transaction yet.
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT CASE
+                    WHEN NOT pg_is_in_recovery() THEN 0
+                    WHEN receiver.pid IS NULL OR receiver.status <> 'streaming' THEN NULL
+                    WHEN receiver.status IS NOT NULL AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                END
+                FROM (SELECT 1) AS server
+                LEFT JOIN pg_stat_wal_receiver receiver ON true
+            """)
+            lag = cursor.fetchone()[0]
+
+        return None if lag is None else float(lag)
+
+    @override
+    @contextmanager
+    def _get_streaming_cursor(self) -> Generator[sql.ServerCursor]:
+        """
+        Create a named (server-side) cursor, which fetches the results of a query in batches instead of all at once.
+        Since the connection is in autocommit mode, the cursor gets a (read-only) transaction of its own, which ends along with it.
+
+        Yields:
+            sql.ServerCursor: The server-side cursor.
+        """
+        with self.connection.transaction(), self.connection.cursor(name="webtext2sql_stream") as cursor:
+            yield cursor
+
+    @override
+    @staticmethod
+    def _describe_error(error: Exception) -> tuple[str | None, str]:
+        """
+        Get the SQLSTATE and the message of an error raised while executing a query.
+
+        Args:
+            error (Exception): The error raised while executing a query.
+
+        Returns:
+            tuple[str | None, str]: The SQLSTATE (if any) and the error message.
+        """
+        # The message includes the position of the error and the hint of the server (e.g. "Perhaps you meant to reference the column ...")
+        return (error.sqlstate if isinstance(error, sql.Error) else None), str(error).strip()
+
+    @override
+    @staticmethod
+    def _is_interrupted_error(error: Exception) -> bool:
+        """
+        Check whether an error was raised because the query was cancelled or exceeded the `statement_timeout`.
+
+        Args:
+            error (Exception): The error raised while executing a query.
+
+        Returns:
+            bool: True if the query was interrupted, False otherwise.
+        """
+        return isinstance(error, sql.errors.QueryCanceled)
+
+    @override
+    @staticmethod
+    def _is_wrapper_error(error: Exception) -> bool:
+        """
+        Check whether an error was raised because of the derived table a previewed query is wrapped in.
+        Postgres accepts any single SELECT statement in a derived table (duplicate column names included), so no error is.
+
+        Args:
+            error (Exception): The error raised while executing the wrapped query.
+
+        Returns:
+            bool: Always False.
+        """
+        return False
+
+    @override
+    def _configure_session(self) -> None:
+        """
+        Make the transactions of the current session read-only and set its `statement_timeout`, `work_mem` and `temp_file_limit`.
+        The connection is in autocommit mode, so every statement runs in a (read-only) transaction of its own.
+        """
+        logger.debug(f"Configuring a read-only session with statement_timeout = {STATEMENT_TIMEOUT_MS} ms and work_mem = {SESSION_WORK_MEM}")
+
+        # SET does not accept bound parameters, so the values are inlined as literals
+        self.connection.execute("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY")
+        self.connection.execute(sql_composition.SQL("SET statement_timeout = {}").format(int(STATEMENT_TIMEOUT_MS)))
+        self.connection.execute(sql_composition.SQL("SET work_mem = {}").format(SESSION_WORK_MEM))
+
+        try:
+            self.connection.execute(sql_composition.SQL("SET temp_file_limit = {}").format(SESSION_TEMP_FILE_LIMIT))
+        except sql.errors.InsufficientPrivilege:
+            # Only superusers (or roles granted SET on it) may limit their temporary files
+            logger.debug("Not allowed to set the temp_file_limit of the session")
+
+    @override
+    def cancel_running_query(self) -> None:
+        """
+        Cancel the query currently running on the current connection, if any.
+        This sends a cancel request for the connection's backend, which has the same effect as `pg_cancel_backend`
+        without having to authenticate a second connection.
+        """
+        if not self._query_running:
+            logger.debug("No running query to cancel.")
+            return
+
+        try:
+            logger.info(f"Cancelling the running query of backend: {self.connection.info.backend_pid}")
+            self.connection.cancel_safe()
+        except sql.Error:
+            logger.exception("Failed to cancel the running query.")
+
     @override
     @staticmethod
     def try_establish_connection(tcp_details: dict) -> bool:
@@ -221,3 +510,21 @@ def try_establish_connection(tcp_details: dict) -> bool:
         except sql.Error:
             logger.exception("Failed to establish a connection.")
             return False
+
+
+def _parse_array_literal(literal: str) -> list[str]:
+    """
+    Parse the text representation of a one-dimensional PostgreSQL array, e.g. `{a,"b, c",NULL}`.
+
+    Args:
+        literal (str): The array literal.
+
+    Returns:
+        list[str]: The non-NULL elements of the array, or an empty list if it is multidimensional.
+    """
+    content = literal.removeprefix("{").removesuffix("}")
+    if not content or "{" in content:
+        return []
+
+    elements = next(csv.reader([content], escapechar="\\", doublequote=False))
+    return [element for element in elements if element != "NULL"]
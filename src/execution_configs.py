@@ -0,0 +1,48 @@
+STATEMENT_TIMEOUT_MS = 30_000  # Maximum execution time of a generated query in milliseconds
+STREAM_BATCH_SIZE = 5_000  # Number of rows fetched per round-trip when streaming the full results of a query
+MAX_COLUMN_WIDTH = 60  # Maximum number of characters of a value shown in the results table, longer values are truncated
+BATCH_MAX_QUESTIONS = 50  # Maximum number of questions answered in a single batch
+BATCH_LLM_CONCURRENCY = 8  # Maximum number of concurrent requests to the AI model per batch
+BATCH_POOL_SIZE = 4  # Maximum number of database connections (and concurrently executed queries) per batch
+SHARED_POOL_SIZE = 4  # Maximum number of database connections per connection shared by the chats and API requests of a worker
+SHARED_POOL_IDLE_TIMEOUT = 5 * 60  # Number of seconds after which an unused shared pool is closed
+CONTEXT_TOKEN_BUDGET = 1_000  # Maximum (estimated) number of tokens of the previous questions and queries included in a prompt
+CONTEXT_MAX_TURNS = 5  # Maximum number of previous questions (along with their queries) included in a prompt
+WARMUP_CONNECTIONS_PER_USER = 2  # Number of the most recently used connections of a user opened in advance when they log in
+WARMUP_MAX_CONCURRENT = 2  # Maximum number of connections being opened in advance at the same time by a worker
+WARMUP_MAX_POOLS = 32  # No connections are opened in advance while a worker holds this many shared pools
+WARMUP_COOLDOWN = 5 * 60  # Number of seconds before the connections of the same user are opened in advance again
+SQL_REPAIR_MAX_ATTEMPTS = 2  # Maximum number of times a failing query is sent back to the AI model, along with its error, to be fixed
+REPLICA_MAX_LAG = 30  # Maximum replication lag in seconds of a read replica that queries are routed to
+REPLICA_RECHECK_AFTER = 60  # Number of seconds before a read replica that was unreachable or lagging is tried again
+REPLICA_LAG_CHECK_INTERVAL = 10  # Number of seconds after which the lag of a read replica is checked again when a pooled connection is leased
+REPLICA_PRIMARY_FALLBACK = True  # Whether queries fall back to the primary when none of the read replicas of a connection is usable
+SESSION_WORK_MEM = "64MB"  # Postgres `work_mem` of the sessions generated queries run in, i.e. the memory of a sort or hash before spilling to disk
+SESSION_TEMP_FILE_LIMIT = "1GB"  # Postgres `temp_file_limit` of the sessions generated queries run in (only applied if the user may set it)
+SESSION_TMP_TABLE_SIZE = 64 * 1024 * 1024  # MySQL `tmp_table_size` in bytes of the sessions generated queries run in
+SCHEDULER_LLM_MAX_CONCURRENT = 16  # Maximum number of concurrent requests to the AI model per worker
+SCHEDULER_LLM_MAX_CONCURRENT_PER_USER = 4  # Maximum number of concurrent requests to the AI model per user and worker
+SCHEDULER_DB_MAX_CONCURRENT = 16  # Maximum number of concurrently executed generated queries per worker
+SCHEDULER_DB_MAX_CONCURRENT_PER_USER = 4  # Maximum number of concurrently executed generated queries per user and worker
+SCHEDULER_MAX_QUEUED = 64  # Requests (to the AI model or the databases) are turned down once this many of them are queued per worker
+SCHEDULER_MAX_QUEUED_PER_USER = 16  # Requests of a user are turned down once this many of them are queued per worker
+SCHEDULER_BATCH_WEIGHT = 0.25  # The share of the capacity the questions of a batch get, compared to the questions asked in the chat
+SCHEDULER_RETRY_AFTER = 5  # Number of seconds the API asks clients to wait before retrying a request that was turned down
+WORKLOAD_TRACKING = True  # Whether the executions of the generated queries are recorded in the app database, see `workload`
+WORKLOAD_BATCH_SIZE = 200  # Maximum number of recorded executions written to the app database at once
+WORKLOAD_FLUSH_INTERVAL = 5  # Maximum number of seconds a recorded execution waits to be written to the app database
+WORKLOAD_MAX_PENDING = 10_000  # Recorded executions are dropped once this many of them are waiting to be written, e.g. while the app database is down
+WORKLOAD_SIZE_SAMPLE_ROWS = 100  # Number of rows of a result set (or of a streamed batch) its size in bytes is estimated from
+WORKLOAD_TOP_N = 20  # Number of query fingerprints shown by the workload endpoint by default
+WORKLOAD_WINDOW_DAYS = 7  # Number of days of executions the workload endpoint takes into account by default
+DATA_LAYER_POOL_MIN_SIZE = 2  # Number of connections to the app database the chat history (Chainlit's data layer) keeps open per worker
+DATA_LAYER_POOL_MAX_SIZE = 10  # Maximum number of connections to the app database of the chat history per worker
+DATA_LAYER_POOL_MAX_INACTIVE_LIFETIME = 5 * 60  # Number of seconds after which an idle connection of the chat history (above the minimum) is closed
+DATA_LAYER_STEP_FLUSH_DELAY = 0.25  # Number of seconds the steps (messages) of the chat history are buffered for, to be written in one batch
+DATA_LAYER_KNOWN_IDS_MAX_SIZE = 10_000  # Maximum number of threads (and of steps) known to exist, which are not checked again before writing a step
+LOCAL_RESULTS_ENGINE = False  # Whether follow-up questions can be answered from the previous results (needs duckdb), at the cost of bigger previews
+LOCAL_RESULTS_MAX_ROWS = 500  # Results are fetched up to this many rows (instead of the rows shown), and kept for follow-up questions if complete
+LOCAL_RESULTS_PER_SESSION = 5  # Number of the most recent results kept per session
+LOCAL_RESULTS_MAX_BYTES = 256 * 1024 * 1024  # Maximum size in bytes of the results kept per worker, evicting the least recently used ones
+LOCAL_RESULTS_MEMORY_LIMIT = "256MB"  # DuckDB `memory_limit` of the queries over the kept results
+LOCAL_RESULTS_THREADS = 2  # DuckDB `threads` of the queries over the kept results
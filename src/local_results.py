@@ -0,0 +1,235 @@
+import functools
+import importlib.util
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any
+
+import metrics
+import result_exports
+from db_controllers.base_db_controller import QueryExecutionError
+from execution_configs import (
+    LOCAL_RESULTS_ENGINE,
+    LOCAL_RESULTS_MAX_BYTES,
+    LOCAL_RESULTS_MAX_ROWS,
+    LOCAL_RESULTS_MEMORY_LIMIT,
+    LOCAL_RESULTS_PER_SESSION,
+    LOCAL_RESULTS_THREADS,
+)
+from prompt_templates import PREVIOUS_RESULTS_MARKER
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+logger: logging.Logger = logging.getLogger("webtext2sql")
+
+MAX_QUESTION_LENGTH = 200  # The questions are cut to this many characters when describing their results to the AI model
+
+
+@dataclass
+class ResultTable:
+    """The complete results of a previous question of a session, kept so that follow-up questions can be answered from them."""
+
+    name: str
+    question: str
+    query: str
+    table: "pa.Table"
+
+    @property
+    def size(self) -> int:
+        """The size of the results in memory, in bytes."""
+        return self.table.nbytes
+
+
+# The results kept by this worker, by session and then by table name, from the least to the most recently used
+_tables: OrderedDict[tuple[str, str], ResultTable] = OrderedDict()
+_tables_size = 0
+_table_numbers: dict[str, int] = {}
+_tables_lock = threading.Lock()
+
+
+@functools.cache
+def is_enabled() -> bool:
+    """
+    Whether follow-up questions can be answered from the results kept in the session, i.e. if it is enabled and duckdb is installed.
+
+    Returns:
+        bool: True if the results are kept and queried in-process.
+    """
+    if not LOCAL_RESULTS_ENGINE:
+        return False
+
+    if importlib.util.find_spec("duckdb") is None:
+        logger.info("duckdb is not installed, so follow-up questions are always answered by the database")
+        return False
+
+    return True
+
+
+def is_local_query(query: str) -> bool:
+    """
+    Whether a generated query targets the results kept in the session instead of the database.
+
+    Args:
+        query (str): The SQL query generated by the AI model.
+
+    Returns:
+        bool: True if the query starts with `prompt_templates.PREVIOUS_RESULTS_MARKER` (and the results are kept at all).
+    """
+    return is_enabled() and query.lstrip().lower().startswith(PREVIOUS_RESULTS_MARKER)
+
+
+def keep_results(session_id: str, question: str, query: str, rows: Iterable[tuple], column_names: tuple[str]) -> ResultTable | None:
+    """
+    Keep the complete results of a question of a session as an Arrow table, named `result_<n>`.
+    Only the `LOCAL_RESULTS_PER_SESSION` most recent results of a session are kept, and the least recently used results
+    of all the sessions are evicted once they take up more than `LOCAL_RESULTS_MAX_BYTES`.
+
+    Args:
+        session_id (str): The ID of the session.
+        question (str): The question the results answer.
+        query (str): The SQL query the results were produced by.
+        rows (Iterable[tuple]): The rows of the results.
+        column_names (tuple[str]): The column names of the results.
+
+    Returns:
+        ResultTable | None: The kept results, or None if they could not be converted or are too large to keep.
+    """
+    global _tables_size  # noqa: PLW0603
+
+    try:
+        table = result_exports.to_arrow_table(column_names, rows)
+    except Exception:  # noqa: BLE001
+        logger.warning(f"Failed to convert the results of the query to keep them: {query}")
+        return None
+
+    if table.nbytes > LOCAL_RESULTS_MAX_BYTES:
+        logger.debug(f"Not keeping results of {table.nbytes} bytes, more than all the kept results may take up")
+        return None
+
+    with _tables_lock:
+        _table_numbers[session_id] = _table_numbers.get(session_id, 0) + 1
+        result_table = ResultTable(name=f"result_{_table_numbers[session_id]}", question=question, query=query, table=table)
+
+        _tables[session_id, result_table.name] = result_table
+        _tables_size += result_table.size
+        metrics.increment("local_results.kept")
+
+        session_keys = [key for key in _tables if key[0] == session_id]
+        evicted = session_keys[: max(len(session_keys) - LOCAL_RESULTS_PER_SESSION, 0)]
+
+        # The least recently used results come first, across all the sessions
+        size_after_eviction = _tables_size - sum(_tables[key].size for key in evicted)
+        for key in _tables:
+            if size_after_eviction <= LOCAL_RESULTS_MAX_BYTES:
+                break
+            if key not in evicted:
+                evicted.append(key)
+                size_after_eviction -= _tables[key].size
+
+        for key in evicted:
+            _tables_size -= _tables.pop(key).size
+            metrics.increment("local_results.evicted")
+
+    return result_table
+
+
+def get_tables(session_id: str) -> list[ResultTable]:
+    """
+    Get the results kept in a session, marking them as recently used.
+
+    Args:
+        session_id (str): The ID of the session.
+
+    Returns:
+        list[ResultTable]: The results, from the oldest to the most recent question.
+    """
+    with _tables_lock:
+        keys = [key for key in _tables if key[0] == session_id]
+        for key in keys:
+            _tables.move_to_end(key)
+        return [_tables[key] for key in keys]
+
+
+def describe_tables(session_id: str) -> str:
+    """
+    Describe the results kept in a session to the AI model: the name, the question and the columns of each table.
+
+    Args:
+        session_id (str): The ID of the session.
+
+    Returns:
+        str: One line per table, or an empty string if no results are kept (or it is not enabled).
+    """
+    if not is_enabled():
+        return ""
+
+    lines = []
+    for result_table in get_tables(session_id):
+        columns = ", ".join(f"{field.name} {field.type}" for field in result_table.table.schema)
+        question = result_table.question[:MAX_QUESTION_LENGTH]
+        lines.append(f"- {result_table.name} ({result_table.table.num_rows} rows) with the results of `{question}`: {columns}")
+
+    return "\n".join(lines)
+
+
+def execute(session_id: str, query: str) -> tuple[tuple[tuple[Any, ...], ...], tuple[str], bool]:
+    """
+    Execute a query over the results kept in a session with an in-memory DuckDB database, fetching up to `LOCAL_RESULTS_MAX_ROWS` rows.
+    The database cannot access any files or any Python objects other than the tables of the session, and its memory is limited.
+
+    Args:
+        session_id (str): The ID of the session.
+        query (str): The DuckDB SQL query.
+
+    Returns:
+        tuple: The rows of the results, the column names and whether the query has more rows than the ones returned.
+
+    Raises:
+        QueryExecutionError: If DuckDB fails to execute the query.
+    """
+    import duckdb  # noqa: PLC0415 # Only needed when follow-up questions are answered from the kept results
+
+    started = time.perf_counter()
+    config = {
+        "enable_external_access": False,
+        "python_enable_replacements": False,
+        "lock_configuration": True,
+        "memory_limit": LOCAL_RESULTS_MEMORY_LIMIT,
+        "threads": LOCAL_RESULTS_THREADS,
+    }
+
+    try:
+        with duckdb.connect(config=config) as connection:
+            for result_table in get_tables(session_id):
+                connection.register(result_table.name, result_table.table)
+
+            cursor = connection.execute(query)
+            rows = cursor.fetchmany(LOCAL_RESULTS_MAX_ROWS + 1)
+            column_names = tuple(desc[0] for desc in cursor.description) if cursor.description else ()
+    except duckdb.Error as e:
+        metrics.increment("local_results.failures")
+        raise QueryExecutionError(query, str(e).strip()) from e
+
+    metrics.increment("local_results.queries")
+    metrics.observe("local_results.query_ms", (time.perf_counter() - started) * 1000)
+
+    return tuple(rows[:LOCAL_RESULTS_MAX_ROWS]), column_names, len(rows) > LOCAL_RESULTS_MAX_ROWS
+
+
+def drop_session(session_id: str) -> None:
+    """
+    Drop the results kept in a session, once it has ended.
+
+    Args:
+        session_id (str): The ID of the session.
+    """
+    global _tables_size  # noqa: PLW0603
+
+    with _tables_lock:
+        for key in [key for key in _tables if key[0] == session_id]:
+            _tables_size -= _tables.pop(key).size
+        _table_numbers.pop(session_id, None)
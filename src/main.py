@@ -1,21 +1,42 @@
+import datetime
+import itertools
 import os
+import shutil
+import tempfile
 from collections.abc import Generator
-from typing import Annotated, Any
+from pathlib import Path
+from typing import Annotated, Any, Literal
+from urllib.parse import quote
 
 from chainlit.utils import mount_chainlit
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, Form, Request, Response
+from fastapi import Depends, FastAPI, Form, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from itsdangerous import URLSafeTimedSerializer
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from pydantic import BaseModel, Field
 from sqlmodel import Session, create_engine
+from starlette.background import BackgroundTask
 from starlette.templating import _TemplateResponse
 
+import ai_controller
+import api_controller
+import batch_controller
+import cache_backends
+import column_profiler
+import connection_pool
 import custom_logging
+import query_repair
+import scheduler
+import workload
 from auth import hash_password, verify_password
-from user_controllers import app_users
+from caching_configs import CACHE_TTL
+from db_controllers.base_db_controller import QueryExecutionError
+from execution_configs import BATCH_MAX_QUESTIONS, SCHEDULER_BATCH_WEIGHT, SCHEDULER_RETRY_AFTER, WORKLOAD_TOP_N, WORKLOAD_WINDOW_DAYS
+from user_controllers import api_keys, app_users, query_workload, user_connections
 
 load_dotenv()
 
@@ -34,6 +55,8 @@
 SECRET_KEY = os.getenv("SECRET_KEY")
 COOKIE_NAME = os.getenv("COOKIE_NAME")
 serializer = URLSafeTimedSerializer(SECRET_KEY)
+ADMIN_EMAILS = {email.strip() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+API_KEY_CACHE_NAMESPACE = "api_key_users"  # The users of the API keys are cached (by the hash of the key) in the cache backend
 db_engine = create_engine(os.getenv("DATABASE_URL"))
 
 
@@ -45,10 +68,88 @@ def get_db_session() -> Generator[Session, Any]:
 DBSessionDep = Annotated[Session, Depends(get_db_session)]
 
 
+# API keys are looked up once per minute at most, and forgotten by all workers as soon as they are deleted (see `delete_api_key`)
+@cache_backends.shared_cache(
+    API_KEY_CACHE_NAMESPACE,
+    ttl=CACHE_TTL,
+    key=lambda raw_key: (api_keys.hash_api_key(raw_key),),
+    condition=lambda email: email is not None,
+)
+def _get_user_email_by_api_key(raw_key: str) -> str | None:
+    with Session(db_engine) as session:
+        return api_keys.get_user_email_by_api_key(raw_key, session)
+
+
+def get_current_user_email(request: Request) -> str:
+    """
+    Authenticate the user of an API request.
+    Either an API key or the session token set at login is accepted, as a bearer token or (for the session token) as the session cookie.
+    """
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        token = request.cookies.get(COOKIE_NAME)
+
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    if token.startswith(api_keys.API_KEY_PREFIX):
+        email = _get_user_email_by_api_key(token)
+        if not email:
+            raise HTTPException(status_code=401, detail="Invalid API key")
+        return email
+
+    try:
+        return serializer.loads(token, max_age=60 * 60 * 24)
+    except (BadSignature, SignatureExpired) as e:
+        raise HTTPException(status_code=401, detail="Invalid or expired session") from e
+
+
+CurrentUserDep = Annotated[str, Depends(get_current_user_email)]
+
+
+def get_admin_email(email: CurrentUserDep) -> str:
+    """Authorize the users listed in `ADMIN_EMAILS` (and only them) to use the admin endpoints."""
+    if email not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Not an administrator")
+    return email
+
+
+AdminDep = Annotated[str, Depends(get_admin_email)]
+
+
+class BatchRequest(BaseModel):
+    """A batch of questions to answer against one schema of a previously connected database."""
+
+    connection_id: str
+    db_schema: str
+    questions: list[str] = Field(min_length=1, max_length=BATCH_MAX_QUESTIONS)
+
+
+class QueryRequest(BaseModel):
+    """A question to answer against one schema of a previously connected database."""
+
+    connection_id: str
+    db_schema: str
+    question: str = Field(min_length=1)
+    format: Literal["ndjson", "csv"] = "ndjson"
+
+
+class ApiKeyRequest(BaseModel):
+    """A request for a new API key."""
+
+    name: str = Field(min_length=1)  # To recognize the key by, e.g. the service that uses it
+
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.mount("/public", StaticFiles(directory="public"), name="public")
 
 
+@app.exception_handler(scheduler.SchedulerBusyError)
+async def scheduler_busy(_: Request, exc: scheduler.SchedulerBusyError) -> JSONResponse:
+    """Turn down the requests the scheduler has no room for with a 503, so that clients retry them later."""
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(SCHEDULER_RETRY_AFTER)})
+
+
 @app.get("/login", response_class=HTMLResponse)
 def login_page(request: Request, error: str | None = None) -> _TemplateResponse:
     """Render the login page with an optional error message."""
@@ -134,6 +235,176 @@ def register(
     return _create_session_and_redirect(email)
 
 
+@app.post("/batch", response_class=FileResponse)
+async def batch(batch_request: BatchRequest, email: CurrentUserDep, db_session: DBSessionDep) -> FileResponse:
+    """Answer a batch of questions and return the summary and the results of all of them as a ZIP archive."""
+    user_connection = user_connections.get_user_connection_by_id(batch_request.connection_id, email, db_session)
+    if not user_connection:
+        raise HTTPException(status_code=404, detail="Connection not found")
+
+    questions = [question.strip() for question in batch_request.questions if question.strip()]
+    if not questions:
+        raise HTTPException(status_code=422, detail="No questions given")
+
+    # The questions of a batch get a smaller share of the capacity than single questions
+    scheduler.set_current_user(email, weight=SCHEDULER_BATCH_WEIGHT)
+
+    # The archive is removed once it has been sent
+    work_dir = Path(tempfile.mkdtemp(prefix="webtext2sql_batch_"))
+    archive_path = work_dir / "batch_results.zip"
+
+    try:
+        answers = await batch_controller.answer_questions(
+            user_connections.get_conn_info(user_connection),
+            batch_request.db_schema,
+            questions,
+            archive_path,
+            connection_id=batch_request.connection_id,
+        )
+    except Exception as e:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        logger.exception(f"Failed to answer a batch of questions for user: {email}")
+        raise HTTPException(status_code=502, detail="Failed to connect to the database") from e
+
+    logger.info(f"Answered a batch of {len(answers)} questions for user: {email}")
+
+    return FileResponse(
+        archive_path,
+        media_type="application/zip",
+        filename="batch_results.zip",
+        headers={"X-Answered-Questions": str(sum(answer.error is None for answer in answers))},
+        background=BackgroundTask(shutil.rmtree, work_dir, ignore_errors=True),
+    )
+
+
+@app.get("/api/connections")
+def list_connections(email: CurrentUserDep, db_session: DBSessionDep) -> list[dict]:
+    """List the previously connected databases of the user, whose IDs are used to query them (one question or a batch)."""
+    return [
+        {"id": str(conn.id), "server_name": conn.server_name, "type_of_db": conn.type_of_db}
+        for conn in user_connections.get_user_connections_by_email(email, db_session)
+    ]
+
+
+@app.post("/api/query", response_class=StreamingResponse)
+async def query(query_request: QueryRequest, email: CurrentUserDep, db_session: DBSessionDep) -> StreamingResponse:
+    """
+    Answer a question and stream the SQL query and its results, as NDJSON or CSV.
+    The SQL query is given in the first line of the NDJSON and in the (percent-encoded) `X-SQL-Query` header of the CSV.
+    """
+    user_connection = user_connections.get_user_connection_by_id(query_request.connection_id, email, db_session)
+    if not user_connection:
+        raise HTTPException(status_code=404, detail="Connection not found")
+
+    scheduler.set_current_user(email)
+    workload.set_context(query_request.db_schema, query_request.connection_id)
+
+    conn_info = user_connections.get_conn_info(user_connection)
+
+    try:
+        pool = await run_in_threadpool(connection_pool.get_shared_pool, conn_info)
+        metadata = await run_in_threadpool(api_controller.get_metadata, pool, query_request.db_schema)
+    except Exception as e:
+        logger.exception(f"Failed to connect to the database of connection: {query_request.connection_id}")
+        raise HTTPException(status_code=502, detail="Failed to connect to the database") from e
+
+    column_profiler.schedule_profiling(conn_info, query_request.db_schema)
+    column_profiles = await run_in_threadpool(column_profiler.get_profile_summary, conn_info, query_request.db_schema)
+
+    sql_query = await ai_controller.generate_sql_query(
+        query_request.question,
+        conn_info["type_of_db"],
+        metadata,
+        query_request.db_schema,
+        column_profiles=column_profiles,
+    )
+    if not sql_query:
+        raise HTTPException(status_code=422, detail="The AI model did not return a valid SQL query")
+
+    async def run_query(query: str) -> tuple[Generator, tuple[tuple[str], list[Any]]]:
+        # The slot is held while the query is executed, not while its results are streamed
+        async with scheduler.db_scheduler.slot():
+            batches = api_controller.stream_results(pool, query)
+            return batches, await run_in_threadpool(next, batches)
+
+    # The query is executed (and its first batch fetched) before responding, so that its errors get a proper status code.
+    # A query that the database rejects is sent back to the AI model to be fixed, along with the error.
+    try:
+        sql_query, (batches, first_batch) = await query_repair.execute_with_repair(
+            run_query,
+            sql_query,
+            question=query_request.question,
+            db_type=conn_info["type_of_db"],
+            metadata=metadata,
+            schema=query_request.db_schema,
+        )
+    except QueryExecutionError as e:
+        raise HTTPException(status_code=422, detail=e.to_dict()) from e
+    except scheduler.SchedulerBusyError:
+        raise
+    except Exception as e:
+        logger.exception(f"Failed to execute the query of connection: {query_request.connection_id}")
+        raise HTTPException(status_code=502, detail="Failed to execute the query") from e
+
+    batches = itertools.chain([first_batch], batches)
+
+    if query_request.format == "csv":
+        return StreamingResponse(
+            api_controller.to_csv(batches),
+            media_type="text/csv",
+            headers={"X-SQL-Query": quote(sql_query)},
+        )
+
+    return StreamingResponse(api_controller.to_ndjson(sql_query, batches), media_type="application/x-ndjson")
+
+
+@app.post("/api/keys")
+def create_api_key(api_key_request: ApiKeyRequest, email: CurrentUserDep, db_session: DBSessionDep) -> dict:
+    """Create an API key for the user. The key is only returned here, it cannot be retrieved again."""
+    api_key, raw_key = api_keys.create_api_key(email, api_key_request.name, db_session)
+
+    logger.info(f"API key created for user: {email}")
+
+    return {"id": str(api_key.id), "name": api_key.name, "key": raw_key}
+
+
+@app.get("/api/keys")
+def list_api_keys(email: CurrentUserDep, db_session: DBSessionDep) -> list[dict]:
+    """List the API keys of the user (without the keys themselves)."""
+    return [
+        {"id": str(api_key.id), "name": api_key.name, "created_at": api_key.created_at}
+        for api_key in api_keys.get_api_keys_by_email(email, db_session)
+    ]
+
+
+@app.delete("/api/keys/{api_key_id}", status_code=204)
+def delete_api_key(api_key_id: str, email: CurrentUserDep, db_session: DBSessionDep) -> None:
+    """Delete an API key of the user."""
+    hashed_key = api_keys.delete_api_key(api_key_id, email, db_session)
+    if not hashed_key:
+        raise HTTPException(status_code=404, detail="API key not found")
+
+    cache_backends.get_cache_backend().delete(cache_backends.make_key(API_KEY_CACHE_NAMESPACE, hashed_key))
+
+    logger.info(f"API key deleted for user: {email}")
+
+
+@app.get("/admin/workload")
+def workload_stats(
+    _: AdminDep,
+    db_session: DBSessionDep,
+    order_by: Literal["total_time", "p95", "frequency"] = "total_time",
+    limit: Annotated[int, Query(ge=1, le=1_000)] = WORKLOAD_TOP_N,
+    days: Annotated[int, Query(ge=1)] = WORKLOAD_WINDOW_DAYS,
+) -> list[dict]:
+    """
+    List the generated queries (by fingerprint, i.e. regardless of their literals) taking the most time in total,
+    the slowest at the 95th percentile or the most frequent, to find the tables that need indexes and the questions worth caching.
+    """
+    since = datetime.datetime.now() - datetime.timedelta(days=days)  # noqa: DTZ005 # Naive, like the recorded timestamps
+    return query_workload.get_top_fingerprints(order_by, limit, since, db_session)
+
+
 @app.get("/", response_class=HTMLResponse)
 def home(_: Request) -> RedirectResponse:
     """Redirect to the login page."""
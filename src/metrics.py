@@ -0,0 +1,55 @@
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger("webtext2sql")
+
+_lock = threading.Lock()
+_counters: defaultdict[str, float] = defaultdict(float)
+_observations: dict[str, dict[str, float]] = {}
+
+
+def increment(name: str, value: float = 1) -> None:
+    """
+    Add to a counter of the current process.
+
+    Args:
+        name (str): The name of the counter, e.g. `llm.requests`.
+        value (float): The amount to add.
+    """
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, value: float) -> None:
+    """
+    Record an observation of a measurement (e.g. a latency), keeping its count, sum, minimum and maximum.
+
+    Args:
+        name (str): The name of the measurement, e.g. `llm.latency_ms`.
+        value (float): The observed value.
+    """
+    with _lock:
+        stats = _observations.get(name)
+        if stats is None:
+            _observations[name] = {"count": 1, "sum": value, "min": value, "max": value}
+            return
+
+        stats["count"] += 1
+        stats["sum"] += value
+        stats["min"] = min(stats["min"], value)
+        stats["max"] = max(stats["max"], value)
+
+
+def snapshot() -> dict[str, dict]:
+    """
+    Get the current values of all the counters and measurements of the current process.
+
+    Returns:
+        dict[str, dict]: The counters and the measurements (with their mean), by name.
+    """
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "observations": {name: {**stats, "mean": stats["sum"] / stats["count"]} for name, stats in _observations.items()},
+        }
@@ -0,0 +1,9 @@
+PROFILE_SAMPLE_ROWS = 1_000  # Number of rows sampled from a table to profile its columns, when there are no statistics to use instead
+PROFILE_MAX_DISTINCT = 12  # Columns with up to this many distinct values have their values listed in the prompts
+PROFILE_MAX_VALUE_LENGTH = 40  # Maximum number of characters of a listed value, longer values are truncated
+PROFILE_TABLES_PER_RUN = 5  # Maximum number of tables profiled per run of the profiling job of a schema
+PROFILE_MIN_INTERVAL = 60  # Minimum number of seconds between two runs of the profiling job of a schema
+PROFILE_TABLE_DELAY = 1  # Number of seconds the profiling job waits between two tables, to spread its load on the database
+PROFILE_MAX_AGE = 60 * 60 * 24  # Age in seconds after which the profile of a table is refreshed
+PROFILES_CACHE_TTL = 60 * 60 * 24 * 7  # TTL of the stored profiles of a schema in seconds
+PROFILE_SUMMARY_MAX_CHARS = 2_000  # Maximum number of characters of the profile summary included in the prompts
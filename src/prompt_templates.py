@@ -0,0 +1,135 @@
+from string import Template
+
+# The system message only depends on the database type, the schema and its structure, so it is byte-for-byte the same
+# for every question about a schema. The provider caches the longest previously seen prefix of a prompt automatically,
+# so the fixed instructions come first, then the (much longer) structure of the schema and only then anything that varies.
+# The profiles of the columns change rarely (when the tables are profiled again), so they follow the structure of the schema.
+SYSTEM_TEMPLATE = Template("""\
+You translate questions about a relational database into SQL queries.
+Answer only with the SQL query (without any text formatting) that answers the question.
+Unless explicitly stated, do not limit the number of rows returned.
+
+The database is a $db_type database and the schema is $schema, which should be used in the SQL queries.$dialect_notes
+
+This is the structure of the schema:
+$metadata$column_profiles""")
+
+DIALECT_NOTES = {
+    "postgres": "\nAdd quotes around the table and column names to avoid SQL syntax errors.",
+}
+
+REPAIR_TEMPLATE = Template("""\
+The SQL query failed with the following error:
+$error
+
+Answer only with the corrected SQL query that answers the question.""")
+
+COLUMN_PROFILES_HEADER = "\n\nThese are some of the values of the columns:\n"
+
+# The first line of the queries over the results of the previous questions, which are executed in-process instead of on the database
+PREVIOUS_RESULTS_MARKER = "-- previous results"
+
+# The results kept in the session change with every question, so they come right before the question, after the cached prefix
+PREVIOUS_RESULTS_TEMPLATE = Template("""\
+The results of the previous questions are also available as tables of a DuckDB database:
+$tables
+
+If the question can be answered from these tables alone (e.g. it filters, sorts, groups or combines previous results),
+answer with a DuckDB SQL query over them whose first line is `$marker`.
+Otherwise, answer with a SQL query against the $db_type database as usual.""")
+
+
+def render_system_prompt(db_type: str, schema: str, metadata: list[str], column_profiles: str = "") -> str:
+    """
+    Render the system message of a schema, which is the stable prefix of all its prompts.
+
+    Args:
+        db_type (str): The type of the database ('mysql' or 'postgres').
+        schema (str): The database schema.
+        metadata (list[str]): The DDL of the tables of the schema.
+        column_profiles (str): The summary of the values of the columns, as built by `column_profiler.get_profile_summary`.
+
+    Returns:
+        str: The system message.
+    """
+    return SYSTEM_TEMPLATE.substitute(
+        db_type=db_type,
+        schema=schema,
+        dialect_notes=DIALECT_NOTES.get(db_type, ""),
+        # Sorted, so that the prefix does not depend on the order the tables were fetched in
+        metadata="\n".join(sorted(metadata)),
+        column_profiles=f"{COLUMN_PROFILES_HEADER}{column_profiles}" if column_profiles else "",
+    )
+
+
+def build_sql_messages(  # noqa: PLR0913
+    question: str,
+    db_type: str,
+    metadata: list[str],
+    schema: str,
+    context: list[dict] | None = None,
+    *,
+    column_profiles: str = "",
+    previous_results: str = "",
+) -> list[dict]:
+    """
+    Build the messages asking the AI model for the SQL query that answers a question.
+    The system message holds everything that is the same across the questions about a schema, followed by the previous
+    questions and their SQL queries as a conversation (which only grows at its end), the results of the previous questions
+    that the question may be answered from (if any) and finally the question itself.
+
+    Args:
+        question (str): The user's question, in natural language.
+        db_type (str): The type of the database ('mysql' or 'postgres').
+        metadata (list[str]): The DDL of the tables of the schema.
+        schema (str): The database schema.
+        context (list[dict] | None): The previous questions and their SQL queries, as built by `context_builder.build_context`.
+        column_profiles (str): The summary of the values of the columns, if any.
+        previous_results (str): The tables of the results kept in the session, as described by `local_results.describe_tables`, if any.
+
+    Returns:
+        list[dict]: The messages, in the format of the OpenAI chat completions API.
+    """
+    previous_results_messages = []
+    if previous_results:
+        content = PREVIOUS_RESULTS_TEMPLATE.substitute(tables=previous_results, marker=PREVIOUS_RESULTS_MARKER, db_type=db_type)
+        previous_results_messages.append({"role": "system", "content": content})
+
+    return [
+        {"role": "system", "content": render_system_prompt(db_type, schema, metadata, column_profiles)},
+        *(context or []),
+        *previous_results_messages,
+        {"role": "user", "content": question},
+    ]
+
+
+def build_repair_messages(  # noqa: PLR0913
+    question: str,
+    failed_query: str,
+    error: str,
+    *,
+    db_type: str,
+    metadata: list[str],
+    schema: str,
+) -> list[dict]:
+    """
+    Build the messages asking the AI model to fix a SQL query that the database failed to execute.
+    The failed query is given as the previous answer of the AI model, followed by the error of the database.
+
+    Args:
+        question (str): The user's question, in natural language.
+        failed_query (str): The SQL query that failed.
+        error (str): The error message of the database.
+        db_type (str): The type of the database ('mysql' or 'postgres').
+        metadata (list[str]): The DDL of the tables relevant to the query, as selected by `str_manipulation.select_relevant_tables`.
+        schema (str): The database schema.
+
+    Returns:
+        list[dict]: The messages, in the format of the OpenAI chat completions API.
+    """
+    return [
+        {"role": "system", "content": render_system_prompt(db_type, schema, metadata)},
+        {"role": "user", "content": question},
+        {"role": "assistant", "content": failed_query},
+        {"role": "user", "content": REPAIR_TEMPLATE.substitute(error=error)},
+    ]
@@ -0,0 +1,94 @@
+import logging
+import time
+from collections.abc import Awaitable, Callable
+
+import ai_controller
+import metrics
+import scheduler
+from db_controllers.base_db_controller import QueryExecutionError
+from execution_configs import SQL_REPAIR_MAX_ATTEMPTS
+
+logger: logging.Logger = logging.getLogger("webtext2sql")
+
+
+async def execute_with_repair[T](  # noqa: PLR0913
+    run_query: Callable[[str], Awaitable[T]],
+    sql_query: str,
+    *,
+    question: str,
+    db_type: str,
+    metadata: list[str],
+    schema: str,
+) -> tuple[str, T]:
+    """
+    Execute a generated SQL query and, if the database rejects it, have the AI model fix it and execute it again.
+    The failed query and the error of the database are sent back to the AI model up to `SQL_REPAIR_MAX_ATTEMPTS` times,
+    which saves the user from asking again (and another full round-trip) for errors such as a misspelled column.
+    Queries that were cancelled or timed out are not repaired.
+
+    Args:
+        run_query (Callable[[str], Awaitable[T]]): Executes a SQL query, raising `QueryExecutionError` if it fails.
+        sql_query (str): The SQL query generated by the AI model.
+        question (str): The user's question, in natural language.
+        db_type (str): The type of the database ('mysql' or 'postgres').
+        metadata (list[str]): The database metadata.
+        schema (str): The database schema.
+
+    Returns:
+        tuple[str, T]: The SQL query that was executed successfully (either the given or a repaired one) and its result.
+
+    Raises:
+        QueryExecutionError: The error of the last query executed, if none of them succeeded.
+    """
+    try:
+        return sql_query, await run_query(sql_query)
+    except QueryExecutionError as e:
+        if e.interrupted or SQL_REPAIR_MAX_ATTEMPTS <= 0:
+            raise
+        error = e
+
+    started = time.perf_counter()
+
+    for attempt in range(1, SQL_REPAIR_MAX_ATTEMPTS + 1):
+        logger.info(f"Repairing the SQL query (attempt {attempt}) that failed with: {error.message}")
+        metrics.increment("sql_repair.attempts")
+
+        try:
+            repaired_query = await ai_controller.repair_sql_query(question, error, db_type, metadata, schema)
+        except scheduler.SchedulerBusyError:
+            raise
+        except Exception:
+            logger.exception("Failed to get the repaired SQL query from the AI model")
+            break
+
+        if not repaired_query or repaired_query == error.query:
+            logger.warning("The AI model did not return a different SQL query")
+            break
+
+        try:
+            result = await run_query(repaired_query)
+        except QueryExecutionError as e:
+            error = e
+            if e.interrupted:
+                break
+            continue
+
+        _record_outcome(started, repaired=True)
+        return repaired_query, result
+
+    _record_outcome(started, repaired=False)
+    raise error
+
+
+def _record_outcome(started: float, *, repaired: bool) -> None:
+    """
+    Record whether a failed query was repaired and how much time the repair added.
+
+    Args:
+        started (float): The `time.perf_counter()` value when the original query failed.
+        repaired (bool): Whether a repaired query was executed successfully.
+    """
+    # The mean of the observations is the success rate of the repairs
+    metrics.observe("sql_repair.success", 1 if repaired else 0)
+    metrics.observe("sql_repair.added_latency_ms", (time.perf_counter() - started) * 1000)
+    metrics.increment("sql_repair.repaired" if repaired else "sql_repair.unrepaired")
@@ -0,0 +1,196 @@
+import itertools
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import connection_factory
+import metrics
+from execution_configs import REPLICA_LAG_CHECK_INTERVAL, REPLICA_MAX_LAG, REPLICA_PRIMARY_FALLBACK, REPLICA_RECHECK_AFTER
+
+if TYPE_CHECKING:
+    from db_controllers.base_db_controller import BaseDBController
+
+logger: logging.Logger = logging.getLogger("webtext2sql")
+
+
+@dataclass
+class ReplicaStatus:
+    """The outcome of the last time a read replica was connected to."""
+
+    lag: float | None  # None if the replica could not be reached or is not replicating
+    checked_at: float
+
+    @property
+    def usable(self) -> bool:
+        """Whether queries can be routed to the replica."""
+        return self.lag is not None and self.lag <= REPLICA_MAX_LAG
+
+
+# The status of each replica of this worker, by the identity of its connection
+_statuses: dict[str, ReplicaStatus] = {}
+_statuses_lock = threading.Lock()
+
+# Rotates the order the replicas are tried in, so that the connections are spread across them
+_rotation = itertools.count()
+
+
+def parse_replicas(text: str) -> list[dict]:
+    """
+    Parse a list of read replicas, as entered by the user.
+
+    Args:
+        text (str): Comma-separated `host:port` pairs, e.g. `replica-1:5432, replica-2:5432`.
+
+    Returns:
+        list[dict]: The host and port of each replica.
+
+    Raises:
+        ValueError: If any of the replicas is not a `host:port` pair.
+    """
+    replicas = []
+
+    for entry in text.split(","):
+        if not entry.strip():
+            continue
+
+        host, separator, port = entry.strip().rpartition(":")
+        if not separator or not host or not port.isdigit():
+            msg = f"Invalid replica (expected host:port): {entry.strip()}"
+            raise ValueError(msg)
+
+        # IPv6 addresses are given in brackets, e.g. `[::1]:5432`
+        replicas.append({"host": host.removeprefix("[").removesuffix("]"), "port": int(port)})
+
+    return replicas
+
+
+def connect_for_reads(db_type: str, tcp_details: dict, replicas: list[dict]) -> "BaseDBController":
+    """
+    Connect to one of the read replicas of a connection, so that the queries stay off its primary.
+    Replicas that cannot be reached or lag more than `REPLICA_MAX_LAG` seconds behind are skipped (failing over to the next one)
+    and not tried again for `REPLICA_RECHECK_AFTER` seconds. If none of them is usable, the primary is connected to instead,
+    unless `REPLICA_PRIMARY_FALLBACK` is disabled.
+
+    Args:
+        db_type (str): The type of database ('mysql' or 'postgres').
+        tcp_details (dict): The TCP connection parameters of the primary, which the replicas share except for their host and port.
+        replicas (list[dict]): The host and port of each replica.
+
+    Returns:
+        BaseDBController: The controller of a replica, or of the primary.
+
+    Raises:
+        ConnectionError: If none of the replicas is usable and falling back to the primary is disabled.
+    """
+    controller_type = connection_factory.get_db_controller_type(db_type)
+
+    for replica in _order_replicas(db_type, tcp_details, replicas):
+        replica_details = {**tcp_details, "host": replica["host"], "port": replica["port"]}
+        replica_identity = connection_factory.connection_identity(db_type, replica_details)
+
+        try:
+            db_controller = controller_type(replica_details)
+        except Exception:  # noqa: BLE001
+            logger.warning(f"Failed to connect to the replica {replica['host']}:{replica['port']}, failing over")
+            _set_status(replica_identity, None)
+            metrics.increment("replicas.failovers")
+            continue
+
+        try:
+            lag = db_controller.get_replication_lag()
+        except Exception:  # noqa: BLE001
+            logger.warning(f"Failed to get the replication lag of the replica {replica['host']}:{replica['port']}")
+            lag = None
+
+        status = _set_status(replica_identity, lag)
+        if status.usable:
+            metrics.increment("replicas.connections")
+            db_controller.replica_identity = replica_identity
+            return db_controller
+
+        logger.warning(f"The replica {replica['host']}:{replica['port']} is lagging ({lag} seconds), failing over")
+        metrics.increment("replicas.failovers")
+        db_controller.close_connection()
+
+    if not REPLICA_PRIMARY_FALLBACK:
+        msg = "None of the read replicas of the connection is usable."
+        raise ConnectionError(msg)
+
+    logger.warning("None of the read replicas is usable, connecting to the primary")
+    metrics.increment("replicas.primary_fallbacks")
+    return controller_type(tcp_details)
+
+
+def is_still_usable(db_controller: "BaseDBController") -> bool:
+    """
+    Check whether a controller can still be used for reads, e.g. when it is leased again from a pool.
+    The lag of the replica it is connected to is checked again if it has not been (by any controller) for `REPLICA_LAG_CHECK_INTERVAL` seconds.
+    Controllers connected to a primary are always usable.
+
+    Args:
+        db_controller (BaseDBController): The controller, as returned by `connect_for_reads`.
+
+    Returns:
+        bool: False if the replica has since been found unreachable or lagging more than `REPLICA_MAX_LAG` seconds behind.
+    """
+    if db_controller.replica_identity is None:
+        return True
+
+    with _statuses_lock:
+        status = _statuses.get(db_controller.replica_identity)
+
+    if status is None or time.monotonic() - status.checked_at > REPLICA_LAG_CHECK_INTERVAL:
+        try:
+            lag = db_controller.get_replication_lag()
+        except Exception:  # noqa: BLE001
+            logger.warning("Failed to get the replication lag of the replica of a pooled connection")
+            lag = None
+
+        status = _set_status(db_controller.replica_identity, lag)
+
+    if not status.usable:
+        logger.warning(f"The replica of a pooled connection is no longer usable ({status.lag} seconds of lag), failing over")
+        metrics.increment("replicas.failovers")
+
+    return status.usable
+
+
+def _order_replicas(db_type: str, tcp_details: dict, replicas: list[dict]) -> list[dict]:
+    """
+    Get the replicas to try, in an order rotated on every call.
+    Replicas found unusable within the last `REPLICA_RECHECK_AFTER` seconds are left out.
+
+    Args:
+        db_type (str): The type of database ('mysql' or 'postgres').
+        tcp_details (dict): The TCP connection parameters of the primary.
+        replicas (list[dict]): The host and port of each replica.
+
+    Returns:
+        list[dict]: The replicas to try.
+    """
+    candidates = []
+
+    with _statuses_lock:
+        for replica in replicas:
+            identity = connection_factory.connection_identity(db_type, {**tcp_details, "host": replica["host"], "port": replica["port"]})
+            status = _statuses.get(identity)
+
+            if status is None or status.usable or time.monotonic() - status.checked_at > REPLICA_RECHECK_AFTER:
+                candidates.append(replica)
+
+    if not candidates:
+        return []
+
+    start = next(_rotation) % len(candidates)
+    return candidates[start:] + candidates[:start]
+
+
+def _set_status(identity: str, lag: float | None) -> ReplicaStatus:
+    status = ReplicaStatus(lag=lag, checked_at=time.monotonic())
+
+    with _statuses_lock:
+        _statuses[identity] = status
+
+    return status
@@ -0,0 +1,306 @@
+import csv
+import logging
+from collections.abc import Callable, Iterable
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+logger = logging.getLogger("webtext2sql")
+
+
+def write_csv(batches: Iterable[tuple[tuple[str], list[Any]]], path: Path) -> int:
+    """
+    Write the streamed results of a query to a CSV file, one batch at a time.
+
+    Args:
+        batches (Iterable[tuple[tuple[str], list[Any]]]): The column names and the rows of each batch, as yielded by `stream_query`.
+        path (Path): The path of the CSV file to write.
+
+    Returns:
+        int: The number of rows written.
+    """
+    rows_written = 0
+    header_written = False
+
+    with path.open("w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+
+        for column_names, rows in batches:
+            if not header_written:
+                writer.writerow(column_names)
+                header_written = True
+
+            writer.writerows(rows)
+            rows_written += len(rows)
+
+    logger.debug(f"Wrote {rows_written} rows to {path}")
+    return rows_written
+
+
+def write_parquet(batches: Iterable[tuple[tuple[str], list[Any]]], path: Path) -> int:
+    """
+    Write the streamed results of a query to a Parquet file, one row group per batch.
+
+    Args:
+        batches (Iterable[tuple[tuple[str], list[Any]]]): The column names and the rows of each batch, as yielded by `stream_query`.
+        path (Path): The path of the Parquet file to write.
+
+    Returns:
+        int: The number of rows written.
+    """
+    import pyarrow.parquet as pq  # noqa: PLC0415 # pyarrow is only loaded when a columnar export is requested
+
+    return _write_record_batches(batches, path, pq.ParquetWriter, _read_parquet_batches)
+
+
+def write_arrow_ipc(batches: Iterable[tuple[tuple[str], list[Any]]], path: Path) -> int:
+    """
+    Write the streamed results of a query to an Arrow IPC (Feather v2) file, one record batch per batch.
+
+    Args:
+        batches (Iterable[tuple[tuple[str], list[Any]]]): The column names and the rows of each batch, as yielded by `stream_query`.
+        path (Path): The path of the Arrow IPC file to write.
+
+    Returns:
+        int: The number of rows written.
+    """
+    import pyarrow as pa  # noqa: PLC0415 # pyarrow is only loaded when a columnar export is requested
+
+    return _write_record_batches(batches, path, pa.ipc.new_file, _read_arrow_ipc_batches)
+
+
+def to_arrow_table(column_names: tuple[str], rows: "Iterable[tuple] | list[Any]") -> "pa.Table":
+    """
+    Convert a complete result set into an Arrow table, with the same types (and unique column names) as the columnar exports.
+
+    Args:
+        column_names (tuple[str]): The column names of the query.
+        rows (Iterable[tuple] | list[Any]): The rows of the results.
+
+    Returns:
+        pa.Table: The results as an Arrow table.
+    """
+    import pyarrow as pa  # noqa: PLC0415 # pyarrow is only loaded when results are actually converted
+
+    return pa.Table.from_batches(list(_to_record_batches([(column_names, list(rows))])))
+
+
+def _write_record_batches(
+    batches: Iterable[tuple[tuple[str], list[Any]]],
+    path: Path,
+    open_writer: Callable[[Path, "pa.Schema"], "pq.ParquetWriter | pa.ipc.RecordBatchFileWriter"],
+    read_batches: Callable[[Path], Iterable["pa.RecordBatch"]],
+) -> int:
+    """
+    Write the streamed results of a query to a columnar file, one record batch per batch.
+    If the schema changes midway (see `_to_record_batches`), the batches already written are rewritten with the new schema.
+
+    Args:
+        batches (Iterable[tuple[tuple[str], list[Any]]]): The column names and the rows of each batch, as yielded by `stream_query`.
+        path (Path): The path of the file to write.
+        open_writer (Callable[[Path, pa.Schema], pq.ParquetWriter | pa.ipc.RecordBatchFileWriter]): Opens a writer of the format for a path and a schema.
+        read_batches (Callable[[Path], Iterable[pa.RecordBatch]]): Reads back the record batches of a file of the format.
+
+    Returns:
+        int: The number of rows written.
+    """
+    rows_written = 0
+    writer = None
+    schema: pa.Schema | None = None
+
+    try:
+        for record_batch in _to_record_batches(batches):
+            if writer is None:
+                writer = open_writer(path, record_batch.schema)
+            elif not record_batch.schema.equals(schema):
+                # Closed before rewriting, so that it is not closed again if rewriting fails
+                writer.close()
+                writer = None
+                writer = _rewrite_with_schema(path, record_batch.schema, open_writer, read_batches)
+
+            schema = record_batch.schema
+            writer.write_batch(record_batch)
+            rows_written += record_batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+
+    logger.debug(f"Wrote {rows_written} rows to {path}")
+    return rows_written
+
+
+def _rewrite_with_schema(
+    path: Path,
+    schema: "pa.Schema",
+    open_writer: Callable[[Path, "pa.Schema"], "pq.ParquetWriter | pa.ipc.RecordBatchFileWriter"],
+    read_batches: Callable[[Path], Iterable["pa.RecordBatch"]],
+) -> "pq.ParquetWriter | pa.ipc.RecordBatchFileWriter":
+    """
+    Rewrite the record batches already written to a file with a new schema, one batch at a time.
+
+    Args:
+        path (Path): The path of the file.
+        schema (pa.Schema): The new schema, which the batches of the file can be cast to.
+        open_writer (Callable[[Path, pa.Schema], pq.ParquetWriter | pa.ipc.RecordBatchFileWriter]): Opens a writer of the format for a path and a schema.
+        read_batches (Callable[[Path], Iterable[pa.RecordBatch]]): Reads back the record batches of a file of the format.
+
+    Returns:
+        pq.ParquetWriter | pa.ipc.RecordBatchFileWriter: The writer of the rewritten file, open to write the rest of the batches.
+    """
+    previous_path = path.with_name(f"{path.name}.previous")
+    path.replace(previous_path)
+
+    writer = open_writer(path, schema)
+    try:
+        for record_batch in read_batches(previous_path):
+            writer.write_batch(record_batch.cast(schema))
+    except Exception:
+        writer.close()
+        raise
+    finally:
+        previous_path.unlink()
+
+    return writer
+
+
+def _read_parquet_batches(path: Path) -> Iterable["pa.RecordBatch"]:
+    """
+    Read back the record batches of a Parquet file.
+
+    Args:
+        path (Path): The path of the Parquet file.
+
+    Yields:
+        pa.RecordBatch: The record batches of the file.
+    """
+    import pyarrow.parquet as pq  # noqa: PLC0415
+
+    with pq.ParquetFile(path) as parquet_file:
+        yield from parquet_file.iter_batches()
+
+
+def _read_arrow_ipc_batches(path: Path) -> Iterable["pa.RecordBatch"]:
+    """
+    Read back the record batches of an Arrow IPC file.
+
+    Args:
+        path (Path): The path of the Arrow IPC file.
+
+    Yields:
+        pa.RecordBatch: The record batches of the file.
+    """
+    import pyarrow as pa  # noqa: PLC0415
+
+    with pa.memory_map(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        for index in range(reader.num_record_batches):
+            yield reader.get_batch(index)
+
+
+def _to_record_batches(batches: Iterable[tuple[tuple[str], list[Any]]]) -> Iterable["pa.RecordBatch"]:
+    """
+    Convert the row-oriented batches of a cursor into columnar Arrow record batches.
+    The schema is inferred from the first batch and enforced on the rest, since a file can only have one schema.
+    Decimal columns are widened to the largest precision, since the first batch may not hold the widest values,
+    and a column whose values in a later batch still do not fit its type is converted to strings from then on.
+
+    Args:
+        batches (Iterable[tuple[tuple[str], list[Any]]]): The column names and the rows of each batch, as yielded by `stream_query`.
+
+    Yields:
+        pa.RecordBatch: The record batch of each batch of rows.
+    """
+    import pyarrow as pa  # noqa: PLC0415
+
+    schema: pa.Schema | None = None
+
+    for column_names, rows in batches:
+        columns = list(zip(*rows, strict=True)) if rows else [() for _ in column_names]
+
+        if schema is None:
+            arrays = [pa.array(column) for column in columns]
+            # Columns that are entirely NULL in the first batch have no type to infer, so they fall back to strings
+            arrays = [array.cast(pa.string()) if pa.types.is_null(array.type) else array for array in arrays]
+            arrays = [array.cast(_widen_decimal(array.type)) if pa.types.is_decimal(array.type) else array for array in arrays]
+            schema = pa.schema(
+                [pa.field(name, array.type) for name, array in zip(_deduplicate_names(column_names), arrays, strict=True)],
+            )
+        else:
+            arrays = []
+            for index, (column, field) in enumerate(zip(columns, schema, strict=True)):
+                try:
+                    arrays.append(_to_array(column, field.type))
+                except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+                    logger.warning(f"The values of column {field.name} no longer fit {field.type}, so it is exported as strings")
+                    schema = schema.set(index, pa.field(field.name, pa.string()))
+                    arrays.append(_to_array(column, pa.string()))
+
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _widen_decimal(arrow_type: "pa.DataType") -> "pa.DataType":
+    """
+    Widen a decimal type to the largest precision of its width, keeping its scale.
+
+    Args:
+        arrow_type (pa.DataType): The decimal type inferred from the values of the first batch.
+
+    Returns:
+        pa.DataType: The widened decimal type.
+    """
+    import pyarrow as pa  # noqa: PLC0415
+
+    if pa.types.is_decimal256(arrow_type):
+        return pa.decimal256(76, arrow_type.scale)
+
+    return pa.decimal128(38, arrow_type.scale)
+
+
+def _to_array(column: tuple[Any], arrow_type: "pa.DataType") -> "pa.Array":
+    """
+    Convert the values of a column into an Arrow array of the given type.
+
+    Args:
+        column (tuple[Any]): The values of the column.
+        arrow_type (pa.DataType): The type of the column in the schema.
+
+    Returns:
+        pa.Array: The Arrow array.
+    """
+    import pyarrow as pa  # noqa: PLC0415
+
+    if pa.types.is_string(arrow_type):
+        return pa.array([None if value is None else str(value) for value in column], type=arrow_type)
+
+    return pa.array(column, type=arrow_type)
+
+
+def _deduplicate_names(column_names: tuple[str]) -> list[str]:
+    """
+    Make the column names unique, since a query may return the same name more than once (e.g. `SELECT *` over a join).
+
+    Args:
+        column_names (tuple[str]): The column names of the query.
+
+    Returns:
+        list[str]: The unique column names, with a numeric suffix added to the repeated ones.
+    """
+    seen: dict[str, int] = {}
+    unique_names: list[str] = []
+
+    for name in column_names:
+        seen[name] = seen.get(name, 0) + 1
+        unique_names.append(name if seen[name] == 1 else f"{name}_{seen[name] - 1}")
+
+    return unique_names
+
+
+# The writer and the file extension of each export format offered to the user
+EXPORT_FORMATS: dict[str, tuple[Callable[[Iterable[tuple[tuple[str], list[Any]]], Path], int], str]] = {
+    "csv": (write_csv, "csv"),
+    "parquet": (write_parquet, "parquet"),
+    "arrow": (write_arrow_ipc, "arrow"),
+}
@@ -0,0 +1,84 @@
+import csv
+import io
+import logging
+from collections.abc import Iterable, Sequence
+from itertools import islice
+from typing import Any
+
+from execution_configs import MAX_COLUMN_WIDTH
+
+logger = logging.getLogger("webtext2sql")
+
+TRUNCATION_MARK = "…"
+NULL_MARK = "NULL"
+
+
+def format_markdown_table(
+    rows: Iterable[Sequence[Any]],
+    column_names: Sequence[str],
+    max_rows: int,
+    max_column_width: int = MAX_COLUMN_WIDTH,
+) -> str:
+    """
+    Render the first rows of a query's results as a markdown table.
+    Rows are consumed lazily from the iterable, so only the rendered ones are ever touched.
+
+    Args:
+        rows (Iterable[Sequence[Any]]): The rows of the results.
+        column_names (Sequence[str]): The column names of the results.
+        max_rows (int): The maximum number of rows to render.
+        max_column_width (int): The maximum number of characters of a cell, longer values are truncated.
+
+    Returns:
+        str: The markdown table.
+    """
+    header = "| " + " | ".join(_format_cell(name, max_column_width) for name in column_names) + " |"
+    separator = "|" + "|".join("---" for _ in column_names) + "|"
+
+    lines = [header, separator]
+    lines.extend("| " + " | ".join(_format_cell(value, max_column_width) for value in row) + " |" for row in islice(rows, max_rows))
+
+    return "\n".join(lines)
+
+
+def format_csv(rows: Iterable[Sequence[Any]], column_names: Sequence[str]) -> str:
+    """
+    Render the rows of a query's results as CSV.
+
+    Args:
+        rows (Iterable[Sequence[Any]]): The rows of the results.
+        column_names (Sequence[str]): The column names of the results.
+
+    Returns:
+        str: The CSV content, including the header.
+    """
+    buffer = io.StringIO()
+
+    writer = csv.writer(buffer)
+    writer.writerow(column_names)
+    writer.writerows(rows)
+
+    return buffer.getvalue()
+
+
+def _format_cell(value: Any, max_column_width: int) -> str:  # noqa: ANN401
+    """
+    Render a single value as the content of a markdown table cell.
+
+    Args:
+        value (Any): The value to render.
+        max_column_width (int): The maximum number of characters of the cell, longer values are truncated.
+
+    Returns:
+        str: The content of the cell.
+    """
+    if value is None:
+        return NULL_MARK
+
+    text = str(value)
+
+    if len(text) > max_column_width:
+        text = text[: max_column_width - len(TRUNCATION_MARK)] + TRUNCATION_MARK
+
+    # Pipes would break the table and newlines would end the row
+    return text.replace("|", "\\|").replace("\r", " ").replace("\n", " ")
@@ -0,0 +1,175 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import Counter
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+import metrics
+from execution_configs import (
+    SCHEDULER_DB_MAX_CONCURRENT,
+    SCHEDULER_DB_MAX_CONCURRENT_PER_USER,
+    SCHEDULER_LLM_MAX_CONCURRENT,
+    SCHEDULER_LLM_MAX_CONCURRENT_PER_USER,
+    SCHEDULER_MAX_QUEUED,
+    SCHEDULER_MAX_QUEUED_PER_USER,
+)
+
+logger: logging.Logger = logging.getLogger("webtext2sql")
+
+# The user (and the weight of their work) the current task runs on behalf of, as set by the entry points (chat, batch, API)
+_current_user: ContextVar[tuple[str, float]] = ContextVar("current_user", default=("", 1.0))
+
+
+class SchedulerBusyError(Exception):
+    """Raised when there is too much work queued already, so that the request is turned down instead of waiting."""
+
+
+def set_current_user(user: str, weight: float = 1.0) -> None:
+    """
+    Set the user the work of the current task (and the tasks and threads it starts) is scheduled on behalf of.
+
+    Args:
+        user (str): The email of the user.
+        weight (float): The share of the capacity the work gets compared to the work of other users, e.g. lower for batches.
+    """
+    _current_user.set((user, weight))
+
+
+@dataclass(order=True)
+class _Waiter:
+    finish_tag: float
+    sequence: int
+    start_tag: float = field(compare=False)
+    user: str = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class FairScheduler:
+    """
+    Bounds the concurrent work of a kind (e.g. requests to the AI model) in total and per user, with weighted fair queuing.
+
+    Work that cannot start right away is queued, and whenever a slot is released the queued work with the lowest virtual
+    finish tag (whose user is under their own limit) starts. Each piece of work advances the tag of its user by `1 / weight`,
+    so a user with a lot of work queued does not hold up the others, whose tags stay behind.
+    When the queue (in total or of the user) is full, the work is turned down with a `SchedulerBusyError`.
+    """
+
+    def __init__(self, name: str, *, max_concurrent: int, max_concurrent_per_user: int, max_queued: int, max_queued_per_user: int) -> None:
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_concurrent_per_user = max_concurrent_per_user
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+
+        self._running: Counter[str] = Counter()
+        self._queued: Counter[str] = Counter()
+        self._waiters: list[_Waiter] = []
+        self._finish_tags: dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._sequence = itertools.count()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncGenerator[None]:
+        """
+        Hold a slot for a piece of work of the current user, waiting for one if needed.
+
+        Yields:
+            None: Once the work can start.
+
+        Raises:
+            SchedulerBusyError: If the queue is full.
+        """
+        user, weight = _current_user.get()
+
+        await self._acquire(user, weight)
+        try:
+            yield
+        finally:
+            self._release(user)
+
+    async def _acquire(self, user: str, weight: float) -> None:
+        can_start = self._can_start(user)
+
+        if not can_start and (len(self._waiters) >= self.max_queued or self._queued[user] >= self.max_queued_per_user):
+            logger.warning(f"Turning down {self.name} work of user {user}: {len(self._waiters)} queued in total, {self._queued[user]} by the user")
+            metrics.increment(f"scheduler.{self.name}.shed")
+            msg = "The service is busy right now. Please try again in a moment."
+            raise SchedulerBusyError(msg)
+
+        start_tag = max(self._virtual_time, self._finish_tags.get(user, 0.0))
+        finish_tag = start_tag + 1 / weight
+        self._finish_tags[user] = finish_tag
+
+        if can_start:
+            self._start(user, start_tag)
+            metrics.observe(f"scheduler.{self.name}.queue_wait_ms", 0)
+            return
+
+        waiter = _Waiter(finish_tag, next(self._sequence), start_tag, user, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self._queued[user] += 1
+
+        started = time.perf_counter()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was granted right before the cancellation, so it is passed on to the next waiter
+                self._release(user)
+            else:
+                self._waiters.remove(waiter)
+                self._queued[user] -= 1
+            raise
+        finally:
+            metrics.observe(f"scheduler.{self.name}.queue_wait_ms", (time.perf_counter() - started) * 1000)
+
+    def _can_start(self, user: str) -> bool:
+        return self._running.total() < self.max_concurrent and self._running[user] < self.max_concurrent_per_user
+
+    def _start(self, user: str, start_tag: float) -> None:
+        self._running[user] += 1
+        # The virtual time is the start tag of the latest work started
+        self._virtual_time = max(self._virtual_time, start_tag)
+        metrics.increment(f"scheduler.{self.name}.started")
+
+    def _release(self, user: str) -> None:
+        self._running[user] -= 1
+        if not self._running[user]:
+            del self._running[user]
+
+        # Start the queued work with the lowest finish tags, skipping the users that are at their own limit
+        for waiter in sorted(self._waiters):
+            if self._running.total() >= self.max_concurrent:
+                break
+            if self._running[waiter.user] < self.max_concurrent_per_user:
+                self._waiters.remove(waiter)
+                self._queued[waiter.user] -= 1
+                self._start(waiter.user, waiter.start_tag)
+                waiter.future.set_result(None)
+
+        # The tags of the users without any work left are forgotten once the others have caught up with them
+        for idle_user in [idle_user for idle_user, tag in self._finish_tags.items() if tag <= self._virtual_time]:
+            if not self._running[idle_user] and not self._queued[idle_user]:
+                del self._finish_tags[idle_user]
+                self._queued.pop(idle_user, None)
+
+
+llm_scheduler = FairScheduler(
+    "llm",
+    max_concurrent=SCHEDULER_LLM_MAX_CONCURRENT,
+    max_concurrent_per_user=SCHEDULER_LLM_MAX_CONCURRENT_PER_USER,
+    max_queued=SCHEDULER_MAX_QUEUED,
+    max_queued_per_user=SCHEDULER_MAX_QUEUED_PER_USER,
+)
+
+db_scheduler = FairScheduler(
+    "db",
+    max_concurrent=SCHEDULER_DB_MAX_CONCURRENT,
+    max_concurrent_per_user=SCHEDULER_DB_MAX_CONCURRENT_PER_USER,
+    max_queued=SCHEDULER_MAX_QUEUED,
+    max_queued_per_user=SCHEDULER_MAX_QUEUED_PER_USER,
+)
@@ -0,0 +1,93 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cache_backends
+import connection_pool
+from caching_configs import SCHEMAS_CACHE_TTL, SCHEMAS_REFRESH_AFTER
+from connection_factory import connection_identity
+
+logger: logging.Logger = logging.getLogger("webtext2sql")
+
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="webtext2sql-schemas")
+
+# The connections whose schema list is being refreshed, so that a refresh is not scheduled again while it is running
+_refreshing: set[str] = set()
+_refreshing_lock = threading.Lock()
+
+
+def get_available_schemas(conn_info: dict) -> list[str]:
+    """
+    Get the names of the schemas available on a connection, from the cache if possible.
+    The schema list is cached by the identity of the connection (so it is shared by SSH and direct connections, workers etc.)
+    and a list older than `SCHEMAS_REFRESH_AFTER` seconds is still returned, but refreshed in the background.
+
+    Args:
+        conn_info (dict): The connection information.
+
+    Returns:
+        list[str]: The schema names, or an empty list if there are none (or they could not be fetched).
+    """
+    identity = connection_identity(conn_info["type_of_db"], conn_info["tcp"], conn_info.get("ssh"))
+
+    cached = cache_backends.get_cache_backend().get(_cache_key(identity))
+    if cached is cache_backends.MISSING:
+        try:
+            return refresh_available_schemas(conn_info)
+        except Exception:
+            logger.exception("Failed to fetch the available schemas")
+            return []
+
+    schemas, fetched_at = cached
+    if time.time() - fetched_at > SCHEMAS_REFRESH_AFTER:
+        _schedule_refresh(conn_info, identity)
+
+    return schemas
+
+
+def refresh_available_schemas(conn_info: dict) -> list[str]:
+    """
+    Fetch the names of the schemas available on a connection (through its shared pool) and cache them.
+
+    Args:
+        conn_info (dict): The connection information.
+
+    Returns:
+        list[str]: The schema names, or an empty list if there are none (which is not cached).
+
+    Raises:
+        Exception: If the connection cannot be established, as raised by the SSH tunnel or the database driver.
+    """
+    pool = connection_pool.get_shared_pool(conn_info)
+
+    with pool.lease() as db_controller:
+        schemas = db_controller.get_available_dbs()
+
+    if schemas:
+        identity = connection_identity(conn_info["type_of_db"], conn_info["tcp"], conn_info.get("ssh"))
+        cache_backends.get_cache_backend().set(_cache_key(identity), (schemas, time.time()), SCHEMAS_CACHE_TTL)
+
+    return schemas
+
+
+def _schedule_refresh(conn_info: dict, identity: str) -> None:
+    with _refreshing_lock:
+        if identity in _refreshing:
+            return
+        _refreshing.add(identity)
+
+    def refresh() -> None:
+        try:
+            refresh_available_schemas(conn_info)
+        except Exception:  # noqa: BLE001
+            logger.warning("Failed to refresh the available schemas in the background")
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(identity)
+
+    _refresh_executor.submit(refresh)
+
+
+def _cache_key(identity: str) -> str:
+    return cache_backends.make_key("available_schemas", identity)
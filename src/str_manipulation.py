@@ -1,16 +1,17 @@
 import logging
+import re
 from typing import TYPE_CHECKING
 
 import chainlit as cl
-import pandas as pd
-from cachetools.func import ttl_cache
 from chainlit.element import Element as cl_Element
 
-from caching_configs import CACHE_MAX_SIZE, CACHE_TTL
+import result_formatting
 
 if TYPE_CHECKING:
     from collections.abc import Callable
 
+    from db_controllers.base_db_controller import QueryExecutionError
+
 
 logger = logging.getLogger("webtext2sql")
 
@@ -18,6 +19,27 @@
 # As per #63, only MAX_RESULT_ROWS rows are returned to avoid overwhelming the user.
 MAX_RESULT_ROWS = 10
 
+# e.g. "ENGINE=InnoDB AUTO_INCREMENT=1234 DEFAULT CHARSET=utf8mb4", as given by MySQL's SHOW CREATE TABLE
+_AUTO_INCREMENT_OPTION = re.compile(r"\s+AUTO_INCREMENT=\d+")
+
+# e.g. "CREATE TABLE `orders` (" on MySQL or "CREATE TABLE public.orders (" on Postgres
+_DDL_TABLE_NAME = re.compile(r"CREATE TABLE\s+(?:[`\"]?[^\s.`\"(]+[`\"]?\.)?[`\"]?([^\s.`\"(]+)", re.IGNORECASE)
+
+# The tokens of a SQL query, as told apart by `normalize_sql_fingerprint` and `limit_query_rows`,
+# in order of precedence (e.g. a `--` within a string is not a comment)
+_FINGERPRINT_TOKEN = re.compile(
+    r"""(?P<string>[eEnN]?'(?:[^'\\]|''|\\.)*')"""
+    r"""|(?P<quoted>"(?:[^"]|"")*"|`[^`]*`)"""
+    r"""|(?P<comment>--[^\n]*|/\*.*?\*/)"""
+    r"""|(?P<word>[A-Za-z_][\w$]*)"""
+    r"""|(?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)"""
+    r"""|(?P<symbol>::|<=|>=|<>|!=|\|\||->>?|#>>?|[^\s\w])""",
+    re.DOTALL,
+)
+
+# A list of literals, e.g. of an IN, after they have been replaced with placeholders
+_FINGERPRINT_LIST = re.compile(r"\(\?(?:, \?)+\)")
+
 
 def extract_sql_only(string: str) -> str:
     """
@@ -78,7 +100,65 @@ def _remove_empty_lines(string: str) -> str:
     return "\n".join(lines)
 
 
-def form_answer(results: tuple[tuple], column_names: tuple[str], query: str) -> tuple[str, list[cl_Element]]:
+def limit_query_rows(query: str, limit: int) -> str | None:
+    """
+    Wrap a query in a derived table with a LIMIT, so that the server stops after producing the first rows.
+
+    Args:
+        query (str): The SQL query to wrap.
+        limit (int): The maximum number of rows the wrapped query returns.
+
+    Returns:
+        str | None: The wrapped query, or None if the query is not a single SELECT statement and cannot be wrapped.
+    """
+    stripped_query = query.strip().rstrip(";").strip()
+    # A `;` or a keyword within a string literal or a comment does not count, e.g. `SELECT * FROM notes WHERE body LIKE '%;%'`
+    tokens = [match for match in _FINGERPRINT_TOKEN.finditer(stripped_query) if match.lastgroup != "comment"]
+    first_keyword = tokens[0].group().upper() if tokens and tokens[0].lastgroup == "word" else ""
+
+    if first_keyword not in ("SELECT", "WITH") or any(token.group() == ";" for token in tokens):
+        logger.debug(f"The query cannot be wrapped with a LIMIT: {query}")
+        return None
+
+    # The closing parenthesis goes on its own line in case the query ends with a `--` comment
+    return f"SELECT * FROM (\n{stripped_query}\n) AS webtext2sql_preview LIMIT {int(limit)}"
+
+
+def normalize_sql_fingerprint(query: str) -> str:
+    """
+    Normalize a SQL query so that the queries that only differ in their literals, comments, whitespace or letter case
+    are identical, e.g. to aggregate the executions of the same query with different values.
+
+    Args:
+        query (str): The SQL query to normalize.
+
+    Returns:
+        str: The query with its literals replaced by `?` (lists of them by `(?+)`), its comments removed,
+        its keywords and unquoted identifiers lowercased and its whitespace collapsed.
+    """
+    tokens = []
+
+    for match in _FINGERPRINT_TOKEN.finditer(query):
+        if match.lastgroup in ("string", "number"):
+            tokens.append("?")
+        elif match.lastgroup == "word":
+            tokens.append(match.group().lower())
+        elif match.lastgroup != "comment":
+            tokens.append(match.group())
+
+    # The tokens are joined the same way regardless of the original whitespace, with the usual spacing around punctuation
+    normalized = " ".join(tokens).replace(" . ", ".").replace("( ", "(").replace(" )", ")").replace(" ,", ",").removesuffix(" ;")
+    return _FINGERPRINT_LIST.sub("(?+)", normalized)
+
+
+def form_answer(
+    results: tuple[tuple],
+    column_names: tuple[str],
+    query: str,
+    *,
+    has_more: bool = False,
+    downloadable: bool = True,
+) -> tuple[str, list[cl_Element]]:
     """
     Format the results before sending them back to the user.
 
@@ -86,6 +166,8 @@ def form_answer(results: tuple[tuple], column_names: tuple[str], query: str) ->
         results (tuple[tuple]): tuple of tuples containing the fetched data.
         column_names (tuple[str]): tuple of column names.
         query (str): The SQL query that was executed.
+        has_more (bool): Whether the query has more rows than the ones given, in which case only a preview is shown.
+        downloadable (bool): Whether the full results of a preview can be downloaded, i.e. if the query ran on the database.
 
     Returns:
         tuple[str, list[cl_Element]]: A tuple containing the formatted answer and a list of Chainlit elements.
@@ -96,23 +178,31 @@ def form_answer(results: tuple[tuple], column_names: tuple[str], query: str) ->
         logger.warning("No results found for the SQL query.")
         md_results = "\nNo results found."
     else:
-        results_df = pd.DataFrame(results, columns=column_names)
-
         # As per #63, only MAX_RESULT_ROWS rows are returned to avoid overwhelming the user.
-        md_top_results = results_df.head(MAX_RESULT_ROWS).to_markdown(index=False)
+        md_top_results = result_formatting.format_markdown_table(results, column_names, max_rows=MAX_RESULT_ROWS)
 
         elements = [
-            cl.File(
-                name="data_table.csv",
-                content=results_df.to_csv(index=False),
-                display="inline",
-            ),
             cl.Text(
                 content=md_top_results,
                 display="inline",
             ),
         ]
 
+        if has_more:
+            md_results = f"\nOnly the first {MAX_RESULT_ROWS} rows are shown."
+            if downloadable:
+                md_results += " The full results can be downloaded as a CSV, Parquet or Arrow file."
+        else:
+            # The preview is the complete result set, so it can be offered as a CSV file right away
+            elements.insert(
+                0,
+                cl.File(
+                    name="data_table.csv",
+                    content=result_formatting.format_csv(results, column_names),
+                    display="inline",
+                ),
+            )
+
         logger.debug(f"Formatted results: {md_top_results}")
 
     answer = f"Here is the SQL query the AI model generated:\n```sql\n{query}\n```\n\nAnd here are the results:{md_results}"
@@ -122,9 +212,30 @@ def form_answer(results: tuple[tuple], column_names: tuple[str], query: str) ->
     return answer, elements
 
 
+def form_error_answer(error: "QueryExecutionError") -> str:
+    """
+    Format the error of a query that could not be executed (even after being repaired) before sending it back to the user.
+
+    Args:
+        error (QueryExecutionError): The error raised when executing the last query.
+
+    Returns:
+        str: The formatted answer.
+    """
+    if error.interrupted:
+        reason = "The query was cancelled or took too long to execute."
+    else:
+        code = f" ({error.code})" if error.code else ""
+        reason = f"The database could not execute the query{code}:\n```\n{error.message}\n```"
+
+    return f"Here is the SQL query the AI model generated:\n```sql\n{error.query}\n```\n\n{reason}"
+
+
 def optimize_ddl_for_ai(ddl: str) -> str:
     """
     Optimize the DDL for AI model processing by removing unnecessary whitespace.
+    Table options that change with the data (i.e. MySQL's next AUTO_INCREMENT value) are removed as well,
+    so that the DDL of a table stays the same, and the prompts that include it can be cached by the AI provider.
 
     Args:
         ddl (str): The DDL string to optimize.
@@ -132,30 +243,27 @@ def optimize_ddl_for_ai(ddl: str) -> str:
     Returns:
         str: Optimized DDL string.
     """
+    ddl = _AUTO_INCREMENT_OPTION.sub("", ddl)
     return " ".join(ddl.split())
 
 
-@ttl_cache(maxsize=CACHE_MAX_SIZE, ttl=CACHE_TTL)
-def _create_markdown_results_table(results: tuple[tuple], column_names: tuple[str]) -> str:
+def select_relevant_tables(metadata: list[str], *texts: str) -> list[str]:
     """
-    Create a markdown table from the results and column names.
+    Select the DDL of the tables that are mentioned in any of the given texts, e.g. a failed SQL query and its error.
 
     Args:
-        results (tuple[tuple]): tuple of tuples containing the fetched data.
-        column_names (tuple[str]): tuple of column names.
+        metadata (list[str]): The DDL of the tables of the schema.
+        *texts (str): The texts to look for the table names in.
 
     Returns:
-        str: Markdown formatted table.
+        list[str]: The DDL of the mentioned tables, or all of it if none of the tables is mentioned.
     """
-    all_column_names = [*column_names]  # Generators have no len() method, so we need to convert it to a list
-
-    # Create header
-    header = "| " + " | ".join(all_column_names) + " |"
-    separator = "| " + " | ".join(["---"] * len(all_column_names)) + " |"
+    words = {word.lower() for text in texts for word in re.findall(r"\w+", text)}
 
-    # Create rows
-    rows = ["| " + " | ".join([str(item) for item in row]) + " |" for row in results]
+    relevant_tables = []
+    for ddl in metadata:
+        match = _DDL_TABLE_NAME.search(ddl)
+        if not match or match.group(1).lower() in words:
+            relevant_tables.append(ddl)
 
-    # Combine header, separator, and rows
-    return "\n".join([header, separator, *rows])
-    return "\n".join([header, separator, *rows])
+    return relevant_tables or metadata
@@ -1,4 +1,6 @@
+from .api_keys import ApiKey
 from .app_users import AppUser
-from .user_connections import UserConnection
+from .query_workload import QueryExecution
+from .user_connections import UserConnection, UserConnectionThread
 
-__all__ = ["AppUser", "UserConnection"]
+__all__ = ["ApiKey", "AppUser", "QueryExecution", "UserConnection", "UserConnectionThread"]
@@ -0,0 +1,94 @@
+import hashlib
+import secrets
+
+from sqlmodel import Session, select
+
+from .models import ApiKey
+
+API_KEY_PREFIX = "wt2s_"  # Makes the keys recognizable, e.g. by secret scanners
+
+
+def hash_api_key(raw_key: str) -> str:
+    """
+    Hash an API key for storage and lookup.
+    The keys are random and long enough that a fast hash is sufficient, unlike passwords.
+
+    Args:
+        raw_key (str): The API key, as given to the user.
+
+    Returns:
+        str: The SHA-256 of the key in hex.
+    """
+    return hashlib.sha256(raw_key.encode()).hexdigest()
+
+
+def create_api_key(user_email: str, name: str, session: Session) -> tuple[ApiKey, str]:
+    """
+    Create a new API key for a user.
+
+    Args:
+        user_email (str): The email of the user the key belongs to.
+        name (str): A name to recognize the key by, e.g. the service that uses it.
+        session (Session): The SQLAlchemy session to use for the insertion.
+
+    Returns:
+        tuple[ApiKey, str]: The stored API key and the key itself, which is not stored and cannot be retrieved again.
+    """
+    raw_key = f"{API_KEY_PREFIX}{secrets.token_urlsafe(32)}"
+
+    api_key = ApiKey(user_email=user_email, name=name, hashed_key=hash_api_key(raw_key))
+    session.add(api_key)
+    session.commit()
+    session.refresh(api_key)
+
+    return api_key, raw_key
+
+
+def get_user_email_by_api_key(raw_key: str, session: Session) -> str | None:
+    """
+    Retrieve the email of the user an API key belongs to.
+
+    Args:
+        raw_key (str): The API key, as given by the caller.
+        session (Session): The SQLAlchemy session to use for the query.
+
+    Returns:
+        str | None: The email of the user, or None if the key does not exist (or has been deleted).
+    """
+    return session.exec(select(ApiKey.user_email).where(ApiKey.hashed_key == hash_api_key(raw_key))).first()
+
+
+def get_api_keys_by_email(email: str, session: Session) -> list[ApiKey]:
+    """
+    Retrieve all the API keys of a user.
+
+    Args:
+        email (str): The email address of the user.
+        session (Session): The SQLAlchemy session to use for the query.
+
+    Returns:
+        list[ApiKey]: The API keys of the user, or an empty list if there are none.
+    """
+    return session.exec(select(ApiKey).where(ApiKey.user_email == email)).all() or []
+
+
+def delete_api_key(api_key_id: str, user_email: str, session: Session) -> str | None:
+    """
+    Delete an API key of a user.
+
+    Args:
+        api_key_id (str): The ID of the API key.
+        user_email (str): The email of the user the key belongs to.
+        session (Session): The SQLAlchemy session to use for the deletion.
+
+    Returns:
+        str | None: The hash of the deleted key (e.g. to forget it where it is cached), or None if the user has no such key.
+    """
+    api_key = session.exec(select(ApiKey).where(ApiKey.id == api_key_id, ApiKey.user_email == user_email)).first()
+    if not api_key:
+        return None
+
+    hashed_key = api_key.hashed_key
+    session.delete(api_key)
+    session.commit()
+    return hashed_key
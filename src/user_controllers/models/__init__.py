@@ -1,4 +1,7 @@
+from .api_keys import ApiKey
 from .app_users import AppUser
+from .query_workload import QueryExecution
+from .user_connection_threads import UserConnectionThread
 from .user_connections import UserConnection
 
-__all__ = ["AppUser", "UserConnection"]
+__all__ = ["ApiKey", "AppUser", "QueryExecution", "UserConnection", "UserConnectionThread"]
@@ -0,0 +1,16 @@
+import datetime
+import uuid
+
+from sqlmodel import Field, SQLModel
+
+
+class ApiKey(SQLModel, table=True):
+    """Model representing an API key of a user, used to call the REST API programmatically."""
+
+    __tablename__ = "API_KEYS"
+
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
+    created_at: str = Field(default_factory=datetime.datetime.now, nullable=False)
+    user_email: str = Field(default=None, nullable=False, index=True, foreign_key="APP_USERS.email")
+    name: str = Field(default=None, nullable=False)
+    hashed_key: str = Field(default=None, nullable=False, unique=True)
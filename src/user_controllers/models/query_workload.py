@@ -0,0 +1,23 @@
+import datetime
+
+from sqlmodel import Column, DateTime, Field, SQLModel
+
+
+class QueryExecution(SQLModel, table=True):
+    """Model representing an execution of a generated query, recorded to find the slow and the repeated queries."""
+
+    __tablename__ = "QUERY_WORKLOAD"
+
+    id: int | None = Field(default=None, primary_key=True)
+    # Naive, like the other timestamps of the app database
+    executed_at: datetime.datetime = Field(default_factory=datetime.datetime.now, sa_column=Column(DateTime, nullable=False, index=True))
+    fingerprint: str = Field(default=None, nullable=False, index=True)
+    normalized_query: str = Field(default=None, nullable=False)
+    connection_id: str | None = Field(default=None)
+    connection_identity: str = Field(default=None, nullable=False)
+    db_schema: str | None = Field(default=None)
+    duration_ms: float = Field(default=None, nullable=False)
+    row_count: int | None = Field(default=None)
+    byte_count: int | None = Field(default=None)
+    error_class: str | None = Field(default=None)
+    llm_latency_ms: float | None = Field(default=None)
@@ -0,0 +1,14 @@
+import datetime
+
+from sqlmodel import Field, SQLModel
+
+
+class UserConnectionThread(SQLModel, table=True):
+    """Model representing the binding of a chat thread (of the Chainlit data layer) to a connection it has been used with."""
+
+    __tablename__ = "USER_CONNECTION_THREADS"
+
+    connection_id: str = Field(default=None, primary_key=True, foreign_key="USER_CONNECTIONS.id")
+    thread_id: str = Field(default=None, primary_key=True, index=True)  # References the `Thread` table of Chainlit, which has no model
+    created_at: str = Field(default_factory=datetime.datetime.now, nullable=False)
+    db_schema: str | None = Field(default=None, nullable=True)  # The schema last selected in the thread, which is restored when it is resumed
@@ -15,4 +15,6 @@ class UserConnection(SQLModel, table=True):
     server_name: str = Field(default=None, nullable=False, index=True)
     ssh_connection_info: dict = Field(default_factory=dict, sa_column=Column(JSON))
     tcp_connection_info: dict = Field(default_factory=dict, sa_column=Column(JSON))
+    replica_connection_info: list = Field(default_factory=list, sa_column=Column(JSON))
     type_of_db: str = Field(default=None, nullable=False, index=True)
+    last_used_at: str = Field(default_factory=datetime.datetime.now, nullable=False)
@@ -0,0 +1,68 @@
+import datetime
+
+from sqlmodel import Session, func, insert, select
+
+from .models import QueryExecution
+
+# The statistics of each fingerprint that the top fingerprints can be ordered by
+WORKLOAD_ORDERINGS = ("total_time", "p95", "frequency")
+
+
+def insert_query_executions(executions: list[dict], session: Session) -> None:
+    """
+    Insert a batch of recorded query executions in a single statement.
+
+    Args:
+        executions (list[dict]): The executions, with the fields of `QueryExecution` (except for the ID).
+        session (Session): The SQLAlchemy session to use for the insertion.
+    """
+    session.exec(insert(QueryExecution), params=executions)
+    session.commit()
+
+
+def get_top_fingerprints(order_by: str, limit: int, since: datetime.datetime, session: Session) -> list[dict]:
+    """
+    Retrieve the statistics of the query fingerprints executed the most, or taking the most time.
+
+    Args:
+        order_by (str): The statistic to order the fingerprints by, one of `WORKLOAD_ORDERINGS`.
+        limit (int): The maximum number of fingerprints to retrieve.
+        since (datetime.datetime): Only the executions since then are taken into account.
+        session (Session): The SQLAlchemy session to use for the query.
+
+    Returns:
+        list[dict]: The statistics of each fingerprint, in descending order of the chosen one.
+
+    Raises:
+        ValueError: If the fingerprints cannot be ordered by the given statistic.
+    """
+    if order_by not in WORKLOAD_ORDERINGS:
+        msg = f"Invalid ordering: {order_by}. Expected one of {', '.join(WORKLOAD_ORDERINGS)}."
+        raise ValueError(msg)
+
+    total_time = func.sum(QueryExecution.duration_ms).label("total_time_ms")
+    p95 = func.percentile_cont(0.95).within_group(QueryExecution.duration_ms).label("p95_ms")
+    frequency = func.count().label("executions")
+
+    rows = session.exec(
+        select(
+            QueryExecution.fingerprint,
+            func.min(QueryExecution.normalized_query).label("normalized_query"),
+            frequency,
+            func.count(QueryExecution.error_class).label("errors"),
+            total_time,
+            func.avg(QueryExecution.duration_ms).label("mean_ms"),
+            p95,
+            func.avg(QueryExecution.row_count).label("mean_rows"),
+            func.avg(QueryExecution.byte_count).label("mean_bytes"),
+            func.avg(QueryExecution.llm_latency_ms).label("mean_llm_latency_ms"),
+            func.count(func.distinct(QueryExecution.connection_id)).label("connections"),  # The user connections, not the databases
+            func.max(QueryExecution.executed_at).label("last_executed_at"),
+        )
+        .where(QueryExecution.executed_at >= since)
+        .group_by(QueryExecution.fingerprint)
+        .order_by({"total_time": total_time, "p95": p95, "frequency": frequency}[order_by].desc())
+        .limit(limit),
+    ).all()
+
+    return [row._asdict() for row in rows]
@@ -0,0 +1,15 @@
+from sqlmodel import Session, text
+
+
+def get_thread_name(thread_id: str, session: Session) -> str | None:
+    """
+    Retrieve the name of a chat thread, without loading its steps and elements like the Chainlit data layer does.
+
+    Args:
+        thread_id (str): The ID of the thread.
+        session (Session): The SQLAlchemy session to use for the query.
+
+    Returns:
+        str | None: The name of the thread, or None if it has no name (or does not exist).
+    """
+    return session.exec(text('SELECT "name" FROM "Thread" WHERE "id" = :thread_id').bindparams(thread_id=thread_id)).scalar_one_or_none()
@@ -1,6 +1,14 @@
-from sqlmodel import Session, select, text
+import datetime
 
-from .models import UserConnection
+from sqlalchemy import column, table
+from sqlmodel import Session, delete, select
+
+from .models import UserConnection, UserConnectionThread
+
+THREAD_DELETE_BATCH_SIZE = 500  # The threads of a deleted connection are deleted this many at a time, so that no transaction holds too many locks
+
+# The threads table of the Chainlit data layer, which has no model
+_THREAD_TABLE = table("Thread", column("id"))
 
 
 def get_user_connections_by_email(email: str, session: Session) -> list[UserConnection]:
@@ -17,6 +25,99 @@ def get_user_connections_by_email(email: str, session: Session) -> list[UserConn
     return session.exec(select(UserConnection).where(UserConnection.user_email == email)).all() or []
 
 
+def get_recent_user_connections(email: str, limit: int, session: Session) -> list[UserConnection]:
+    """
+    Retrieve the most recently used connections of a user.
+
+    Args:
+        email (str): The email address of the user.
+        limit (int): The maximum number of connections to retrieve.
+        session (Session): The SQLAlchemy session to use for the query.
+
+    Returns:
+        list[UserConnection]: The connections, most recently used first (connections never used count as used when they were created).
+    """
+    statement = select(UserConnection).where(UserConnection.user_email == email).order_by(UserConnection.last_used_at.desc()).limit(limit)
+    return session.exec(statement).all() or []
+
+
+def mark_user_connection_used(server_name: str, user_email: str, session: Session) -> None:
+    """
+    Record that a user connection has just been used, i.e. selected to work with.
+
+    Args:
+        server_name (str): The name of the server of the connection.
+        user_email (str): The email of the user the connection belongs to.
+        session (Session): The SQLAlchemy session to use for the update.
+    """
+    user_connection = get_user_connection_by_server_name(server_name, user_email, session)
+    if not user_connection:
+        return
+
+    user_connection.last_used_at = datetime.datetime.now()  # noqa: DTZ005 # Naive, like the other timestamps of the table
+    session.add(user_connection)
+    session.commit()
+
+
+def get_user_connection_by_id(connection_id: str, user_email: str, session: Session) -> UserConnection | None:
+    """
+    Retrieve a user connection by its ID, as long as it belongs to the given user.
+
+    Args:
+        connection_id (str): The ID of the connection.
+        user_email (str): The email of the user the connection belongs to.
+        session (Session): The SQLAlchemy session to use for the query.
+
+    Returns:
+        UserConnection | None: The UserConnection found, or None if the user has no such connection.
+    """
+    return session.exec(
+        select(UserConnection).where(
+            UserConnection.id == connection_id,
+            UserConnection.user_email == user_email,
+        ),
+    ).first()
+
+
+def get_user_connection_by_server_name(server_name: str, user_email: str, session: Session) -> UserConnection | None:
+    """
+    Retrieve a user connection by its server name and user email.
+
+    Args:
+        server_name (str): The name of the server of the connection.
+        user_email (str): The email of the user the connection belongs to.
+        session (Session): The SQLAlchemy session to use for the query.
+
+    Returns:
+        UserConnection | None: The UserConnection found, or None if there is no such connection.
+    """
+    return session.exec(
+        select(UserConnection).where(
+            UserConnection.server_name == server_name,
+            UserConnection.user_email == user_email,
+        ),
+    ).first()
+
+
+def get_conn_info(user_connection: UserConnection) -> dict:
+    """
+    Build the connection information used by the database controllers out of a stored user connection.
+
+    Args:
+        user_connection (UserConnection): The stored user connection.
+
+    Returns:
+        dict: The connection information, including the type of connection, the SSH and TCP details, the read replicas and the type of database.
+    """
+    return {
+        "type": "ssh" if user_connection.ssh_connection_info else "tcp",
+        "ssh": user_connection.ssh_connection_info,
+        "tcp": user_connection.tcp_connection_info,
+        "replicas": user_connection.replica_connection_info or [],
+        "type_of_db": user_connection.type_of_db,
+    }
+
+
 def insert_user_connection(user_connection: UserConnection, session: Session) -> UserConnection:
     """
     Insert a new user connection into the database.
@@ -35,9 +136,58 @@ def insert_user_connection(user_connection: UserConnection, session: Session) ->
     return user_connection  # This user_connection doesn't have an ID yet, but we don't need it
 
 
+def bind_thread_to_connection(connection_id: str, thread_id: str, session: Session, db_schema: str | None = None) -> None:
+    """
+    Record that a chat thread has been used with a connection, so that it is deleted along with it
+    (and resumed with it, along with the schema selected in it).
+
+    Args:
+        connection_id (str): The ID of the connection.
+        thread_id (str): The ID of the thread, as given by Chainlit.
+        session (Session): The SQLAlchemy session to use for the insertion.
+        db_schema (str | None): The schema selected in the thread, or None to keep the one recorded (if any).
+    """
+    binding = session.get(UserConnectionThread, (connection_id, thread_id))
+
+    if binding is None:
+        binding = UserConnectionThread(connection_id=connection_id, thread_id=thread_id, db_schema=db_schema)
+    elif db_schema is None or binding.db_schema == db_schema:
+        return
+    else:
+        binding.db_schema = db_schema
+
+    session.add(binding)
+    session.commit()
+
+
+def get_thread_binding(thread_id: str, user_email: str, session: Session) -> tuple[UserConnection, str | None] | None:
+    """
+    Retrieve the connection a chat thread of a user has last been bound to, along with the schema selected in the thread.
+
+    Args:
+        thread_id (str): The ID of the thread, as given by Chainlit.
+        user_email (str): The email of the user, who has to own the connection.
+        session (Session): The SQLAlchemy session to use for the query.
+
+    Returns:
+        tuple[UserConnection, str | None] | None: The connection and the schema (None if no schema has been selected),
+        or None if the thread is not bound to any connection of the user.
+    """
+    return session.exec(
+        select(UserConnection, UserConnectionThread.db_schema)
+        .join(UserConnectionThread, UserConnectionThread.connection_id == UserConnection.id)
+        .where(
+            UserConnectionThread.thread_id == thread_id,
+            UserConnection.user_email == user_email,
+        )
+        .order_by(UserConnectionThread.created_at.desc())
+        .limit(1),
+    ).first()
+
+
 def delete_user_connection_by_server_name(server_name: str, user_email: str, session: Session) -> UserConnection:
     """
-    Delete a user connection by its server name and user email.
+    Delete a user connection by its server name and user email, along with the chat threads that have been used with it.
 
     Args:
         server_name (str): The name of the server to delete the connection for.
@@ -55,14 +205,35 @@ def delete_user_connection_by_server_name(server_name: str, user_email: str, ses
     ).one()
 
     if user_connection:
-        user_id_query = text(f'SELECT "id" FROM public."User" WHERE "identifier" = \'{user_email}\'')
-        user_id = session.exec(user_id_query).one()
-        user_id = user_id[0]  # Extract the user ID from the tuple
-        thread_delete_statement = text(f'DELETE FROM public."Thread" WHERE "userId" = \'{user_id}\' AND "name" LIKE \'%{server_name}%\'')
-        session.exec(thread_delete_statement)
+        _delete_threads_of_connection(str(user_connection.id), session)
 
+        # The bindings of the connection (if any are left) are deleted along with it
         session.delete(user_connection)
 
     session.commit()
 
     return user_connection
+
+
+def _delete_threads_of_connection(connection_id: str, session: Session) -> None:
+    """
+    Delete the chat threads bound to a connection in batches, looking them up by the primary key of the bindings.
+    The steps and elements of the threads, as well as the bindings themselves, are deleted by the cascades of the foreign keys.
+
+    Args:
+        connection_id (str): The ID of the connection.
+        session (Session): The SQLAlchemy session to use for the deletion.
+    """
+    thread_batch = (
+        select(UserConnectionThread.thread_id)
+        .where(UserConnectionThread.connection_id == connection_id)
+        .limit(THREAD_DELETE_BATCH_SIZE)
+        .scalar_subquery()
+    )
+
+    while True:
+        result = session.exec(delete(_THREAD_TABLE).where(_THREAD_TABLE.c.id.in_(thread_batch)))
+        session.commit()
+
+        if result.rowcount < THREAD_DELETE_BATCH_SIZE:
+            return
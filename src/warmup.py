@@ -0,0 +1,100 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cachetools import TTLCache
+from sqlmodel import Session, create_engine
+
+import connection_pool
+import schema_cache
+from execution_configs import WARMUP_CONNECTIONS_PER_USER, WARMUP_COOLDOWN, WARMUP_MAX_CONCURRENT, WARMUP_MAX_POOLS
+from user_controllers import user_connections
+
+logger: logging.Logger = logging.getLogger("webtext2sql")
+
+# The warm-ups run in the background, at most `WARMUP_MAX_CONCURRENT` at a time per worker (the rest wait in the executor's queue)
+_executor = ThreadPoolExecutor(max_workers=WARMUP_MAX_CONCURRENT, thread_name_prefix="webtext2sql-warmup")
+
+# The users whose connections have been warmed up recently, since logging in and starting a chat both trigger a warm-up
+_recently_warmed_up: TTLCache[str, bool] = TTLCache(maxsize=4096, ttl=WARMUP_COOLDOWN)
+_recently_warmed_up_lock = threading.Lock()
+
+
+def schedule_warmup(user_email: str) -> None:
+    """
+    Open the most recently used connections of a user in advance (and fetch their schemas), in the background.
+    This way, the user does not wait for the SSH tunnel, the connection and the schema list when they choose a connection.
+    It does nothing if the user's connections have been warmed up in the last `WARMUP_COOLDOWN` seconds.
+
+    Args:
+        user_email (str): The email of the user.
+    """
+    with _recently_warmed_up_lock:
+        if user_email in _recently_warmed_up:
+            return
+        _recently_warmed_up[user_email] = True
+
+    _executor.submit(_warm_up_user_connections, user_email)
+
+
+def _warm_up_user_connections(user_email: str) -> None:
+    """
+    Open the shared pools of the most recently used connections of a user and fetch their schemas.
+    Failures are only logged, since the connections are opened again when they are actually needed.
+
+    Args:
+        user_email (str): The email of the user.
+    """
+    db_engine = create_engine(os.getenv("DATABASE_URL"))
+
+    with Session(db_engine) as session:
+        recent_connections = user_connections.get_recent_user_connections(user_email, WARMUP_CONNECTIONS_PER_USER, session)
+
+    for user_connection in recent_connections:
+        if connection_pool.count_shared_pools() >= WARMUP_MAX_POOLS:
+            logger.debug("Skipping the warm-up of connections, too many connections are already open")
+            return
+
+        try:
+            schema_cache.refresh_available_schemas(user_connections.get_conn_info(user_connection))
+        except Exception:  # noqa: BLE001
+            logger.warning(f"Failed to warm up the connection {user_connection.server_name} of user: {user_email}")
+            continue
+
+        logger.debug(f"Warmed up the connection {user_connection.server_name} of user: {user_email}")
+
+
+def schedule_schema_warmup(conn_info: dict, schema: str) -> None:
+    """
+    Open the shared pool of a connection in advance and fetch the metadata of a schema through it, in the background.
+    This way, the first question asked in a resumed thread does not wait for the SSH tunnel, the connection and the introspection.
+
+    Args:
+        conn_info (dict): The connection information.
+        schema (str): The schema selected in the thread.
+    """
+    _executor.submit(_warm_up_schema, conn_info, schema)
+
+
+def _warm_up_schema(conn_info: dict, schema: str) -> None:
+    """
+    Fetch the metadata of a schema through the shared pool of its connection, which caches it.
+    Failures are only logged, since the metadata is fetched again when it is actually needed.
+
+    Args:
+        conn_info (dict): The connection information.
+        schema (str): The schema to fetch the metadata of.
+    """
+    if connection_pool.count_shared_pools() >= WARMUP_MAX_POOLS:
+        logger.debug("Skipping the warm-up of a schema, too many connections are already open")
+        return
+
+    try:
+        with connection_pool.get_shared_pool(conn_info).lease() as db_controller:
+            db_controller.get_db_metadata(schema=schema)
+    except Exception:  # noqa: BLE001
+        logger.warning(f"Failed to warm up the schema: {schema}")
+        return
+
+    logger.debug(f"Warmed up the schema: {schema}")
@@ -0,0 +1,180 @@
+import datetime
+import functools
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import Engine
+from sqlmodel import Session, create_engine
+
+import metrics
+import str_manipulation
+from execution_configs import WORKLOAD_BATCH_SIZE, WORKLOAD_FLUSH_INTERVAL, WORKLOAD_MAX_PENDING, WORKLOAD_SIZE_SAMPLE_ROWS, WORKLOAD_TRACKING
+from user_controllers import query_workload
+
+logger: logging.Logger = logging.getLogger("webtext2sql")
+
+# What the queries executed by the current task are about, as set by the entry points (chat, batch, API) and the AI controller.
+# It is a mutable dictionary, so that what is recorded after it is set (e.g. the latency of the AI model) is seen by the worker threads too.
+_context: ContextVar[dict | None] = ContextVar("workload_context", default=None)
+
+# The executions waiting to be written, by a single thread per worker
+_pending: queue.Queue[dict] = queue.Queue(maxsize=WORKLOAD_MAX_PENDING)
+_writer_lock = threading.Lock()
+_writer: threading.Thread | None = None
+
+
+def set_context(schema: str | None, connection_id: str | None) -> None:
+    """
+    Set the schema and the user connection of the queries executed by the current task (and the tasks and threads it starts),
+    e.g. for the question being answered.
+
+    Args:
+        schema (str | None): The database schema the queries are executed against.
+        connection_id (str | None): The ID of the user connection (`USER_CONNECTIONS`) the queries are executed through.
+    """
+    _context.set({"schema": schema, "connection_id": connection_id, "llm_latency_ms": None})
+
+
+def set_llm_latency(latency_ms: float) -> None:
+    """
+    Record how long it took the AI model to generate (or repair) the query that the current task executes next.
+
+    Args:
+        latency_ms (float): The latency of the AI model in milliseconds.
+    """
+    context = _context.get()
+    if context is not None:
+        context["llm_latency_ms"] = latency_ms
+
+
+def record_execution(  # noqa: PLR0913
+    query: str,
+    *,
+    connection_identity: str,
+    duration_ms: float,
+    row_count: int | None = None,
+    byte_count: int | None = None,
+    error: Exception | None = None,
+) -> None:
+    """
+    Record an execution of a generated query, to be written to the app database in the background along with the others.
+    Executions are dropped rather than held up when the writer falls behind.
+
+    Args:
+        query (str): The SQL query, as generated (it is normalized in the background).
+        connection_identity (str): The identity of the database (and credentials) the query was executed on.
+        duration_ms (float): The time the execution took in milliseconds.
+        row_count (int | None): The number of rows of the results, if the query succeeded.
+        byte_count (int | None): The estimated size of the results in bytes, if the query succeeded.
+        error (Exception | None): The error raised by the driver, if the query failed.
+    """
+    if not WORKLOAD_TRACKING:
+        return
+
+    context = _context.get() or {}
+
+    _ensure_writer()
+
+    try:
+        _pending.put_nowait(
+            {
+                "executed_at": datetime.datetime.now(),  # noqa: DTZ005 # Naive, like the other timestamps of the app database
+                "query": query,
+                "connection_id": context.get("connection_id"),
+                "connection_identity": connection_identity,
+                "db_schema": context.get("schema"),
+                "duration_ms": duration_ms,
+                "row_count": row_count,
+                "byte_count": byte_count,
+                "error_class": type(error).__name__ if error else None,
+                "llm_latency_ms": context.get("llm_latency_ms"),
+            },
+        )
+    except queue.Full:
+        metrics.increment("workload.dropped")
+
+
+def estimate_size(rows: list[tuple] | tuple[tuple, ...]) -> int:
+    """
+    Estimate the size in bytes of a batch of rows out of the text representation of the values of its first rows.
+
+    Args:
+        rows (list[tuple] | tuple[tuple, ...]): The rows.
+
+    Returns:
+        int: The estimated size of the rows in bytes.
+    """
+    sample = rows[:WORKLOAD_SIZE_SAMPLE_ROWS]
+    if not sample:
+        return 0
+
+    sample_size = sum(len(str(value)) for row in sample for value in row if value is not None)
+    return sample_size * len(rows) // len(sample)
+
+
+def fingerprint(normalized_query: str) -> str:
+    """
+    Get the fingerprint of a normalized query, compact enough to be indexed.
+
+    Args:
+        normalized_query (str): The query, as normalized by `str_manipulation.normalize_sql_fingerprint`.
+
+    Returns:
+        str: The fingerprint in hex.
+    """
+    return hashlib.blake2b(normalized_query.encode(), digest_size=16).hexdigest()
+
+
+@functools.cache
+def _get_engine() -> Engine:
+    return create_engine(os.getenv("DATABASE_URL"))
+
+
+def _ensure_writer() -> None:
+    global _writer  # noqa: PLW0603
+
+    if _writer is not None:
+        return
+
+    with _writer_lock:
+        if _writer is None:
+            # A daemon thread, so the executions still pending when the worker exits are lost
+            _writer = threading.Thread(target=_write_pending, name="webtext2sql-workload", daemon=True)
+            _writer.start()
+
+
+def _write_pending() -> None:
+    """Write the recorded executions to the app database, in batches of up to `WORKLOAD_BATCH_SIZE` at least every `WORKLOAD_FLUSH_INTERVAL` seconds."""
+    while True:
+        batch = [_pending.get()]
+        deadline = time.monotonic() + WORKLOAD_FLUSH_INTERVAL
+
+        while len(batch) < WORKLOAD_BATCH_SIZE:
+            try:
+                batch.append(_pending.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+
+        try:
+            _write_batch(batch)
+            metrics.increment("workload.written", len(batch))
+        except Exception:
+            logger.exception(f"Failed to write {len(batch)} query executions to the app database")
+            metrics.increment("workload.dropped", len(batch))
+
+
+def _write_batch(batch: list[dict]) -> None:
+    executions = []
+
+    for entry in batch:
+        query = entry.pop("query")
+        normalized_query = str_manipulation.normalize_sql_fingerprint(query)
+        executions.append({**entry, "fingerprint": fingerprint(normalized_query), "normalized_query": normalized_query})
+
+    with Session(_get_engine()) as session:
+        query_workload.insert_query_executions(executions, session)
@@ -0,0 +1,81 @@
+"""
+Benchmark the catalog (introspection) queries of the Postgres controller, with and without server-side prepared statements.
+
+The tables and the DDL of every table of the northwind and pagila test schemas are fetched repeatedly over one connection,
+as the metadata of a schema is fetched by a pooled connection. The caches of the controller are bypassed, so that every
+round actually queries the server. Preparing is disabled on the connection for the baseline, so both runs send the same
+parameterized queries and only differ in whether the server parses and plans them again on every execution.
+
+Requires a Postgres server with the test schemas loaded (see tests/SQL/postgres).
+
+Usage (from the repository root):
+    uv run python tools/benchmarks/bench_catalog_queries.py --dsn "host=localhost port=5432 dbname=postgres user=root password=root"
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "src"))
+
+import psycopg
+
+from db_controllers.pg_controller import PostgresController
+
+SCHEMAS = ("northwind", "pagila")
+ROUNDS = 20
+
+
+def fetch_metadata(db_controller: PostgresController, schema: str) -> int:
+    """Fetch the DDL of every table of a schema, bypassing the caches of the controller, and return the number of tables."""
+    table_names = PostgresController._get_db_tables_for_user.__wrapped__(db_controller, schema)  # noqa: SLF001
+    for table_name in table_names:
+        db_controller._get_table_ddl(table_name, schema)  # noqa: SLF001
+    return len(table_names)
+
+
+def run(dsn: str, schema: str, rounds: int, *, prepared: bool) -> tuple[int, list[float]]:
+    """Fetch the metadata of a schema `rounds` times over a new connection and return the number of tables and the time of each round."""
+    db_controller = PostgresController(psycopg.conninfo.conninfo_to_dict(dsn))
+
+    # None disables preparing altogether, even for the queries executed with `prepare=True`
+    db_controller.connection.prepare_threshold = 5 if prepared else None
+
+    try:
+        # The first round prepares the statements, so it is not timed
+        table_count = fetch_metadata(db_controller, schema)
+
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            fetch_metadata(db_controller, schema)
+            timings.append(time.perf_counter() - start)
+    finally:
+        db_controller.close_connection()
+
+    return table_count, timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="libpq connection string of the server with the test schemas")
+    parser.add_argument("--rounds", type=int, default=ROUNDS, help="number of timed rounds per schema and mode")
+    args = parser.parse_args()
+
+    print(f"{'schema':<10} {'tables':>6} {'unprepared':>12} {'prepared':>12} {'saved':>8}")
+
+    for schema in SCHEMAS:
+        table_count, unprepared = run(args.dsn, schema, args.rounds, prepared=False)
+        _, prepared = run(args.dsn, schema, args.rounds, prepared=True)
+
+        unprepared_ms = statistics.median(unprepared) * 1000
+        prepared_ms = statistics.median(prepared) * 1000
+        saved = 1 - prepared_ms / unprepared_ms if unprepared_ms else 0
+
+        print(f"{schema:<10} {table_count:>6} {unprepared_ms:>9.1f} ms {prepared_ms:>9.1f} ms {saved:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark the formatting of query results, before (pandas + tabulate) and after (result_formatting).
+
+Both paths render the markdown preview and the CSV of the same rows, as `form_answer` does.
+
+Usage (from the repository root):
+    uv run python tools/benchmarks/bench_result_formatting.py
+"""
+
+import datetime as dt
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "src"))
+
+import result_formatting
+
+PREVIEW_ROWS = 10
+ROW_COUNTS = (10, 1_000, 100_000)
+REPEATS = 5
+
+COLUMN_NAMES = ("id", "name", "email", "amount", "created_at", "active", "notes", "country")
+
+
+def make_rows(count: int) -> tuple[tuple, ...]:
+    start = dt.datetime(2024, 1, 1, tzinfo=dt.UTC)
+    return tuple(
+        (
+            i,
+            f"customer {i}",
+            f"customer{i}@example.com",
+            Decimal(i) / 7,
+            start + dt.timedelta(minutes=i),
+            i % 2 == 0,
+            None if i % 3 else "some | longer note\nthat spans lines " * 3,
+            "GR",
+        )
+        for i in range(count)
+    )
+
+
+def format_with_pandas(rows: tuple[tuple, ...]) -> tuple[str, str]:
+    import pandas as pd  # noqa: PLC0415
+
+    results_df = pd.DataFrame(rows, columns=COLUMN_NAMES)
+    return results_df.head(PREVIEW_ROWS).to_markdown(index=False), results_df.to_csv(index=False)
+
+
+def format_directly(rows: tuple[tuple, ...]) -> tuple[str, str]:
+    return (
+        result_formatting.format_markdown_table(rows, COLUMN_NAMES, max_rows=PREVIEW_ROWS),
+        result_formatting.format_csv(rows, COLUMN_NAMES),
+    )
+
+
+def measure(func: Callable[[tuple[tuple, ...]], tuple[str, str]], rows: tuple[tuple, ...]) -> tuple[float, float]:
+    """Return the best wall time (ms) and the peak traced memory (KiB) of formatting the rows."""
+    func(rows)  # Warm up imports and caches
+
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func(rows)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best * 1000, peak / 1024
+
+
+def main() -> None:
+    try:
+        import pandas  # noqa: F401, ICN001, PLC0415
+
+        implementations = {"pandas": format_with_pandas, "direct": format_directly}
+    except ImportError:
+        print("pandas is not installed, only the direct formatter is measured")
+        implementations = {"direct": format_directly}
+
+    print(f"{'rows':>8} {'formatter':>10} {'time (ms)':>12} {'peak (KiB)':>12}")
+    for count in ROW_COUNTS:
+        rows = make_rows(count)
+        for name, func in implementations.items():
+            elapsed_ms, peak_kib = measure(func, rows)
+            print(f"{count:>8} {name:>10} {elapsed_ms:>12.2f} {peak_kib:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
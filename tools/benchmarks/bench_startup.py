@@ -0,0 +1,98 @@
+"""
+Benchmark the cold start of a worker, i.e. the time it takes to import the application.
+
+The application is imported in a fresh interpreter with `python -X importtime`, several times,
+and the import profile of the last run is summarized (and optionally saved in full).
+
+Usage (from the repository root):
+    uv run python tools/benchmarks/bench_startup.py [--runs 5] [--profile importtime.txt]
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parents[2] / "src"
+
+# The module Chainlit loads when a worker starts (it also imports `main`)
+TARGET_MODULE = "chainlit_app"
+
+# Modules that should only be imported when they are actually needed
+LAZY_MODULES = ("openai", "sshtunnel", "paramiko", "psycopg", "pymysql", "pyarrow", "pandas", "duckdb")
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)")
+
+# Dummy values for the variables read at import time, so that the benchmark does not need a real .env
+BENCHMARK_ENV = {
+    "OPENAI_API_KEY": "benchmark",
+    "DATABASE_URL": "sqlite://",
+    "SECRET_KEY": "benchmark",
+    "COOKIE_NAME": "benchmark",
+}
+
+
+def import_once() -> tuple[float, str]:
+    """Import the application in a fresh interpreter and return the wall time (s) and the importtime profile."""
+    env = {**BENCHMARK_ENV, **os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+
+    start = time.perf_counter()
+    completed = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-c", f"import {TARGET_MODULE}"],
+        cwd=SRC_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return time.perf_counter() - start, completed.stderr
+
+
+def summarize(profile: str, top: int) -> None:
+    """Print the slowest top-level imports of the application and which of the lazy modules got imported."""
+    entries = []
+    imported = set()
+
+    for match in IMPORTTIME_LINE.finditer(profile):
+        _, cumulative, indent, module = match.groups()
+        imported.add(module)
+        entries.append((int(cumulative), len(indent), module))
+
+    print(f"\nSlowest imports (cumulative, top {top}):")
+    for cumulative, depth, module in sorted(entries, reverse=True)[:top]:
+        print(f"  {cumulative / 1000:>9.1f} ms  {'  ' * (depth // 2)}{module}")
+
+    print("\nModules that should load lazily:")
+    for module in LAZY_MODULES:
+        print(f"  {module:<10} {'imported' if module in imported else 'not imported'}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="number of cold imports to time")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest imports to show")
+    parser.add_argument("--profile", type=Path, help="file to save the full importtime profile of the last run to")
+    args = parser.parse_args()
+
+    timings = []
+    profile = ""
+    for _ in range(args.runs):
+        elapsed, profile = import_once()
+        timings.append(elapsed)
+
+    print(f"Cold import of {TARGET_MODULE} over {args.runs} runs:")
+    print(f"  median {statistics.median(timings) * 1000:.0f} ms, min {min(timings) * 1000:.0f} ms, max {max(timings) * 1000:.0f} ms")
+
+    summarize(profile, args.top)
+
+    if args.profile:
+        args.profile.write_text(profile)
+        print(f"\nFull profile saved to {args.profile}")
+
+
+if __name__ == "__main__":
+    main()